@@ -0,0 +1,104 @@
+import time
+import queue
+import asyncio
+import threading
+import traceback
+
+from transport import aclose_async_client
+
+
+class BackgroundLoop:
+    """
+    Runs an asyncio event loop in a daemon thread for all network and disk work of a GUI, and hands
+    results back to the render loop through a queue.
+
+    Coroutines go to submit(), blocking functions to run_in_thread() (the loop's default executor).
+    Their `on_done` callbacks, and anything passed to post(), are queued instead of run where the work
+    finished; the render loop runs them with drain() between frames, so DearPyGui items are only touched
+    from the render thread and a slow download never holds up a frame.
+
+        background = BackgroundLoop().start()
+        background.submit(fetch_page(), on_done=show_page)
+        while dpg.is_dearpygui_running():
+            background.drain()
+            dpg.render_dearpygui_frame()
+        background.stop()
+    """
+
+    def __init__(self, name: str = "background-loop"):
+        self.loop = asyncio.new_event_loop()
+        self._ui_queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            pending = asyncio.all_tasks(self.loop)
+            for task in pending:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            self.loop.run_until_complete(aclose_async_client())
+            self.loop.close()
+
+    def start(self):
+        if not self._thread.is_alive():
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 5.0):
+        if self._thread.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout)
+
+    def submit(self, coroutine, *, on_done=None):
+        """
+        Schedules `coroutine` on the background loop from any thread.
+
+        Args:
+            on_done (callable, optional): Called on the render thread with the finished future.
+
+        Returns:
+            concurrent.futures.Future: The future of the coroutine's result.
+        """
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        if on_done is not None:
+            future.add_done_callback(lambda done: self.post(on_done, done))
+        return future
+
+    def run_in_thread(self, function, *args, on_done=None, **kwargs):
+        """
+        Runs a blocking `function(*args, **kwargs)` in the background loop's executor, see submit().
+        """
+        return self.submit(asyncio.to_thread(function, *args, **kwargs), on_done=on_done)
+
+    def post(self, callback, *args):
+        """
+        Queues `callback(*args)` to run on the render thread at the next drain(). Safe from any thread.
+        """
+        self._ui_queue.put((callback, args))
+
+    def drain(self, budget: float = 0.004):
+        """
+        Runs queued callbacks until the queue is empty or `budget` seconds have passed, so a burst of
+        results is spread over several frames.
+
+        Returns:
+            int: The number of callbacks run.
+        """
+        deadline = time.perf_counter() + budget
+        ran = 0
+        while True:
+            try:
+                callback, args = self._ui_queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                callback(*args)
+            except Exception:
+                traceback.print_exc()
+            ran += 1
+            if time.perf_counter() >= deadline:
+                break
+        return ran
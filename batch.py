@@ -0,0 +1,248 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from cache import HTTP_CACHE
+from config import Config
+from download import (DownloadManager, STICKER_FILE_WORKERS, download_sticker_files, download_sticker_pack,
+                      parse_sticker_id)
+from jobs import Heartbeat, JobQueue, worker_name
+from metrics import METRICS, write_metrics
+from mirrors import MIRROR_STATS
+from progress import ProgressTracker, ProgressSampler
+from retry import MIRROR_BREAKERS
+from transport import TRANSPORT_SETTINGS, configure, host_limits
+from utils import logger
+
+logger = logger('Batch Downloader', to_file=False)
+
+
+def read_sticker_ids(lines):
+    """
+    Turns free-form lines (IDs, store links, blank lines, # comments) into a de-duplicated list of sticker IDs.
+    """
+    sticker_ids = []
+    seen = set()
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        for token in line.replace(",", " ").split():
+            sticker_id = parse_sticker_id(token)
+            if sticker_id and sticker_id not in seen:
+                seen.add(sticker_id)
+                sticker_ids.append(sticker_id)
+    return sticker_ids
+
+
+def read_sticker_ids_file(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        return read_sticker_ids(f)
+
+
+class BatchDownloader:
+    """
+    Downloads many sticker packs concurrently over one shared client.
+
+    Every pack goes through download.download_sticker_pack, the same flow the GUI uses for a single ID, or
+    through download.download_sticker_files when config.sticker_files selects single sticker files.
+    """
+
+    def __init__(self, config: Config = None, *, workers: int = 4, output_dir: str = "output", http_cache=HTTP_CACHE,
+                 hedge_after: float = None):
+        self.config = config or Config()
+        self.workers = max(1, workers)
+        self.output_dir = output_dir
+        self.http_cache = http_cache
+        self.hedge_after = hedge_after
+        self.progress = ProgressTracker()
+
+    def _download_one(self, client, sticker_id: str):
+        download = download_sticker_files if self.config.sticker_files else download_sticker_pack
+        try:
+            return download(client, sticker_id, self.config, output_dir=self.output_dir,
+                            http_cache=self.http_cache, hedge_after=self.hedge_after,
+                            progress=self.progress)
+        except Exception as err:
+            logger.error(f"Exception while downloading {sticker_id}: {err}")
+            return {"sticker_id": sticker_id, "ok": False, "error": str(err)}
+
+    def run(self, sticker_ids, *, on_result=None):
+        """
+        Downloads every sticker ID in `sticker_ids`. Progress of the run can be sampled from self.progress.
+
+        Args:
+            sticker_ids (list): Sticker IDs or store links.
+            on_result (callable, optional): Called with each result dict as soon as its pack finishes.
+
+        Returns:
+            list: One result dict per sticker ID, in input order.
+        """
+        sticker_ids = read_sticker_ids(sticker_ids)
+        results = {}
+        self.progress.reset()
+        with DownloadManager() as client, ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self._download_one, client, sticker_id): sticker_id
+                       for sticker_id in sticker_ids}
+            for future in as_completed(futures):
+                result = future.result()
+                results[futures[future]] = result
+                if result["ok"]:
+                    logger.info(f"Downloaded {result['sticker_id']} -> {result['filename']}")
+                else:
+                    logger.error(f"Failed {result['sticker_id']}: {result['error']}")
+                if on_result:
+                    on_result(result)
+        return [results[sticker_id] for sticker_id in sticker_ids]
+
+    def _drain(self, client, queue: JobQueue, worker: str, on_result):
+        results = []
+        while (job := queue.claim(worker)) is not None:
+            sticker_id = job["sticker_id"]
+            result = self._download_one(client, sticker_id)
+            if result["ok"]:
+                queue.complete(sticker_id)
+                logger.info(f"Downloaded {sticker_id} -> {result['filename']}")
+            else:
+                result["state"] = queue.fail(sticker_id, result["error"])
+                retry = ""
+                if result["state"] == "queued":
+                    retry = f", queued again ({job['attempts']}/{queue.max_attempts})"
+                logger.error(f"Failed {sticker_id}: {result['error']}{retry}")
+            results.append(result)
+            if on_result:
+                on_result(result)
+        return results
+
+    def run_queue(self, queue: JobQueue, *, on_result=None):
+        """
+        Downloads jobs from `queue` until it is empty. Other processes may drain the same queue at the same
+        time; jobs left running by a process that stopped renewing their lease are queued again.
+
+        Args:
+            queue (JobQueue): The job queue.
+            on_result (callable, optional): Called with each result dict as soon as its pack finishes.
+
+        Returns:
+            list: One result dict per attempt made by this process, in completion order.
+        """
+        recovered = queue.recover()
+        if recovered:
+            logger.info(f"Resuming {recovered} jobs left running by a stopped worker")
+        self.progress.reset()
+        worker = worker_name()
+        with Heartbeat(queue, worker), DownloadManager() as client, \
+                ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self._drain, client, queue, f"{worker}:{index}", on_result)
+                       for index in range(self.workers)]
+            return [result for future in futures for result in future.result()]
+
+
+def _log_progress(snapshot: dict):
+    limits = ", ".join(f"{host} {limit['in_flight']}/{limit['concurrency']} at {limit['rate']}/s"
+                       for host, limit in host_limits().items())
+    logger.info(f"Progress: {snapshot['done']} done, {snapshot['failed']} failed, {snapshot['active']} active, "
+                f"{snapshot['downloaded'] / 1024 / 1024:.1f}/{snapshot['total'] / 1024 / 1024:.1f} MiB, "
+                f"{snapshot['bytes_per_second'] / 1024 / 1024:.2f} MiB/s, host limits: {limits}")
+
+
+def export_metrics(json_path: str = None, prometheus_path: str = None):
+    """
+    Copies the mirror averages into METRICS gauges and writes the metrics to the given files.
+    """
+    for host, stats in MIRROR_STATS.snapshot().items():
+        if stats["latency"] is not None:
+            METRICS.set("mirror_latency_ewma_seconds", stats["latency"], host=host)
+        METRICS.set("mirror_error_rate_ewma", stats["error_rate"], host=host)
+    if json_path:
+        write_metrics(json_path, fmt="json")
+    if prometheus_path:
+        write_metrics(prometheus_path, fmt="prometheus")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Download many LINE sticker packs without the GUI.")
+    parser.add_argument("ids", nargs="*", help="Sticker IDs or store links")
+    parser.add_argument("-f", "--file", help="File with one sticker ID or link per line")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="Number of concurrent downloads")
+    parser.add_argument("-p", "--platform", choices=list(Config.PLATFORM_LIST.keys()), default="iphone")
+    parser.add_argument("-o", "--output", default="output", help="Output folder")
+    parser.add_argument("--connections-per-host", type=int, default=TRANSPORT_SETTINGS["max_connections_per_host"],
+                        help="Upper bound of the adaptive number of requests in flight per host")
+    parser.add_argument("--max-rate-per-host", type=float,
+                        default=TRANSPORT_SETTINGS["max_requests_per_second_per_host"],
+                        help="Upper bound of the adaptive requests per second per host")
+    parser.add_argument("--files", type=lambda value: value.split(","), metavar="TYPE[,TYPE]",
+                        help="Fetch single sticker files instead of pack zips: 'auto' or any of "
+                             f"{', '.join(Config.TYPES_STICKER_FILE)}. Files already on disk are skipped")
+    parser.add_argument("--only", nargs="+", metavar="STICKER", help="With --files, only these sticker IDs")
+    parser.add_argument("-q", "--queue", metavar="DB",
+                        help="Keep the IDs in this persistent job queue and download from it. A run that was "
+                             "stopped resumes where it left off; several processes may share one queue")
+    parser.add_argument("--priority", type=int, default=0, help="With --queue, priority of the given IDs")
+    parser.add_argument("--redo", action="store_true", help="With --queue, download IDs that are already done again")
+    parser.add_argument("--no-cache", action="store_true", help="Always refetch metadata and packs")
+    parser.add_argument("--progress-interval", type=float, default=2.0,
+                        help="Seconds between progress log lines")
+    parser.add_argument("--hedge-after", type=float, default=None,
+                        help="Race the next CDN mirror after this many seconds without a response")
+    parser.add_argument("--metrics-json", help="Write request, cache and disk metrics to this JSON file")
+    parser.add_argument("--metrics-prom", help="Write the same metrics in Prometheus text format to this file")
+    args = parser.parse_args(argv)
+
+    sticker_ids = list(args.ids)
+    if args.file:
+        sticker_ids += read_sticker_ids_file(args.file)
+    if not sticker_ids and not args.queue:
+        parser.error("no sticker IDs given")
+
+    configure(max_connections_per_host=args.connections_per_host,
+              initial_connections_per_host=min(args.connections_per_host,
+                                               TRANSPORT_SETTINGS["initial_connections_per_host"]),
+              max_requests_per_second_per_host=args.max_rate_per_host,
+              # A hedged request and its race, for every fetch the workers may have in flight
+              hedge_workers=max(TRANSPORT_SETTINGS["hedge_workers"],
+                                2 * args.workers * (STICKER_FILE_WORKERS if args.files else 1)))
+
+    config = Config()
+    config.platform = Config.PLATFORM_LIST[args.platform]
+    if args.files:
+        unknown = set(args.files) - set(Config.TYPES_STICKER_FILE) - {"auto"}
+        if unknown:
+            parser.error(f"unknown sticker file types: {', '.join(sorted(unknown))}")
+        config.sticker_files = args.files
+        config.sticker_ids = args.only
+    elif args.only:
+        parser.error("--only needs --files")
+
+    batch_downloader = BatchDownloader(config, workers=args.workers, output_dir=args.output,
+                                       http_cache=None if args.no_cache else HTTP_CACHE,
+                                       hedge_after=args.hedge_after)
+
+    def _on_progress(snapshot: dict):
+        _log_progress(snapshot)
+        export_metrics(args.metrics_json, args.metrics_prom)
+
+    queue = None
+    if args.queue:
+        queue = JobQueue(args.queue)
+        added = queue.submit(read_sticker_ids(sticker_ids), priority=args.priority, redo=args.redo)
+        logger.info(f"Queued {added} new jobs, queue: {queue.counts()}")
+
+    with ProgressSampler(batch_downloader.progress, args.progress_interval, _on_progress):
+        if queue:
+            results = batch_downloader.run_queue(queue)
+        else:
+            results = batch_downloader.run(sticker_ids)
+    failed = [result for result in results if not result["ok"] and result.get("state", "failed") == "failed"]
+    logger.info(f"Finished: {sum(result['ok'] for result in results)} downloaded, {len(failed)} failed")
+    if queue:
+        logger.info(f"Job queue: {queue.counts()}")
+        queue.close()
+    logger.info(f"Mirror stats: {MIRROR_STATS.snapshot()}")
+    logger.info(f"Host limits: {host_limits()}")
+    logger.info(f"Circuit breakers: {MIRROR_BREAKERS.snapshot()}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,423 @@
+"""
+Local stand-in for the LINE store and sticker CDN, for benchmarks that must not touch the real servers.
+
+Serves, for any product ID, deterministic content under the same paths as the real hosts:
+
+    /stickershop/v1/product/<id>/<platform>/productInfo.meta      pack metadata (JSON)
+    /stickershop/v1/product/<id>/<platform>/<Config.TYPES_STICKER> pack zips of APNG/PNG stickers
+    /products/0/0/1/<id>/<platform>/...                           the same, under the fallback mirror's layout
+    /stickershop/v1/sticker/<sticker id>/<platform>/<file>         single sticker files (Config.TYPES_STICKER_FILE)
+    /stickershop/v1/product/<id>/LINEStorePC/main.png             showcase thumbnails
+    /stickershop/showcase/top/en?page=<n>                         showcase pages of 36 products
+
+Latency, bandwidth, server errors, dropped connections and 429 throttling are configurable. Range requests and
+ETag / Last-Modified revalidation behave like the CDN's.
+
+RedirectTransport points an httpx client at the server without changing any URL in the app.
+"""
+import io
+import os
+import re
+import sys
+import html
+import json
+import time
+import zlib
+import random
+import struct
+import socket
+import hashlib
+import zipfile
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+SHOWCASE_PAGE_SIZE = 36
+SEND_CHUNK_SIZE = 16 * 1024
+
+PACK_PATH = re.compile(r"^/(?:stickershop/v1/product|products/0/0/1)/(\d+)/(\w+)/([^/]+)$")
+STICKER_PATH = re.compile(r"^/stickershop/v1/sticker/(\d+)/(\w+)/(.+)$")
+THUMBNAIL_PATH = re.compile(r"^/stickershop/v1/product/(\d+)/LINEStorePC/main\.png$")
+SHOWCASE_PATH = "/stickershop/showcase/top/en"
+
+
+def _chunk(chunk_type: bytes, data: bytes):
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+
+def make_png(width: int, height: int, seed: int, frames: int = 1):
+    """
+    Builds an RGBA PNG of noise, animated (APNG) when `frames` > 1. Noise keeps the zips about as large as
+    the pixel data, like real sticker packs.
+    """
+    rng = random.Random(seed)
+    row_size = width * 4
+
+    def _frame_data():
+        raw = b"".join(b"\x00" + rng.randbytes(row_size) for _ in range(height))
+        return zlib.compress(raw, 1)
+
+    chunks = [_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))]
+    if frames > 1:
+        chunks.append(_chunk(b"acTL", struct.pack(">II", frames, 0)))
+    sequence = 0
+    for frame in range(frames):
+        if frames > 1:
+            chunks.append(_chunk(b"fcTL", struct.pack(">IIIIIHHBB", sequence, width, height, 0, 0, 1, 10, 0, 0)))
+            sequence += 1
+        if frame == 0:
+            chunks.append(_chunk(b"IDAT", _frame_data()))
+        else:
+            chunks.append(_chunk(b"fdAT", struct.pack(">I", sequence) + _frame_data()))
+            sequence += 1
+    chunks.append(_chunk(b"IEND", b""))
+    return PNG_SIGNATURE + b"".join(chunks)
+
+
+class FakeLineCDN:
+    """
+    Threaded HTTP/1.1 server with keep-alive, started with start() or as a context manager.
+
+    Args:
+        latency (float, optional): Seconds to wait before answering each request. Defaults to 0.
+        bandwidth (float, optional): Bytes per second each response body is sent at. Defaults to unlimited.
+        error_rate (float, optional): Fraction of requests answered with 503. Defaults to 0.
+        drop_rate (float, optional): Fraction of body responses cut off halfway through. Defaults to 0.
+        throttle_above (int, optional): Requests in flight above which new ones get 429 with Retry-After.
+            Defaults to no throttling.
+        retry_after (int, optional): Retry-After seconds sent with a 429. Defaults to 1.
+        stickers_per_pack (int, optional): Stickers in each pack zip. Defaults to 8.
+        sticker_size (int, optional): Width and height of sticker images. Defaults to 120.
+        frames (int, optional): Frames of each animated sticker. Defaults to 4.
+        resource_types (tuple, optional): stickerResourceType values, cycled over product IDs.
+        seed (int, optional): Seed of the error and content generators. Defaults to 0.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, *, latency: float = 0.0, bandwidth: float = None,
+                 error_rate: float = 0.0, drop_rate: float = 0.0, throttle_above: int = None, retry_after: int = 1,
+                 stickers_per_pack: int = 8, sticker_size: int = 120, frames: int = 4,
+                 resource_types: tuple = ("ANIMATION",), seed: int = 0):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.throttle_above = throttle_above
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.stickers_per_pack = stickers_per_pack
+        self.sticker_size = sticker_size
+        self.frames = frames
+        self.resource_types = resource_types
+        self.seed = seed
+        self.last_modified = formatdate(time.time() - 3600, usegmt=True)
+        self.stats = {"requests": 0, "bytes_sent": 0, "errors": 0, "drops": 0, "not_modified": 0, "partial": 0,
+                      "throttled": 0}
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._bodies = {}
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+        return False
+
+    def _roll(self, rate: float):
+        if rate <= 0:
+            return False
+        with self._lock:
+            return self._random.random() < rate
+
+    def _count(self, **counts):
+        with self._lock:
+            for key, value in counts.items():
+                self.stats[key] += value
+
+    # Content
+
+    def resource_type(self, product_id: int):
+        return self.resource_types[product_id % len(self.resource_types)]
+
+    def sticker_ids(self, product_id: int):
+        return [product_id * 1000 + index for index in range(self.stickers_per_pack)]
+
+    def metadata(self, product_id: int):
+        return {
+            "packageId": product_id,
+            "onSale": True,
+            "validDays": 0,
+            "title": {"en": f"Benchmark Pack {product_id}"},
+            "author": {"en": "Fake CDN"},
+            "price": [{"country": "@@", "currency": "NLC", "symbol": "NLC", "price": 50.0}],
+            "stickers": [{"id": sticker_id, "width": self.sticker_size, "height": self.sticker_size}
+                         for sticker_id in self.sticker_ids(product_id)],
+            "hasAnimation": self.resource_type(product_id) != "STATIC",
+            "hasSound": self.resource_type(product_id) == "ANIMATION_SOUND",
+            "stickerResourceType": self.resource_type(product_id),
+        }
+
+    def pack_zip(self, product_id: int, variant: str):
+        size = self.sticker_size
+        animated = variant != Config.TYPES_STICKER[0] and self.resource_type(product_id) != "STATIC"
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as zip_ref:
+            zip_ref.writestr("productInfo.meta", json.dumps(self.metadata(product_id)))
+            zip_ref.writestr("tab_on@2x.png", make_png(32, 32, product_id))
+            zip_ref.writestr("tab_off@2x.png", make_png(32, 32, product_id + 1))
+            for sticker_id in self.sticker_ids(product_id):
+                zip_ref.writestr(f"{sticker_id}@2x.png", make_png(size, size, self.seed + sticker_id))
+                if animated:
+                    zip_ref.writestr(f"animation@2x/{sticker_id}@2x.png",
+                                     make_png(size, size, self.seed + sticker_id, frames=self.frames))
+        return buffer.getvalue()
+
+    def sticker_file(self, sticker_id: int, name: str):
+        """
+        Returns the body of a single sticker file, the same image as in the pack zips, or None for an unknown name.
+        """
+        size = self.sticker_size
+        if name == Config.TYPES_STICKER_FILE["animation"][0]:
+            return make_png(size, size, self.seed + sticker_id, frames=self.frames)
+        if name == Config.TYPES_STICKER_FILE["sound"][0]:
+            return random.Random(self.seed + sticker_id).randbytes(8 * 1024)
+        if name in (Config.TYPES_STICKER_FILE[file_type][0] for file_type in ("static", "popup", "overlay")):
+            return make_png(size, size, self.seed + sticker_id)
+        return None
+
+    def showcase_page(self, page: int):
+        items = []
+        for position in range(SHOWCASE_PAGE_SIZE):
+            product_id = page * 100 + position
+            name = html.escape(f"Benchmark Pack {product_id} & Friends")
+            items.append(
+                f'<li class="mdCMN02Li"><a href="/stickershop/product/{product_id}/en" class="FnLink">'
+                f'<div class="mdCMN05Img"><img src="https://stickershop.line-scdn.net/stickershop/v1/product/'
+                f'{product_id}/LINEStorePC/main.png?v=1" alt=""></div>'
+                f'<div class="mdCMN05Body"><p class="mdCMN05Ttl">{name}</p></div></a></li>'
+            )
+        return ('<!DOCTYPE html><html lang="en"><head><meta charset="UTF-8"><title>LINE STORE</title></head>'
+                f'<body><ul class="mdCMN02Ul">{"".join(items)}</ul></body></html>').encode("utf-8")
+
+    def body_for(self, path: str, query: dict):
+        """
+        Returns (body, content_type) for a request path, or None for a 404. Bodies are built once and kept.
+        """
+        key = (path, query.get("page", [""])[0])
+        with self._lock:
+            if key in self._bodies:
+                return self._bodies[key]
+
+        body = None
+        match = PACK_PATH.match(path)
+        if THUMBNAIL_PATH.match(path):
+            body = (make_png(96, 96, int(THUMBNAIL_PATH.match(path).group(1))), "image/png")
+        elif match:
+            product_id, name = int(match.group(1)), match.group(3)
+            if name == "productInfo.meta":
+                body = (json.dumps(self.metadata(product_id)).encode("utf-8"), "application/json")
+            elif name in Config.TYPES_STICKER.values():
+                body = (self.pack_zip(product_id, name), "application/zip")
+        elif STICKER_PATH.match(path):
+            sticker_id, name = int(STICKER_PATH.match(path).group(1)), STICKER_PATH.match(path).group(3)
+            content = self.sticker_file(sticker_id, name)
+            if content is not None:
+                body = (content, "audio/mp4" if name.endswith(".m4a") else "image/png")
+        elif path == SHOWCASE_PATH:
+            page = query.get("page", ["1"])[0]
+            body = (self.showcase_page(int(page) if page.isdigit() else 1), "text/html; charset=utf-8")
+
+        if body is not None:
+            with self._lock:
+                self._bodies[key] = body
+        return body
+
+    def _handler_class(self):
+        cdn = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                cdn._count(requests=1)
+                with cdn._lock:
+                    cdn.in_flight += 1
+                    throttled = cdn.throttle_above is not None and cdn.in_flight > cdn.throttle_above
+                try:
+                    if throttled:
+                        cdn._count(throttled=1)
+                        return self._send_empty(429, {"Retry-After": str(cdn.retry_after)})
+                    self._respond()
+                finally:
+                    with cdn._lock:
+                        cdn.in_flight -= 1
+
+            def _respond(self):
+                if cdn.latency:
+                    time.sleep(cdn.latency)
+                if cdn._roll(cdn.error_rate):
+                    cdn._count(errors=1)
+                    return self._send_empty(503)
+
+                url = urlsplit(self.path)
+                found = cdn.body_for(url.path, parse_qs(url.query))
+                if found is None:
+                    return self._send_empty(404)
+                body, content_type = found
+
+                etag = f'"{hashlib.sha1(body).hexdigest()[:16]}"'
+                if self._not_modified(etag):
+                    cdn._count(not_modified=1)
+                    return self._send_empty(304, {"ETag": etag, "Last-Modified": cdn.last_modified})
+
+                headers = {"Content-Type": content_type, "ETag": etag, "Last-Modified": cdn.last_modified,
+                           "Accept-Ranges": "bytes", "Cache-Control": "max-age=3600"}
+                status, start, end = 200, 0, len(body)
+                byte_range = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range", ""))
+                if byte_range:
+                    start = int(byte_range.group(1))
+                    if start >= len(body):
+                        return self._send_empty(416, {"Content-Range": f"bytes */{len(body)}"})
+                    end = min(int(byte_range.group(2)) + 1, len(body)) if byte_range.group(2) else len(body)
+                    status = 206
+                    headers["Content-Range"] = f"bytes {start}-{end - 1}/{len(body)}"
+                    cdn._count(partial=1)
+                self._send_body(status, headers, body[start:end])
+
+            def _not_modified(self, etag: str):
+                if_none_match = self.headers.get("If-None-Match")
+                if if_none_match is not None:
+                    return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+                if_modified_since = self.headers.get("If-Modified-Since")
+                if if_modified_since:
+                    try:
+                        return parsedate_to_datetime(if_modified_since) >= parsedate_to_datetime(cdn.last_modified)
+                    except (TypeError, ValueError):
+                        return False
+                return False
+
+            def _send_empty(self, status: int, headers: dict = None):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def _send_body(self, status: int, headers: dict, body: bytes):
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+
+                cut_at = len(body) // 2 if body and cdn._roll(cdn.drop_rate) else None
+                started = time.monotonic()
+                sent = 0
+                while sent < len(body):
+                    chunk = body[sent:sent + SEND_CHUNK_SIZE]
+                    if cut_at is not None and sent + len(chunk) > cut_at:
+                        self.wfile.write(body[sent:cut_at])
+                        self.wfile.flush()
+                        cdn._count(drops=1, bytes_sent=cut_at - sent)
+                        self.close_connection = True
+                        self.connection.shutdown(socket.SHUT_RDWR)
+                        return
+                    self.wfile.write(chunk)
+                    sent += len(chunk)
+                    if cdn.bandwidth:
+                        delay = sent / cdn.bandwidth - (time.monotonic() - started)
+                        if delay > 0:
+                            time.sleep(delay)
+                cdn._count(bytes_sent=sent)
+
+        return Handler
+
+
+class RedirectTransport(httpx.BaseTransport):
+    """
+    Sends every request to `target` (scheme, host and port) keeping its path and query, so app code with
+    hard-coded store and CDN URLs talks to a FakeLineCDN. The Host header still names the original host.
+    """
+
+    def __init__(self, target: str, transport: httpx.BaseTransport):
+        self._target = httpx.URL(target)
+        self._transport = transport
+
+    def handle_request(self, request: httpx.Request):
+        request.url = request.url.copy_with(scheme=self._target.scheme, host=self._target.host,
+                                            port=self._target.port)
+        return self._transport.handle_request(request)
+
+    def close(self):
+        self._transport.close()
+
+
+class AsyncRedirectTransport(httpx.AsyncBaseTransport):
+    """
+    asyncio counterpart of RedirectTransport.
+    """
+
+    def __init__(self, target: str, transport: httpx.AsyncBaseTransport):
+        self._target = httpx.URL(target)
+        self._transport = transport
+
+    async def handle_async_request(self, request: httpx.Request):
+        request.url = request.url.copy_with(scheme=self._target.scheme, host=self._target.host,
+                                            port=self._target.port)
+        return await self._transport.handle_async_request(request)
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the fake LINE CDN until interrupted.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--bandwidth", type=float, default=None, help="Bytes per second per response")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-above", type=int, default=None, help="Answer 429 above this many requests in flight")
+    args = parser.parse_args()
+
+    with FakeLineCDN(port=args.port, latency=args.latency, bandwidth=args.bandwidth, error_rate=args.error_rate,
+                     drop_rate=args.drop_rate, throttle_above=args.throttle_above) as cdn:
+        print(f"Serving on {cdn.url}, Ctrl+C to stop")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
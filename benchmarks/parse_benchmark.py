@@ -0,0 +1,81 @@
+"""
+Compares the showcase parser backends on saved store pages.
+
+Every .html file in benchmarks/fixtures is parsed by each backend in parsers.PARSERS, plus store.html from
+the project root if a page was saved there. Records must be identical across backends before any timing is
+reported.
+
+    python benchmarks/parse_benchmark.py [-n REPEAT] [files ...]
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from parsers import PARSERS  # noqa: E402
+
+FIXTURES = os.path.join(ROOT, "benchmarks", "fixtures")
+
+
+def default_pages():
+    pages = sorted(glob.glob(os.path.join(FIXTURES, "*.html")))
+    if os.path.isfile(os.path.join(ROOT, "store.html")):
+        pages.append(os.path.join(ROOT, "store.html"))
+    return pages
+
+
+def check_equivalent(html: str):
+    """
+    Returns the records of the bs4 reference backend, raising AssertionError if another backend disagrees.
+    """
+    expected = PARSERS["bs4"](html)
+    for name, parser in PARSERS.items():
+        records = parser(html)
+        if records != expected:
+            diff = next((i for i, (a, b) in enumerate(zip(records, expected)) if a != b), min(len(records), len(expected)))
+            raise AssertionError(f"{name} differs from bs4 at record {diff} ({len(records)} vs {len(expected)} records)")
+    return expected
+
+
+def time_parser(parser, html: str, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        parser(html)
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Benchmark the showcase parser backends.")
+    arg_parser.add_argument("files", nargs="*", help="Saved showcase pages. Defaults to the fixtures and store.html.")
+    arg_parser.add_argument("-n", "--repeat", type=int, default=200, help="Parses per backend and page.")
+    args = arg_parser.parse_args(argv)
+
+    pages = args.files or default_pages()
+    if not pages:
+        arg_parser.error("no pages to parse")
+
+    totals = {name: [0, 0.0] for name in PARSERS}
+    for path in pages:
+        with open(path, "r", encoding="utf-8") as f:
+            html = f.read()
+        items = len(check_equivalent(html))
+        print(f"{os.path.relpath(path, ROOT)}: {items} items, {len(html) / 1024:.1f} KiB, backends agree")
+        for name, parser in PARSERS.items():
+            elapsed = time_parser(parser, html, args.repeat)
+            totals[name][0] += items * args.repeat
+            totals[name][1] += elapsed
+            print(f"  {name:<8}{items * args.repeat / elapsed:>12,.0f} items/s{elapsed / args.repeat * 1000:>10.3f} ms/page")
+
+    baseline = totals["bs4"][0] / totals["bs4"][1]
+    print("total:")
+    for name, (items, elapsed) in sorted(totals.items(), key=lambda item: item[1][1]):
+        rate = items / elapsed
+        print(f"  {name:<8}{rate:>12,.0f} items/s{rate / baseline:>8.1f}x bs4")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+"""
+End-to-end benchmarks of the download, scrape, unzip and convert paths against a local FakeLineCDN.
+
+Each path runs in a fresh process so its peak RSS is its own, and reports items/min, MB/s and p50/p99
+per-item latency:
+
+    download  packs, through download.download_sticker_pack on the shared client transport
+    scrape    showcase pages, fetched, parsed and with their thumbnails cached
+    unzip     archives, through extract.extract_zip
+    convert   animated PNGs, through convert.convert_file on a process pool
+
+    python benchmarks/run_benchmarks.py --packs 40 --latency 0.05 --bandwidth 5e6 --error-rate 0.02
+    python benchmarks/run_benchmarks.py --paths download unzip --json results.json
+"""
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import asyncio
+import zipfile
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import httpx  # noqa: E402
+
+from fake_cdn import FakeLineCDN, RedirectTransport, AsyncRedirectTransport  # noqa: E402
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+PATHS = ("download", "scrape", "unzip", "convert")
+
+
+def percentile(values: list, q: float):
+    """
+    Nearest-rank percentile of `values`, or None if there are none.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(q / 100 * len(values) + 0.5) - 1))]
+
+
+def peak_rss(who: int = None):
+    """
+    Peak resident set size in bytes of this process (or of its waited-for children with
+    resource.RUSAGE_CHILDREN), None where the resource module is missing.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF if who is None else who).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def summarize(path: str, item: str, latencies: list, size: int, elapsed: float, failed: int):
+    return {
+        "path": path,
+        "item": item,
+        "items": len(latencies),
+        "failed": failed,
+        "seconds": elapsed,
+        "items_per_minute": len(latencies) / elapsed * 60 if elapsed else 0.0,
+        "megabytes_per_second": size / 1024 / 1024 / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000 if latencies else None,
+        "p99_ms": percentile(latencies, 99) * 1000 if latencies else None,
+        "peak_rss": peak_rss(),
+    }
+
+
+def _timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_download(cdn_url: str, work_dir: str, options: dict):
+    from config import Config
+    from download import download_sticker_pack
+    from transport import TRANSPORT_SETTINGS, client_options, create_transport
+
+    output_dir = os.path.join(work_dir, "output")
+    shutil.rmtree(output_dir, ignore_errors=True)
+    transport = create_transport(RedirectTransport(cdn_url, httpx.HTTPTransport(**client_options())))
+    config = Config()
+
+    start = time.perf_counter()
+    with httpx.Client(transport=transport, timeout=TRANSPORT_SETTINGS["timeout"]) as client, \
+            ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+        futures = [executor.submit(_timed, download_sticker_pack, client, str(sticker_id), config,
+                                   output_dir=output_dir, http_cache=None, hedge_after=options["hedge_after"])
+                   for sticker_id in range(1, options["packs"] + 1)]
+        timed_results = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+
+    done = [(result, seconds) for result, seconds in timed_results if result["ok"]]
+    size = sum(os.path.getsize(result["filename"]) for result, _ in done)
+    return summarize("download", "packs", [seconds for _, seconds in done], size, elapsed,
+                     len(timed_results) - len(done))
+
+
+def bench_scrape(cdn_url: str, work_dir: str, options: dict):
+    from cache import PageCache, ThumbnailCache
+    from scraper import FAKE_HEADERS, fetch_showcase_page, parse_showcase_page, cache_thumbnails
+    from transport import TRANSPORT_SETTINGS, client_options, create_async_transport
+
+    cache_dir = os.path.join(work_dir, "cache")
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    page_cache = PageCache(os.path.join(cache_dir, "pages"))
+    thumbnail_cache = ThumbnailCache(os.path.join(cache_dir, "thumbnails"))
+
+    async def _run():
+        transport = create_async_transport(
+            AsyncRedirectTransport(cdn_url, httpx.AsyncHTTPTransport(**client_options()))
+        )
+        semaphore = asyncio.Semaphore(options["workers"])
+
+        async def _page(client, page):
+            async with semaphore:
+                start = time.perf_counter()
+                html = await fetch_showcase_page(page, client=client, headers=FAKE_HEADERS, page_cache=page_cache,
+                                                 always_fetch_new=True)
+                stickers = parse_showcase_page(html)
+                await cache_thumbnails(stickers, client=client, thumbnail_cache=thumbnail_cache)
+                size = len(html.encode("utf-8")) + sum(os.path.getsize(sticker["cached_image"])
+                                                       for sticker in stickers if not sticker.get("error"))
+                return time.perf_counter() - start, size
+
+        async with httpx.AsyncClient(transport=transport, timeout=TRANSPORT_SETTINGS["timeout"]) as client:
+            return await asyncio.gather(*(_page(client, page) for page in range(1, options["pages"] + 1)),
+                                        return_exceptions=True)
+
+    start = time.perf_counter()
+    results = asyncio.run(_run())
+    elapsed = time.perf_counter() - start
+
+    done = [result for result in results if not isinstance(result, Exception)]
+    return summarize("scrape", "pages", [seconds for seconds, _ in done], sum(size for _, size in done),
+                     elapsed, len(results) - len(done))
+
+
+def bench_unzip(cdn_url: str, work_dir: str, options: dict):
+    from extract import extract_zip
+
+    output_dir = os.path.join(work_dir, "output")
+    zip_paths = sorted(glob.glob(os.path.join(output_dir, "*.zip")))
+    extract_dirs = [os.path.splitext(zip_path)[0] for zip_path in zip_paths]
+    for extract_dir in extract_dirs:
+        shutil.rmtree(extract_dir, ignore_errors=True)
+
+    def _extract(zip_path: str, extract_dir: str):
+        try:
+            extract_zip(zip_path, extract_dir)
+            with zipfile.ZipFile(zip_path) as zip_ref:
+                return sum(info.file_size for info in zip_ref.infolist())
+        except (OSError, zipfile.BadZipFile):
+            return None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+        timed_results = list(executor.map(lambda paths: _timed(_extract, *paths), zip(zip_paths, extract_dirs)))
+    elapsed = time.perf_counter() - start
+
+    done = [(size, seconds) for size, seconds in timed_results if size is not None]
+    return summarize("unzip", "archives", [seconds for _, seconds in done], sum(size for size, _ in done), elapsed,
+                     len(timed_results) - len(done))
+
+
+def _timed_convert(path: str):
+    from convert import convert_file
+
+    return _timed(convert_file, path)
+
+
+def bench_convert(cdn_url: str, work_dir: str, options: dict):
+    from convert import skip_reason
+
+    paths = [path for path in glob.glob(os.path.join(work_dir, "output", "**", "*.png"), recursive=True)
+             if skip_reason(path, force=True) is None]
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=options["convert_workers"]) as executor:
+        timed_results = list(executor.map(_timed_convert, paths))
+    elapsed = time.perf_counter() - start
+
+    done = [(result, seconds) for result, seconds in timed_results if result["ok"]]
+    summary = summarize("convert", "files", [seconds for _, seconds in done],
+                        sum(os.path.getsize(result["file"]) for result, _ in done), elapsed,
+                        len(timed_results) - len(done))
+    summary["worker_peak_rss"] = peak_rss(resource.RUSAGE_CHILDREN) if resource else None
+    return summary
+
+
+BENCHMARKS = {
+    "download": bench_download,
+    "scrape": bench_scrape,
+    "unzip": bench_unzip,
+    "convert": bench_convert,
+}
+
+
+def run_isolated(path: str, cdn_url: str, work_dir: str, options: dict):
+    """
+    Runs one benchmark in a fresh spawned process, so imports and peak RSS do not leak between paths.
+    """
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(BENCHMARKS[path], cdn_url, work_dir, options).result()
+
+
+def _format(value, spec: str):
+    return "n/a" if value is None else format(value, spec)
+
+
+def print_report(results: list, server_stats: dict):
+    print(f"{'path':<10}{'items':>7}{'failed':>8}{'items/min':>12}{'MB/s':>9}{'p50 ms':>9}{'p99 ms':>9}"
+          f"{'peak RSS MB':>13}")
+    for result in results:
+        rss = result["peak_rss"] / 1024 / 1024 if result["peak_rss"] is not None else None
+        print(f"{result['path']:<10}{result['items']:>7}{result['failed']:>8}"
+              f"{result['items_per_minute']:>12.1f}{result['megabytes_per_second']:>9.2f}"
+              f"{_format(result['p50_ms'], '.1f'):>9}{_format(result['p99_ms'], '.1f'):>9}{_format(rss, '.1f'):>13}"
+              f"  ({result['item']})")
+    print(f"server: {server_stats}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the app against a local fake LINE CDN.")
+    parser.add_argument("--paths", nargs="+", choices=PATHS, default=list(PATHS))
+    parser.add_argument("--packs", type=int, default=20, help="Sticker packs to download")
+    parser.add_argument("--pages", type=int, default=5, help="Showcase pages to scrape")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="Concurrent downloads, pages and unzips")
+    parser.add_argument("--convert-workers", type=int, default=None, help="Converter processes. Defaults to the CPU count")
+    parser.add_argument("--hedge-after", type=float, default=None)
+    parser.add_argument("--latency", type=float, default=0.0, help="Server seconds per request")
+    parser.add_argument("--bandwidth", type=float, default=None, help="Server bytes per second per response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="Fraction of bodies cut off halfway")
+    parser.add_argument("--throttle-above", type=int, default=None,
+                        help="Server answers 429 with Retry-After above this many requests in flight")
+    parser.add_argument("--stickers-per-pack", type=int, default=8)
+    parser.add_argument("--sticker-size", type=int, default=120)
+    parser.add_argument("--frames", type=int, default=4)
+    parser.add_argument("--work-dir", help="Where packs and caches are written. Defaults to a temporary folder")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    options = {"packs": args.packs, "pages": args.pages, "workers": args.workers,
+               "convert_workers": args.convert_workers, "hedge_after": args.hedge_after}
+    paths = [path for path in PATHS if path in args.paths]
+    # unzip and convert work on the downloaded packs
+    setup_download = "download" not in paths and ("unzip" in paths or "convert" in paths)
+    if "convert" in paths and "unzip" not in paths:
+        paths.insert(paths.index("convert"), "unzip")
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="line-bench-")
+    results = []
+    try:
+        with FakeLineCDN(latency=args.latency, bandwidth=args.bandwidth, error_rate=args.error_rate,
+                         drop_rate=args.drop_rate, throttle_above=args.throttle_above,
+                         stickers_per_pack=args.stickers_per_pack, sticker_size=args.sticker_size, frames=args.frames) as cdn:
+            if setup_download:
+                run_isolated("download", cdn.url, work_dir, options)
+            for path in paths:
+                print(f"Running {path}...", file=sys.stderr)
+                result = run_isolated(path, cdn.url, work_dir, options)
+                if path in args.paths:
+                    results.append(result)
+            server_stats = dict(cdn.stats)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_report(results, server_stats)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"options": vars(args), "results": results, "server": server_stats}, f, indent=2)
+    return 1 if any(result["failed"] for result in results) else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,270 @@
+import os
+import re
+import gzip
+import json
+import time
+import shutil
+import threading
+from email.utils import formatdate
+from urllib.parse import urlparse, parse_qs
+
+
+class ThumbnailCache:
+    """
+    Persistent thumbnail cache keyed on the product ID and the ?v= version of the image URL.
+
+    Files are stored as `<directory>/<product id>_v<version>.<ext>`. A small JSON index keeps the size and
+    last access time of every entry, and the least recently used entries are evicted once the total size
+    goes over `max_bytes`.
+    """
+
+    INDEX_FILE = "index.json"
+
+    def __init__(self, directory: str = "cache/thumbnails", *, max_bytes: int = 64 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._index = self._load_index()
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, self.INDEX_FILE)
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self.index_path)
+        self._dirty = False
+
+    @staticmethod
+    def key_for(image_url: str):
+        """
+        Builds the cache key of an image URL, e.g. ".../product/9801/LINEStorePC/main.png?v=3" -> "9801_v3.png".
+        """
+        parsed = urlparse(image_url)
+        product_match = re.search(r"/product/(\d+)/", parsed.path)
+        product_id = product_match.group(1) if product_match else re.sub(r"\W", "_", parsed.path.strip("/"))
+        version = parse_qs(parsed.query).get("v", ["0"])[0]
+        file_ext = parsed.path.split(".")[-1]
+        return f"{product_id}_v{version}.{file_ext}"
+
+    def path_for(self, image_url: str):
+        return os.path.join(self.directory, self.key_for(image_url))
+
+    def get(self, image_url: str):
+        """
+        Returns the cached file path of `image_url` and marks it as recently used, or None on a miss.
+        """
+        key = self.key_for(image_url)
+        path = os.path.join(self.directory, key)
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                return None
+            if not os.path.exists(path):
+                del self._index[key]
+                self._dirty = True
+                return None
+            entry["last_access"] = time.time()
+            self._dirty = True
+            return path
+
+    def commit(self, image_url: str):
+        """
+        Registers the file already written at path_for(image_url) and evicts old entries if over budget.
+        The index is written on the next flush().
+        """
+        key = self.key_for(image_url)
+        path = os.path.join(self.directory, key)
+        with self._lock:
+            self._index[key] = {"size": os.path.getsize(path), "last_access": time.time()}
+            self._evict(keep=key)
+            self._dirty = True
+        return path
+
+    def put(self, image_url: str, content: bytes):
+        path = self.path_for(image_url)
+        os.makedirs(self.directory, exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(content)
+        path = self.commit(image_url)
+        self.flush()
+        return path
+
+    def total_size(self):
+        with self._lock:
+            return sum(entry["size"] for entry in self._index.values())
+
+    def _evict(self, keep: str = None):
+        total = sum(entry["size"] for entry in self._index.values())
+        if total <= self.max_bytes:
+            return
+        for key, entry in sorted(self._index.items(), key=lambda item: item[1]["last_access"]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            try:
+                os.remove(os.path.join(self.directory, key))
+            except FileNotFoundError:
+                pass
+            total -= entry["size"]
+            del self._index[key]
+
+    def flush(self):
+        """
+        Writes pending last-access updates to the index.
+        """
+        with self._lock:
+            if self._dirty:
+                self._save_index()
+
+    def clear(self):
+        with self._lock:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self._index = {}
+            self._dirty = False
+
+
+class HttpCache:
+    """
+    Local HTTP cache with a per-resource TTL and ETag/Last-Modified revalidation.
+
+    Every resource gets a small JSON entry in `directory` holding its validators, the time it was last
+    confirmed fresh, and either the body itself (metadata) or the path of the file the body lives in (packs).
+    Entries younger than the TTL of their kind are served without touching the network; older ones are
+    revalidated with a conditional request.
+    """
+
+    DEFAULT_TTLS = {
+        "meta": 6 * 60 * 60,
+        "pack": 7 * 24 * 60 * 60,
+    }
+
+    def __init__(self, directory: str = "cache/http", *, ttls: dict = None):
+        self.directory = directory
+        self.ttls = {**self.DEFAULT_TTLS, **(ttls or {})}
+
+    def _entry_path(self, key: str):
+        return os.path.join(self.directory, re.sub(r"[^\w.@-]", "_", key) + ".json")
+
+    def lookup(self, key: str):
+        try:
+            with open(self._entry_path(key), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("path") and not os.path.exists(entry["path"]):
+            return None
+        return entry
+
+    def is_fresh(self, entry: dict):
+        if entry is None:
+            return False
+        return time.time() - entry["checked_at"] < self.ttls.get(entry["kind"], 0)
+
+    @staticmethod
+    def conditional_headers(entry: dict = None, path: str = None):
+        """
+        Builds If-None-Match/If-Modified-Since headers from an entry, or from the mtime of an existing
+        file at `path` when there is no entry yet.
+        """
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        elif path and os.path.exists(path):
+            headers["If-Modified-Since"] = formatdate(os.path.getmtime(path), usegmt=True)
+        return headers
+
+    def _write(self, key: str, entry: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        entry_path = self._entry_path(key)
+        tmp_path = f"{entry_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, entry_path)
+
+    def store(self, key: str, kind: str, headers, *, body=None, path: str = None):
+        """
+        Records a 200 response. Pass the decoded `body` for small resources or the `path` the body was written to.
+        """
+        entry = {
+            "kind": kind,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "checked_at": time.time(),
+            "body": body,
+            "path": path,
+        }
+        self._write(key, entry)
+        return entry
+
+    def revalidated(self, key: str, entry: dict, headers, *, kind: str = None, path: str = None):
+        """
+        Records a 304 response, refreshing the TTL and any validators the server sent again.
+        """
+        if entry is None:
+            entry = {"kind": kind, "etag": None, "last_modified": None, "body": None, "path": path}
+        entry["etag"] = headers.get("ETag") or entry.get("etag")
+        entry["last_modified"] = headers.get("Last-Modified") or entry.get("last_modified")
+        entry["checked_at"] = time.time()
+        self._write(key, entry)
+        return entry
+
+
+class PageCache:
+    """
+    Gzip-compressed cache of showcase HTML, one file per page number.
+
+    An entry is fresh for `ttl` seconds after it was written, based on the file mtime. Stale entries are
+    still returned so callers can serve them while refreshing in the background.
+    """
+
+    def __init__(self, directory: str = "cache/pages", *, ttl: float = 10 * 60):
+        self.directory = directory
+        self.ttl = ttl
+
+    def path_for(self, page: int):
+        return os.path.join(self.directory, f"page_{int(page)}.html.gz")
+
+    def get(self, page: int):
+        """
+        Returns (html, fresh) for `page`, or (None, False) when it was never cached.
+        """
+        path = self.path_for(page)
+        try:
+            age = time.time() - os.path.getmtime(path)
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                return f.read(), age < self.ttl
+        except (OSError, EOFError):
+            return None, False
+
+    def put(self, page: int, html: str):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path_for(page)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=6) as f:
+            f.write(html)
+        os.replace(tmp_path, path)
+        return path
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+THUMBNAIL_CACHE = ThumbnailCache()
+HTTP_CACHE = HttpCache()
+PAGE_CACHE = PageCache()
@@ -0,0 +1,118 @@
+import time
+import sqlite3
+import threading
+
+
+class Catalog:
+    """
+    Local SQLite catalog of showcase products, filled by scraper.crawl_showcase.
+
+    Products are keyed on their product ID. The showcase page and position they were last seen at are kept
+    so the GUI can page through the catalog in store order without any request.
+    """
+
+    PAGE_SIZE = 36
+
+    def __init__(self, path: str = "catalog.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def _connect(self):
+        """
+        Opens the database on first use. Callers hold self._lock.
+        """
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.row_factory = sqlite3.Row
+            with self._connection:
+                self._connection.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS products (
+                        product_id TEXT PRIMARY KEY,
+                        name TEXT NOT NULL,
+                        link TEXT NOT NULL,
+                        image_url TEXT NOT NULL,
+                        version INTEGER NOT NULL DEFAULT 0,
+                        page INTEGER NOT NULL,
+                        position INTEGER NOT NULL,
+                        first_seen REAL NOT NULL,
+                        updated_at REAL NOT NULL
+                    )
+                    """
+                )
+                self._connection.execute(
+                    "CREATE INDEX IF NOT EXISTS products_order ON products (page, position)"
+                )
+        return self._connection
+
+    def upsert(self, records: list, page: int):
+        """
+        Inserts or updates the products of one showcase page.
+
+        Returns:
+            tuple: (new, changed) counts. A product counts as changed when its name, image or version
+            differs; moving to another page or position does not.
+        """
+        new = changed = 0
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                for position, record in enumerate(records):
+                    if not record.get("product_id"):
+                        continue
+                    row = connection.execute(
+                        "SELECT name, image_url, version FROM products WHERE product_id = ?",
+                        (record["product_id"],),
+                    ).fetchone()
+                    if row is None:
+                        new += 1
+                        connection.execute(
+                            "INSERT INTO products VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            (record["product_id"], record["name"], record["link"], record["image_url"],
+                             record["version"], page, position, now, now),
+                        )
+                        continue
+
+                    is_changed = (row["name"], row["image_url"], row["version"]) != (
+                        record["name"], record["image_url"], record["version"])
+                    changed += is_changed
+                    connection.execute(
+                        """
+                        UPDATE products SET name = ?, link = ?, image_url = ?, version = ?, page = ?, position = ?,
+                            updated_at = CASE WHEN ? THEN ? ELSE updated_at END
+                        WHERE product_id = ?
+                        """,
+                        (record["name"], record["link"], record["image_url"], record["version"], page, position,
+                         is_changed, now, record["product_id"]),
+                    )
+        return new, changed
+
+    def page(self, number: int, page_size: int = PAGE_SIZE):
+        """
+        Returns the products of catalog page `number` (1-based) in store order, as dictionaries.
+        """
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT product_id, name, link, image_url, version FROM products "
+                "ORDER BY page, position LIMIT ? OFFSET ?",
+                (page_size, max(0, number - 1) * page_size),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def count(self):
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM products").fetchone()[0]
+
+    def page_count(self, page_size: int = PAGE_SIZE):
+        return max(1, -(-self.count() // page_size))
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+CATALOG = Catalog()
@@ -0,0 +1,84 @@
+class Config:
+    MODE_LIST = {
+        "sticker": 0,
+        "theme": 1,
+        "emoji": 2
+    }
+    PLATFORM_LIST = {
+        "android": 0,
+        "iphone": 1,
+        "pc": 2
+    }
+    TYPES_STICKER = {
+        0: "stickers@2x.zip",
+        1: "stickerpack@2x.zip",
+        2: "sticker_custom_plus_base@2x.zip",
+        3: "sticker_name_base@2x.zip",
+    }
+    TYPES_EMOJI = {
+        "package.zip?v=1": 0,
+        "package_animation.zip": 1
+    }
+    TYPES_THEME = {
+        "/4/WEBSTORE/icon_198x278.png?__=20161019": 0,
+        "/4/ANDROID/ja/preview_001_720x1232.png": 1
+    }
+
+    # Single sticker files: CDN name under /sticker/<sticker id>/<platform>/, and the name they are saved
+    # under, the same as inside the pack zips
+    TYPES_STICKER_FILE = {
+        "static": ("sticker@2x.png", "{id}@2x.png"),
+        "animation": ("sticker_animation@2x.png", "animation@2x/{id}@2x.png"),
+        "sound": ("sticker_sound.m4a", "sound/{id}.m4a"),
+        "popup": ("sticker_popup.png", "popup/{id}.png"),
+        "overlay": ("overlay/plus/default/sticker@2x.png", "overlay/{id}@2x.png"),
+    }
+
+    # URL TO GET OVERLAY "/sticker/{STICKER_ID@2.png}/iPhone/overlay/plus/default/sticker@2x.png"
+
+    def __init__(self):
+        self.mode = 0
+        self.platform = 1
+        # None downloads the whole pack zip; a list of TYPES_STICKER_FILE keys (or ["auto"]) fetches single
+        # sticker files instead, limited to sticker_ids when that is set
+        self.sticker_files = None
+        self.sticker_ids = None
+
+    def get_current_mode(self):
+        return list(self.MODE_LIST.keys())[list(self.MODE_LIST.values()).index(self.mode)]
+
+    def get_current_platform(self):
+        return list(self.PLATFORM_LIST.keys())[list(self.PLATFORM_LIST.values()).index(self.platform)]
+
+    def get_current_sticker_types(self, parsed_type: str):
+        match parsed_type:
+            case "STATIC":
+                return self.TYPES_STICKER.get(0)
+            case "NAME_TEXT":
+                return self.TYPES_STICKER.get(3)
+            case "PER_STICKER_TEXT":
+                return self.TYPES_STICKER.get(2)
+            case _:
+                return self.TYPES_STICKER.get(1)
+
+    def get_current_sticker_files(self, parsed_type: str):
+        """
+        Returns the TYPES_STICKER_FILE keys to fetch for a pack of type `parsed_type`, honouring sticker_files.
+        """
+        if self.sticker_files and "auto" not in self.sticker_files:
+            return list(self.sticker_files)
+        match parsed_type:
+            case "STATIC" | "NAME_TEXT" | "PER_STICKER_TEXT":
+                return ["static"]
+            case "SOUND":
+                return ["static", "sound"]
+            case "ANIMATION":
+                return ["animation"]
+            case "ANIMATION_SOUND":
+                return ["animation", "sound"]
+            case "POPUP":
+                return ["popup"]
+            case "POPUP_SOUND":
+                return ["popup", "sound"]
+            case _:
+                return ["static"]
@@ -0,0 +1,115 @@
+import os
+import glob
+import time
+import struct
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from apnggif import apnggif
+from metrics import METRICS
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Pack thumbnails and tab icons, never stickers
+THUMBNAIL_SUFFIXES = ("key@2x.png", "key.png")
+THUMBNAIL_PREFIXES = ("tab_on", "tab_off")
+
+
+def is_apng(path: str):
+    """
+    Tells whether `path` is an animated PNG by looking for an acTL chunk before the first IDAT.
+    Only the chunk headers are read, the image data is skipped.
+    """
+    try:
+        with open(path, "rb") as f:
+            if f.read(8) != PNG_SIGNATURE:
+                return False
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    return False
+                length, chunk_type = struct.unpack(">I4s", header)
+                if chunk_type == b"acTL":
+                    return True
+                if chunk_type in (b"IDAT", b"IEND"):
+                    return False
+                f.seek(length + 4, os.SEEK_CUR)
+    except OSError:
+        return False
+
+
+def gif_path_for(path: str):
+    return os.path.splitext(path)[0] + ".gif"
+
+
+def skip_reason(path: str, *, force: bool = False):
+    """
+    Returns why `path` should not be converted, or None if it should.
+    """
+    name = os.path.basename(path)
+    if name.endswith(THUMBNAIL_SUFFIXES) or name.startswith(THUMBNAIL_PREFIXES):
+        return "thumbnail"
+    if not force:
+        gif_path = gif_path_for(path)
+        if os.path.exists(gif_path) and os.path.getmtime(gif_path) >= os.path.getmtime(path):
+            return "up to date"
+    if not is_apng(path):
+        return "static"
+    return None
+
+
+def convert_file(path: str):
+    """
+    Converts one APNG to GIF. Runs in a worker process, so it only takes and returns plain data.
+    """
+    started = time.perf_counter()
+    try:
+        apnggif(path, gif_path_for(path))
+        return {"file": path, "gif": gif_path_for(path), "ok": True, "skipped": None, "error": None,
+                "seconds": time.perf_counter() - started}
+    except Exception as err:
+        return {"file": path, "gif": None, "ok": False, "skipped": None, "error": str(err),
+                "seconds": time.perf_counter() - started}
+
+
+def convert_folder(folder: str, *, workers: int = None, force: bool = False):
+    """
+    Converts every animated PNG under `folder` to GIF on a process pool sized to the CPU count.
+
+    Static PNGs, pack thumbnails and files whose .gif is newer than the source are skipped without
+    starting a worker.
+
+    Args:
+        workers (int, optional): Number of worker processes. Defaults to the CPU count.
+        force (bool, optional): Convert even if an up to date .gif exists. Defaults to False.
+
+    Yields:
+        dict: file, gif, ok, skipped (reason or None), error and seconds, for each PNG as soon as it is done.
+    """
+    to_convert = []
+    for path in glob.glob(os.path.join(folder, "**", "*.png"), recursive=True):
+        reason = skip_reason(path, force=force)
+        if reason:
+            METRICS.inc("conversions_total", result="skipped")
+            yield {"file": path, "gif": None, "ok": True, "skipped": reason, "error": None, "seconds": 0.0}
+        else:
+            to_convert.append(path)
+
+    if not to_convert:
+        return
+    with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, len(to_convert))) as executor:
+        futures = [executor.submit(convert_file, path) for path in to_convert]
+        for future in as_completed(futures):
+            result = future.result()
+            METRICS.observe("convert_seconds", result["seconds"])
+            METRICS.inc("conversions_total", result="ok" if result["ok"] else "failed")
+            yield result
+
+
+if __name__ == '__main__':
+    import sys
+
+    for result in convert_folder(sys.argv[1] if len(sys.argv) > 1 else "output"):
+        if result["skipped"]:
+            continue
+        print(f"{'converted' if result['ok'] else 'failed'}: {result['file']}"
+              + (f" ({result['error']})" if result["error"] else ""))
@@ -1,21 +1,583 @@
+import os
+import re
+import json
+import time
 import httpx
+import hashlib
 import contextlib
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from cache import HTTP_CACHE
+from metrics import METRICS
+from mirrors import MIRROR_STATS, open_first_with_retry
+from retry import RETRY_POLICY, MIRROR_BREAKERS
+from store import store_for
+from transport import get_client
+from verify import check_zip, manifest_for
+
+# Single sticker files of one pack fetched at a time by download_sticker_files
+STICKER_FILE_WORKERS = 8
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024
+
+STICKER_META_HEADERS = {
+    "user-agent": "Mozilla/5.0 (iPhone; CPU iPhone OS 12_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) FxiOS/103.0 Mobile/15E148 Safari/605.1.15",
+    "accept": "application/json",
+    "Content-Type": "application/json",
+    "charset": "UTF-8",
+}
 
 
 class DownloadManager(contextlib.ContextDecorator):
+    """
+    Hands out the app-wide pooled client from transport.get_client(), which stays open on exit.
+    Passing client arguments creates a dedicated httpx.Client instead, closed on exit.
+    """
+
     def __init__(self, *args, **kwargs):
         self.args = args
         self.kwargs = kwargs
+        self.owns_client = bool(args or kwargs)
 
     def __enter__(self):
-        self.client = httpx.Client(*self.args, **self.kwargs)
+        self.client = httpx.Client(*self.args, **self.kwargs) if self.owns_client else get_client()
         return self.client
 
     def __exit__(self, *args):
-        self.client.close()
+        if self.owns_client:
+            self.client.close()
         return False
 
 
+def parse_sticker_id(url: str):
+    """
+    Extracts the sticker product ID from a bare ID or a LINE store link.
+
+    Returns:
+        str | None: The sticker ID, or None if the input holds no number.
+    """
+    regex_match = re.search(r"\d+", url)
+    if not regex_match:
+        return None
+    return regex_match.group()
+
+
+def sticker_fallback_urls(sticker_id: str, platform: str):
+    """
+    Builds the list of CDN base URLs a sticker pack can be fetched from, in the order they should be tried.
+    """
+    return [
+        f"https://stickershop.line-scdn.net/stickershop/v1/product/{sticker_id}/{platform}/",
+        f"http://dl.stickershop.line.naver.jp/products/0/0/1/{sticker_id}/{platform}/",
+    ]
+
+
+def sticker_file_urls(sticker_id, platform: str):
+    """
+    Builds the list of CDN base URLs a single sticker's files can be fetched from, in the order they should be tried.
+    """
+    return [
+        f"https://stickershop.line-scdn.net/stickershop/v1/sticker/{sticker_id}/{platform}/",
+        f"http://dl.stickershop.line.naver.jp/stickershop/v1/sticker/{sticker_id}/{platform}/",
+    ]
+
+
+def get_sticker_metadata(client: httpx.Client, fallback_urls: list, *, log=None, http_cache=None, cache_key=None,
+                         hedge_after: float = None):
+    """
+    Fetches productInfo.meta from the first mirror that answers with 200 and a JSON body.
+
+    Mirrors are tried fastest first, and raced against each other after `hedge_after` seconds (see
+    mirrors.open_first). Connection errors and 429/5xx answers are retried with backoff under RETRY_POLICY. With an `http_cache`, a fresh entry under `cache_key` is returned without a request, and a stale one is
+    revalidated so a 304 returns the stored metadata.
+
+    Returns:
+        dict: The parsed metadata, or an empty dict if no mirror had it.
+    """
+    entry = http_cache.lookup(cache_key) if http_cache else None
+    if http_cache and http_cache.is_fresh(entry):
+        if log:
+            log.info(f"Metadata cache hit: {cache_key}")
+        METRICS.inc("cache_requests_total", cache="meta", result="hit")
+        return entry["body"]
+
+    headers = {**STICKER_META_HEADERS, **(http_cache.conditional_headers(entry) if http_cache else {})}
+
+    def _send(uri: str):
+        if log:
+            log.info(f"Trying to get metadata from: {uri}")
+        return client.get(uri + "productInfo.meta", headers=headers)
+
+    def _accept(response: httpx.Response):
+        if response.status_code == 304:
+            return entry is not None
+        if response.status_code != 200:
+            return False
+        # A 200 that is not JSON (an error page, a cut-off body) is passed over for the next mirror
+        response.encoding = 'utf-8'
+        try:
+            response.json()
+        except ValueError as err:
+            if log:
+                log.error(f"Metadata from {response.url} is not JSON: {err}")
+            return False
+        return True
+
+    try:
+        uri, req = open_first_with_retry(_send, fallback_urls, hedge_after=hedge_after, operation="meta", log=log,
+                                         accept=_accept)
+    except httpx.HTTPError as err:
+        if log:
+            log.error(f"HTTP Error: {err}")
+        return {}
+    if req is None:
+        return {}
+
+    if req.status_code == 304:
+        if log:
+            log.info(f"Metadata not modified: {cache_key}")
+        http_cache.revalidated(cache_key, entry, req.headers)
+        METRICS.inc("cache_requests_total", cache="meta", result="revalidated")
+        return entry["body"]
+    metadata = req.json()
+    if http_cache:
+        http_cache.store(cache_key, "meta", req.headers, body=metadata)
+        METRICS.inc("cache_requests_total", cache="meta", result="miss")
+    return metadata
+
+
+def _parse_content_range(value: str):
+    """
+    Parses "bytes <start>-<end>/<total>" into (start, total). Total is None when the server sent "*".
+    """
+    match = re.match(r"bytes (\d+)-\d+/(\d+|\*)", value or "")
+    if not match:
+        return None, None
+    total = match.group(2)
+    return int(match.group(1)), None if total == "*" else int(total)
+
+
+def _chunk_size_for(total: int = None):
+    """
+    Picks a read size of about 1/16 of the body, between MIN_CHUNK_SIZE and MAX_CHUNK_SIZE.
+    """
+    if not total:
+        return MIN_CHUNK_SIZE
+    return min(max(total // 16, MIN_CHUNK_SIZE), MAX_CHUNK_SIZE)
+
+
+def stream_sticker_pack(client: httpx.Client, fallback_urls: list, ext: str, filename: str, *,
+                        pack_progress=None, log=None, http_cache=None, cache_key=None, hedge_after: float = None,
+                        manifest=None):
+    """
+    Streams a sticker pack zip from the first mirror that has it into `filename`.
+
+    The body goes to `filename.part`. A leftover part file from an earlier attempt, or from a mirror that
+    dropped the connection, is resumed with a Range request. The part file is renamed into place only once
+    its length matches the expected size and it passes verify.check_zip. Mirrors are picked, raced and retried
+    on the response headers the same way as in get_sticker_metadata; a body that breaks off or fails the
+    checks is fetched again after a backoff, up to RETRY_POLICY.attempts times.
+
+    With an `http_cache`, an existing `filename` that is still fresh is kept without a request, and a stale
+    one is revalidated so a 304 keeps it without transferring the body.
+
+    With a `manifest` (verify.PackManifest), an existing `filename` is checked first: a valid one is kept
+    without a request when there is no cache entry to revalidate, a truncated or corrupt one is deleted and
+    downloaded again instead of being kept by the cache. Every pack written is recorded in the manifest.
+
+    Args:
+        pack_progress (PackProgress, optional): Counters updated as bytes arrive, for consumers to sample.
+        manifest (PackManifest, optional): Size and hash record of the valid packs in the output folder.
+
+    Returns:
+        bool: True if the pack was written or is already up to date, False otherwise.
+    """
+    Path(os.path.dirname(filename) or ".").mkdir(parents=True, exist_ok=True)
+    part_filename = filename + ".part"
+
+    entry = http_cache.lookup(cache_key) if http_cache else None
+    if entry is not None and entry.get("path") != filename:
+        entry = None
+    if manifest and os.path.exists(filename):
+        if not manifest.is_valid(filename):
+            if log:
+                log.warning(f"Existing pack is corrupt, downloading it again: {filename}")
+            os.remove(filename)
+            entry = None
+        elif entry is None:
+            if log:
+                log.info(f"Valid pack already downloaded: {filename}")
+            METRICS.inc("cache_requests_total", cache="pack", result="verified")
+            return True
+    if http_cache and http_cache.is_fresh(entry):
+        if log:
+            log.info(f"Pack cache hit: {filename}")
+        METRICS.inc("cache_requests_total", cache="pack", result="hit")
+        return True
+
+    conditional_headers = http_cache.conditional_headers(entry, filename) if http_cache else {}
+    started = time.perf_counter()
+    attempts = 0
+    while attempts < RETRY_POLICY.attempts:
+        if attempts:
+            METRICS.inc("download_retries_total", operation="pack")
+            time.sleep(RETRY_POLICY.backoff(attempts - 1))
+        attempts += 1
+        headers = dict(conditional_headers)
+        resume_from = os.path.getsize(part_filename) if os.path.exists(part_filename) else 0
+        if resume_from:
+            headers["Range"] = f"bytes={resume_from}-"
+
+        def _send(uri: str):
+            return client.send(client.build_request("GET", uri + ext, headers=headers), stream=True)
+
+        def _accept(response: httpx.Response):
+            if response.status_code == 304:
+                return bool(conditional_headers)
+            if response.status_code == 416:
+                return bool(resume_from)
+            return response.status_code in (200, 206)
+
+        try:
+            uri, stream_resp = open_first_with_retry(_send, fallback_urls, accept=_accept, hedge_after=hedge_after,
+                                                     operation="pack", log=log)
+        except httpx.HTTPError as err:
+            if log:
+                log.error(f"Stream Error: {err}")
+            break
+        if stream_resp is None:
+            break
+
+        try:
+            if log:
+                log.info(f"STATUS CODE STREAM {stream_resp.status_code}")
+            if stream_resp.status_code == 304:
+                if log:
+                    log.info(f"Pack not modified: {filename}")
+                http_cache.revalidated(cache_key, entry, stream_resp.headers, kind="pack", path=filename)
+                METRICS.inc("cache_requests_total", cache="pack", result="revalidated")
+                return True
+
+            if stream_resp.status_code == 206:
+                range_start, total = _parse_content_range(stream_resp.headers.get("Content-Range"))
+                if range_start != resume_from:
+                    if log:
+                        log.warning(f"Unexpected Content-Range, restarting: {stream_resp.headers.get('Content-Range')}")
+                    os.remove(part_filename)
+                    continue
+                mode = "ab"
+            elif stream_resp.status_code == 200:
+                resume_from = 0
+                total = int(stream_resp.headers.get("Content-Length", 0)) or None
+                mode = "wb"
+            else:
+                # 416: the part file is already as long as the resource, let the checks below decide
+                total = resume_from
+                mode = None
+
+            if log:
+                log.info(f"Total Size: {total}, resuming from: {resume_from}")
+            if pack_progress:
+                pack_progress.begin(total, resume_from)
+            if mode:
+                write_seconds = 0.0
+                written = 0
+                with open(part_filename, mode) as f:
+                    for chunk in stream_resp.iter_bytes(_chunk_size_for(total)):
+                        write_started = time.perf_counter()
+                        f.write(chunk)
+                        write_seconds += time.perf_counter() - write_started
+                        written += len(chunk)
+                        if pack_progress:
+                            pack_progress.advance(len(chunk))
+                METRICS.observe("disk_write_seconds", write_seconds, op="pack")
+                METRICS.inc("disk_written_bytes_total", written, op="pack")
+            response_headers = stream_resp.headers
+        except httpx.HTTPError as err:
+            if log:
+                log.error(f"Stream Error from {uri}: {err}")
+            MIRROR_STATS.record(uri, error=True)
+            MIRROR_BREAKERS.record(MIRROR_STATS.host_of(uri), False)
+            continue
+        finally:
+            stream_resp.close()
+
+        if total is not None and os.path.getsize(part_filename) != total:
+            if log:
+                log.error(f"Incomplete download: {os.path.getsize(part_filename)}/{total} bytes")
+            continue
+        check = check_zip(part_filename)
+        if not check["ok"]:
+            if log:
+                log.error(f"Downloaded pack failed the zip integrity check: {part_filename}: {check['error']}")
+            os.remove(part_filename)
+            continue
+
+        os.replace(part_filename, filename)
+        if manifest:
+            manifest.record(filename, check["sha256"])
+        if http_cache:
+            http_cache.store(cache_key, "pack", response_headers, path=filename)
+            METRICS.inc("cache_requests_total", cache="pack", result="miss")
+        mirror = MIRROR_STATS.host_of(uri)
+        METRICS.inc("pack_downloads_total", mirror=mirror, result="ok")
+        if log:
+            log.info("Pack stats: " + json.dumps({
+                "file": filename, "mirror": mirror, "bytes": os.path.getsize(filename), "resumed_from": resume_from,
+                "attempts": attempts, "seconds": round(time.perf_counter() - started, 3),
+            }))
+        return True
+    METRICS.inc("pack_downloads_total", mirror=None, result="failed")
+    return False
+
+
+def download_sticker_pack(client: httpx.Client, url: str, config, *, output_dir: str = "output",
+                          on_metadata=None, progress=None, log=None, http_cache=HTTP_CACHE,
+                          hedge_after: float = None):
+    """
+    Runs the whole single-pack flow: metadata -> Config.get_current_sticker_types -> zip.
+
+    Args:
+        client (httpx.Client): The client used for every request of this pack.
+        url (str): A sticker ID or store link.
+        config (Config): Supplies the platform and the sticker type mapping.
+        on_metadata (callable, optional): Called with the metadata dict once it is known.
+        progress (ProgressTracker, optional): Tracker this pack registers its PackProgress counters with.
+        http_cache (HttpCache, optional): Cache for metadata and packs. Defaults to HTTP_CACHE, None disables it.
+        hedge_after (float, optional): Seconds before racing the next mirror. Defaults to None, trying them in turn.
+
+    Returns:
+        dict: sticker_id, title, author, type, filename, ok and error of this pack.
+    """
+    result = {
+        "sticker_id": parse_sticker_id(url),
+        "title": None,
+        "author": None,
+        "type": None,
+        "filename": None,
+        "ok": False,
+        "error": None,
+    }
+    if not result["sticker_id"]:
+        result["error"] = "No Sticker ID Found"
+        return result
+
+    pack_progress = progress.start(result["sticker_id"]) if progress else None
+
+    def _finish(error: str = None):
+        result["error"] = error
+        if pack_progress:
+            pack_progress.finish(error)
+        return result
+
+    current_platform = config.get_current_platform()
+    fallback_urls = sticker_fallback_urls(result["sticker_id"], current_platform)
+
+    metadata = get_sticker_metadata(client, fallback_urls, log=log, http_cache=http_cache,
+                                    cache_key=f"{result['sticker_id']}_{current_platform}_productInfo.meta",
+                                    hedge_after=hedge_after)
+    if not metadata:
+        return _finish("Metadata not found")
+
+    result["title"] = metadata.get("title", {}).get("en")
+    result["author"] = metadata.get("author", {}).get("en")
+    result["type"] = metadata.get("stickerResourceType")
+    if on_metadata:
+        on_metadata(metadata)
+
+    sticker_uri = config.get_current_sticker_types(result["type"])
+    if log:
+        log.info(f"Sticker URI: {sticker_uri}")
+
+    filename = os.path.join(output_dir, f"{result['sticker_id']}_{current_platform}_{sticker_uri}")
+    if stream_sticker_pack(client, fallback_urls, sticker_uri, filename, pack_progress=pack_progress, log=log,
+                           http_cache=http_cache, cache_key=f"{result['sticker_id']}_{current_platform}_{sticker_uri}",
+                           hedge_after=hedge_after, manifest=manifest_for(output_dir)):
+        result["filename"] = filename
+        result["ok"] = True
+        return _finish()
+    return _finish("Error Downloading Sticker")
+
+
+def _find_local_file(output_dir: str, sticker_id: str, platform: str, name: str):
+    """
+    Looks for `name` in the per-sticker folder and in every extracted pack folder of the same product and platform.
+    """
+    for directory in sorted(Path(output_dir).glob(f"{sticker_id}_{platform}_*")):
+        path = directory / name
+        if directory.is_dir() and path.is_file() and path.stat().st_size > 0:
+            return str(path)
+    return None
+
+
+def fetch_sticker_file(client: httpx.Client, fallback_urls: list, file_uri: str, filename: str, *,
+                       pack_progress=None, hedge_after: float = None, store=None):
+    """
+    Downloads one sticker file from the first mirror that has it, through `filename.part` moved into place
+    once complete, via `store` (BlobStore) when given.
+
+    Returns:
+        int: The number of bytes written.
+
+    Raises:
+        httpx.HTTPError: When no mirror served the file in full.
+    """
+    uri, response = open_first_with_retry(
+        lambda base: client.send(client.build_request("GET", base + file_uri), stream=True),
+        fallback_urls, accept=lambda r: r.status_code == 200, hedge_after=hedge_after, operation="sticker")
+    if response is None:
+        raise httpx.HTTPError(f"No mirror has {file_uri}")
+
+    Path(os.path.dirname(filename)).mkdir(parents=True, exist_ok=True)
+    part_filename = filename + ".part"
+    try:
+        total = int(response.headers.get("Content-Length", 0)) or None
+        if pack_progress and total:
+            pack_progress.grow(total)
+        written = 0
+        digest = hashlib.sha256()
+        with open(part_filename, "wb") as f:
+            for chunk in response.iter_bytes(_chunk_size_for(total)):
+                f.write(chunk)
+                digest.update(chunk)
+                written += len(chunk)
+                if pack_progress:
+                    pack_progress.advance(len(chunk))
+    except httpx.HTTPError:
+        MIRROR_STATS.record(uri, error=True)
+        MIRROR_BREAKERS.record(MIRROR_STATS.host_of(uri), False)
+        raise
+    finally:
+        response.close()
+    if total is not None and written != total:
+        os.remove(part_filename)
+        raise httpx.RemoteProtocolError(f"Incomplete download of {file_uri}: {written}/{total} bytes")
+    if store:
+        store.adopt(part_filename, filename, digest.hexdigest())
+    else:
+        os.replace(part_filename, filename)
+    METRICS.inc("disk_written_bytes_total", written, op="sticker")
+    return written
+
+
+def download_sticker_files(client: httpx.Client, url: str, config, *, output_dir: str = "output",
+                           on_metadata=None, progress=None, log=None, http_cache=HTTP_CACHE,
+                           hedge_after: float = None, workers: int = STICKER_FILE_WORKERS):
+    """
+    Downloads single sticker files of a pack instead of its zip: metadata -> "stickers" list ->
+    Config.get_current_sticker_files, fetched concurrently.
+
+    Files go to `output_dir/<sticker id>_<platform>_stickers/` under the same names as inside the pack zips,
+    deduplicated through the blob store of `output_dir`.
+    A file already present there, or in an extracted pack folder of the same product, is not fetched again,
+    so a later run only transfers stickers that are new or were asked for since.
+
+    Args:
+        config (Config): Supplies the platform, the file types (sticker_files) and the sticker subset (sticker_ids).
+        workers (int, optional): Files fetched at once. Defaults to 8.
+
+    Returns:
+        dict: The same keys as download_sticker_pack, filename being the folder, plus the downloaded, skipped and
+        failed file counts and the bytes transferred.
+    """
+    result = {
+        "sticker_id": parse_sticker_id(url),
+        "title": None,
+        "author": None,
+        "type": None,
+        "filename": None,
+        "ok": False,
+        "error": None,
+        "downloaded": 0,
+        "skipped": 0,
+        "failed": 0,
+        "bytes": 0,
+    }
+    if not result["sticker_id"]:
+        result["error"] = "No Sticker ID Found"
+        return result
+
+    pack_progress = progress.start(result["sticker_id"]) if progress else None
+
+    def _finish(error: str = None):
+        result["error"] = error
+        if pack_progress:
+            pack_progress.finish(error)
+        return result
+
+    current_platform = config.get_current_platform()
+    metadata = get_sticker_metadata(client, sticker_fallback_urls(result["sticker_id"], current_platform), log=log,
+                                    http_cache=http_cache,
+                                    cache_key=f"{result['sticker_id']}_{current_platform}_productInfo.meta",
+                                    hedge_after=hedge_after)
+    if not metadata:
+        return _finish("Metadata not found")
+
+    result["title"] = metadata.get("title", {}).get("en")
+    result["author"] = metadata.get("author", {}).get("en")
+    result["type"] = metadata.get("stickerResourceType")
+    if on_metadata:
+        on_metadata(metadata)
+
+    sticker_ids = [str(sticker["id"]) for sticker in metadata.get("stickers", [])]
+    if config.sticker_ids:
+        wanted = {str(sticker_id) for sticker_id in config.sticker_ids}
+        sticker_ids = [sticker_id for sticker_id in sticker_ids if sticker_id in wanted]
+    file_types = config.get_current_sticker_files(result["type"])
+    directory = os.path.join(output_dir, f"{result['sticker_id']}_{current_platform}_stickers")
+    result["filename"] = directory
+
+    jobs = []
+    for sticker_id in sticker_ids:
+        for file_type in file_types:
+            file_uri, name = config.TYPES_STICKER_FILE[file_type]
+            name = name.format(id=sticker_id)
+            if _find_local_file(output_dir, result["sticker_id"], current_platform, name):
+                result["skipped"] += 1
+                continue
+            jobs.append((sticker_id, file_uri, os.path.join(directory, name)))
+    METRICS.inc("sticker_files_total", result["skipped"], result="skipped")
+    if log:
+        log.info(f"Sticker files: {len(jobs)} to fetch, {result['skipped']} already present, types {file_types}")
+    if pack_progress:
+        pack_progress.begin(0)
+
+    def _fetch(job):
+        sticker_id, file_uri, filename = job
+        try:
+            # Opening is retried inside, this only covers bodies that break off once the response is open
+            return RETRY_POLICY.call(
+                lambda: fetch_sticker_file(client, sticker_file_urls(sticker_id, current_platform), file_uri,
+                                           filename, pack_progress=pack_progress, hedge_after=hedge_after,
+                                           store=store),
+                operation="sticker", log=log, retry_on=(httpx.RemoteProtocolError, httpx.ReadError))
+        except (httpx.HTTPError, OSError) as err:
+            if log:
+                log.error(f"Failed to fetch {file_uri} of sticker {sticker_id}: {err}")
+            return None
+
+    store = store_for(output_dir)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for written in executor.map(_fetch, jobs):
+            if written is None:
+                result["failed"] += 1
+            else:
+                result["downloaded"] += 1
+                result["bytes"] += written
+    METRICS.inc("sticker_files_total", result["downloaded"], result="ok")
+    METRICS.inc("sticker_files_total", result["failed"], result="failed")
+    if log:
+        log.info("Sticker file stats: " + json.dumps({
+            "directory": directory, "downloaded": result["downloaded"], "skipped": result["skipped"],
+            "failed": result["failed"], "bytes": result["bytes"], "seconds": round(time.perf_counter() - started, 3),
+        }))
+    if result["failed"]:
+        return _finish(f"{result['failed']} sticker files failed")
+    result["ok"] = True
+    return _finish()
+
+
 if __name__ == '__main__':
     headers = {
         'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/84.0.4147.89 Safari/537.36'
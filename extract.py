@@ -0,0 +1,160 @@
+import os
+import json
+import hashlib
+import zipfile
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from metrics import METRICS
+from progress import ProgressTracker
+from store import HASH_CHUNK_SIZE, store_for
+from verify import manifest_for
+
+MANIFEST_FILE = ".manifest.json"
+
+
+def _zip_members(zip_ref: zipfile.ZipFile):
+    return {info.filename: {"crc": info.CRC, "size": info.file_size}
+            for info in zip_ref.infolist() if not info.is_dir()}
+
+
+def is_extracted(zip_path: str, extract_dir: str):
+    """
+    Tells whether `extract_dir` already holds a complete extraction of `zip_path`.
+
+    The manifest written by extract_zip must list the same member names and CRCs as the archive's central
+    directory, and every member must exist on disk with its uncompressed size.
+    """
+    try:
+        with open(os.path.join(extract_dir, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        with zipfile.ZipFile(zip_path) as zip_ref:
+            members = _zip_members(zip_ref)
+    except (OSError, ValueError, zipfile.BadZipFile):
+        return False
+
+    if manifest.get("members") != members:
+        return False
+    for name, member in members.items():
+        path = os.path.join(extract_dir, name)
+        if not os.path.isfile(path) or os.path.getsize(path) != member["size"]:
+            return False
+    return True
+
+
+def _member_path(extract_dir: str, name: str):
+    """
+    Maps a member name to a path inside `extract_dir`, dropping drive letters and "." / ".." parts the
+    same way ZipFile.extract does.
+    """
+    name = os.path.splitdrive(name.replace("/", os.path.sep))[1]
+    parts = [part for part in name.split(os.path.sep) if part not in ("", os.path.curdir, os.path.pardir)]
+    return os.path.join(extract_dir, *parts)
+
+
+def _extract_member(zip_ref: zipfile.ZipFile, info: zipfile.ZipInfo, extract_dir: str, store=None):
+    """
+    Writes one member to a part file and moves it into place, through `store` when given. An existing file
+    is replaced rather than written through, as it may be a hardlink shared with other folders.
+    """
+    path = _member_path(extract_dir, info.filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    part_path = path + ".part"
+    digest = hashlib.sha256()
+    with zip_ref.open(info) as source, open(part_path, "wb") as target:
+        for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+            target.write(chunk)
+    if store:
+        store.adopt(part_path, path, digest.hexdigest())
+    else:
+        os.replace(part_path, path)
+
+
+def extract_zip(zip_path: str, extract_dir: str, *, pack_progress=None, store=None):
+    """
+    Extracts `zip_path` into `extract_dir` member by member and writes the manifest last, so an
+    interrupted extraction is never mistaken for a complete one.
+
+    Args:
+        store (BlobStore, optional): Keeps each member body once across every extracted folder.
+    """
+    with METRICS.time("disk_write_seconds", op="extract"), zipfile.ZipFile(zip_path) as zip_ref:
+        members = _zip_members(zip_ref)
+        if pack_progress:
+            pack_progress.begin(sum(member["size"] for member in members.values()))
+        for info in zip_ref.infolist():
+            if info.is_dir():
+                os.makedirs(_member_path(extract_dir, info.filename), exist_ok=True)
+            else:
+                _extract_member(zip_ref, info, extract_dir, store)
+            if pack_progress:
+                pack_progress.advance(info.file_size)
+    METRICS.inc("disk_written_bytes_total", sum(member["size"] for member in members.values()), op="extract")
+    write_manifest(extract_dir, os.path.basename(zip_path), members)
+
+
+def write_manifest(extract_dir: str, source: str, members: dict):
+    """
+    Marks `extract_dir` as a complete extraction of the zip named `source`, whose members map each name to
+    its crc and size.
+    """
+    manifest_path = os.path.join(extract_dir, MANIFEST_FILE)
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"source": source, "members": members}, f)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def extract_all(folder: str = "output", *, workers: int = None, progress: ProgressTracker = None, on_result=None):
+    """
+    Extracts every .zip in `folder` into `folder/<zip stem>` on a thread pool, skipping archives whose
+    extract directory is already complete. Archives that fail verification (a truncated or corrupt
+    download) are reported without extracting anything. Files are deduplicated through the blob store of
+    `folder`.
+
+    Args:
+        workers (int, optional): Size of the thread pool. Defaults to the CPU count.
+        progress (ProgressTracker, optional): Receives one PackProgress per archive, counted in uncompressed bytes.
+        on_result (callable, optional): Called with each result dict as soon as its archive is done.
+
+    Returns:
+        list: One dict per archive with zip, extract_dir, skipped, ok and error.
+    """
+    zip_paths = sorted(str(path) for path in Path(folder).glob("*.zip"))
+
+    def _extract(zip_path: str):
+        extract_dir = os.path.join(folder, Path(zip_path).stem)
+        result = {"zip": zip_path, "extract_dir": extract_dir, "skipped": False, "ok": True, "error": None}
+        pack_progress = progress.start(Path(zip_path).name) if progress else None
+        try:
+            if is_extracted(zip_path, extract_dir):
+                result["skipped"] = True
+            elif not manifest_for(folder).is_valid(zip_path):
+                result["ok"] = False
+                result["error"] = "Corrupt or incomplete zip, download it again"
+            else:
+                extract_zip(zip_path, extract_dir, pack_progress=pack_progress, store=store_for(folder))
+        except (OSError, zipfile.BadZipFile) as err:
+            result["ok"] = False
+            result["error"] = str(err)
+        if pack_progress:
+            pack_progress.finish(result["error"])
+        return result
+
+    results = []
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 4) as executor:
+        futures = [executor.submit(_extract, zip_path) for zip_path in zip_paths]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if on_result:
+                on_result(result)
+    return results
+
+
+if __name__ == '__main__':
+    import sys
+
+    for result in extract_all(sys.argv[1] if len(sys.argv) > 1 else "output"):
+        status = "failed" if not result["ok"] else "skipped" if result["skipped"] else "extracted"
+        print(f"{status}: {result['zip']}" + (f" ({result['error']})" if result["error"] else ""))
@@ -1,18 +1,45 @@
 import os
+import time
 import asyncio
+from functools import partial
 from dearpygui import dearpygui as dpg
-from scraper import scrape_line_store_stickers_test
+from scraper import crawl_showcase, cache_thumbnails
+from catalog import CATALOG
+from batch import BatchDownloader
+from background import BackgroundLoop
+from textures import THUMBNAIL_SIZE, TexturePool, load_thumbnail
+
+PROGRESS_UPDATE_INTERVAL = 0.1
+# Rows built above and below the visible part of the sticker table
+ROW_OVERSCAN = 4
+TEXTURE_POOL_SIZE = 64
 
 
 class LineStickerDownloader:
     def __init__(self):
-        self.loop = asyncio.new_event_loop()
-        self.sticker_data = []
+        # Network and disk work runs here, results come back to the render loop through its queue
+        self.background = BackgroundLoop()
         self._loading_stickers = False
+        self.catalog_page = 1
+        self.catalog_count = 0
+        # Sticker table: catalog rows by index, filled a catalog page at a time as they scroll into view
+        self._rows = {}
+        self._pages_loading = set()
+        self._row_slots = []
+        self._row_height = THUMBNAIL_SIZE + 8
+        self._visible_range = None
+        self._visible_keys = set()
+        self._rows_dirty = True
+        self._thumbnails_loading = set()
+        self._thumbnails_missing = set()
+        self._bulk_downloading = False
+        self._next_progress_update = 0.0
+        self.batch_downloader = BatchDownloader()
         self._setup()
 
     def _setup(self):
         self._setup_dpg()
+        self.texture_pool = TexturePool(TEXTURE_POOL_SIZE)
         self._create_windows()
         # self._create_ui()
 
@@ -94,18 +121,41 @@ class LineStickerDownloader:
                 dpg.add_button(label="<<", callback=self._previous_page_callback)
                 dpg.add_button(label=">>", callback=self._next_page_callback)
                 dpg.add_spacer(width=15)
+                dpg.add_input_int(
+                    label="to", tag="showcase_start_page", default_value=1, min_value=1, min_clamped=True, width=90
+                )
+                dpg.add_input_int(
+                    label="pages", tag="showcase_end_page", default_value=5, min_value=1, min_clamped=True, width=90
+                )
                 dpg.add_button(
                     label="Reload Stickers", callback=self._reload_stickers_callback
                 )
-            self._create_sticker_table()
+                dpg.add_loading_indicator(tag="sticker_loading", show=False, radius=1.2)
+                dpg.add_text("", tag="sticker_range")
+            with dpg.child_window(tag="sticker_scroll", border=False):
+                self._create_sticker_table()
 
     def _create_sticker_table(self):
-        with dpg.table(
-            header_row=True, resizable=True, tag="sticker_table", parent="store_tab"
-        ):
+        # Only the rows around the viewport exist; the spacer rows stand in for the rest of the catalog
+        with dpg.table(header_row=True, resizable=True, tag="sticker_table"):
             dpg.add_table_column(label="Sticker Name & Link", width_stretch=True)
-            dpg.add_table_column(label="Image", width_stretch=True)
+            dpg.add_table_column(label="Image", width_fixed=True, init_width_or_weight=THUMBNAIL_SIZE)
             dpg.add_table_column(label="Action")
+            with dpg.table_row(tag="sticker_top_spacer"):
+                dpg.add_spacer(tag="sticker_top_space", height=0)
+            with dpg.table_row(tag="sticker_bottom_spacer"):
+                dpg.add_spacer(tag="sticker_bottom_space", height=0)
+
+    def _add_row_slot(self):
+        with dpg.table_row(parent="sticker_table", before="sticker_bottom_spacer") as row:
+            with dpg.group() as info:
+                text = dpg.add_text("")
+                with dpg.group(horizontal=True):
+                    dpg.add_button(label="copy link", callback=lambda: print("copy link"))
+                    dpg.add_button(label="open link", callback=lambda: print("open link"))
+            image = dpg.add_image(self.texture_pool.placeholder, width=THUMBNAIL_SIZE, height=THUMBNAIL_SIZE)
+            dpg.add_button(label="Download", callback=lambda: print("Download"))
+        self._row_slots.append({"row": row, "info": info, "text": text, "image": image})
 
     def _create_manual_tab(self):
         with dpg.tab(label="Manual"):
@@ -127,7 +177,13 @@ class LineStickerDownloader:
                             hint="Bulk ID/Link",
                             multiline=True,
                         )
-                        dpg.add_button(label="Download")
+                        dpg.add_button(
+                            label="Download", callback=self._bulk_download_callback
+                        )
+                        dpg.add_progress_bar(
+                            tag="bulk_progress", default_value=0.0, overlay="Waiting..."
+                        )
+                        dpg.add_text("", tag="bulk_status")
 
     def _create_theme_mode_group(self):
         with dpg.group(tag="theme_mode_group", show=False):
@@ -150,82 +206,217 @@ class LineStickerDownloader:
     def _open_github(self):
         os.system("start https://github.com/j3rr7/Line-Sticker-Downloader/")
 
-    async def _collect_stickers(self):
-        return await scrape_line_store_stickers_test()
+    async def _collect_stickers(self, number, start_page, end_page):
+        await crawl_showcase(start_page, end_page)
+        return await self._collect_catalog_page(number, download_images=True)
+
+    async def _collect_catalog_page(self, number, download_images=False):
+        # Without download_images: catalog rows and cached thumbnails only, scrolling never touches the network
+        stickers = await asyncio.to_thread(CATALOG.page, number)
+        count = await asyncio.to_thread(CATALOG.count)
+        stickers = await cache_thumbnails(stickers, download_images=download_images)
+        return number, count, stickers
+
+    def _store_catalog_page(self, number, count, stickers):
+        self.catalog_count = count
+        first = (number - 1) * CATALOG.PAGE_SIZE
+        for offset, sticker in enumerate(stickers):
+            self._rows[first + offset] = sticker
+        self._rows_dirty = True
+
+    def _request_catalog_page(self, number):
+        if self._loading_stickers or number in self._pages_loading:
+            return
+        self._pages_loading.add(number)
+        self.background.submit(
+            self._collect_catalog_page(number), on_done=partial(self._callback_catalog_page_loaded, number)
+        )
+
+    def _callback_catalog_page_loaded(self, number, future):
+        self._pages_loading.discard(number)
+        try:
+            self._store_catalog_page(*future.result())
+        except Exception as err:
+            print(f"Error collecting stickers: {err}")
+
+    def _callback_catalog_count(self, future):
+        try:
+            self.catalog_count = future.result()
+        except Exception as err:
+            print(f"Error counting stickers: {err}")
+            return
+        self._rows_dirty = True
 
-    def _callback_stickers_data_collected(self, task):
-        self._loading_stickers = False
-        stickers = task.result()
-        print("Stickers collected", stickers)
-        self._update_sticker_table(stickers)
-
-    def _add_and_load_image(self, image_path, parent=None):
-        width, height, channels, data = dpg.load_image(image_path)
-
-        with dpg.texture_registry() as reg_id:
-            texture_id = dpg.add_static_texture(width, height, data, parent=reg_id)
-
-        if parent is None:
-            return dpg.add_image(texture_id)
-        else:
-            return dpg.add_image(texture_id, parent=parent)
-
-    def _update_sticker_table(self, stickers):
-        if dpg.does_item_exist("sticker_table"):
-            dpg.delete_item("sticker_table")
-
-        self._create_sticker_table()
-        # Add stickers to the table here
-        for index, sticker in enumerate(stickers):
-            with dpg.table_row(parent="sticker_table", tag=f"sticker_row_{index}"):
-                with dpg.group():
-                    dpg.add_text(f"{sticker['name']}\n{sticker['link']}")
-                    dpg.add_button(label="copy link", callback=lambda: print("copy link"))
-                    dpg.add_button(label="open link", callback=lambda: print("open link"))
-                    
-                self._add_and_load_image(
-                    image_path=sticker["cached_image"], parent=f"sticker_row_{index}"
-                )
-                dpg.add_button(label="Download", callback=lambda: print("Download"))
+    def _request_thumbnail(self, sticker):
+        key = sticker["image_url"]
+        if key in self._thumbnails_loading or key in self._thumbnails_missing:
+            return
+        self._thumbnails_loading.add(key)
+        self.background.run_in_thread(
+            load_thumbnail, sticker["cached_image"], on_done=partial(self._callback_thumbnail_loaded, key)
+        )
+
+    def _callback_thumbnail_loaded(self, key, future):
+        self._thumbnails_loading.discard(key)
+        try:
+            data = future.result()
+        except Exception as err:
+            print(f"Error loading thumbnail {key}: {err}")
+            data = None
+        if data is None:
+            self._thumbnails_missing.add(key)
+        elif key in self._visible_keys:
+            # Rows scrolled away meanwhile are dropped rather than evicting a texture still on screen
+            self.texture_pool.put(key, data)
+            self._rows_dirty = True
+
+    def _measure_row_height(self):
+        """
+        Takes the row pitch from the first two row slots once they have been laid out.
+        """
+        if len(self._row_slots) < 2:
+            return
+        first, second = (dpg.get_item_pos(slot["info"])[1] for slot in self._row_slots[:2])
+        if dpg.is_item_shown(self._row_slots[1]["row"]) and second > first:
+            self._row_height = second - first
+
+    def _update_visible_rows(self):
+        """
+        Points the row slots at the catalog rows in and around the viewport. Cheap when nothing changed,
+        so it runs every frame.
+        """
+        self._measure_row_height()
+        scroll = dpg.get_y_scroll("sticker_scroll")
+        view_height = dpg.get_item_rect_size("sticker_scroll")[1] or dpg.get_viewport_client_height()
+        first = max(0, int(scroll // self._row_height) - ROW_OVERSCAN)
+        last = min(self.catalog_count, int((scroll + view_height) // self._row_height) + 1 + ROW_OVERSCAN)
+        first = min(first, last)
+        if not self._rows_dirty and (first, last) == self._visible_range:
+            return
+        self._visible_range = (first, last)
+        self._rows_dirty = False
+
+        while len(self._row_slots) < last - first:
+            self._add_row_slot()
+        dpg.configure_item("sticker_top_space", height=int(first * self._row_height))
+        dpg.configure_item("sticker_bottom_space", height=int((self.catalog_count - last) * self._row_height))
+
+        self._visible_keys = {self._rows[index]["image_url"] for index in range(first, last) if index in self._rows}
+        for offset, slot in enumerate(self._row_slots):
+            index = first + offset
+            dpg.configure_item(slot["row"], show=index < last)
+            if index >= last:
+                continue
+            sticker = self._rows.get(index)
+            if sticker is None:
+                dpg.set_value(slot["text"], "Loading...")
+                dpg.configure_item(slot["image"], texture_tag=self.texture_pool.placeholder)
+                self._request_catalog_page(index // CATALOG.PAGE_SIZE + 1)
+                continue
+            dpg.set_value(slot["text"], f"{sticker['name']}\n{sticker['link']}")
+            texture = self.texture_pool.get(sticker["image_url"])
+            dpg.configure_item(slot["image"], texture_tag=texture or self.texture_pool.placeholder)
+            if texture is None:
+                self._request_thumbnail(sticker)
+
+        self.catalog_page = first // CATALOG.PAGE_SIZE + 1
+        dpg.set_value("sticker_range", f"{first + 1 if last else 0}-{last} of {self.catalog_count}")
 
     def _reload_stickers_callback(self):
         if self._loading_stickers:
             return
         self._loading_stickers = True
+        dpg.show_item("sticker_loading")
+        start_page = dpg.get_value("showcase_start_page")
+        end_page = max(start_page, dpg.get_value("showcase_end_page"))
+        self.background.submit(
+            self._collect_stickers(self.catalog_page, start_page, end_page),
+            on_done=self._callback_stickers_reloaded,
+        )
+
+    def _callback_stickers_reloaded(self, future):
+        self._loading_stickers = False
+        dpg.hide_item("sticker_loading")
+        try:
+            stickers_data = future.result()
+        except Exception as err:
+            print(f"Error collecting stickers: {err}")
+            return
+        print("Stickers collected", len(stickers_data[2]))
+        self._rows.clear()
+        self._pages_loading.clear()
+        self._thumbnails_missing.clear()
+        self._store_catalog_page(*stickers_data)
+
+    def _bulk_download_callback(self):
+        if self._bulk_downloading:
+            return
+        sticker_ids = (dpg.get_value("bulk_input") or "").splitlines()
+        if not sticker_ids:
+            return
+        self._bulk_downloading = True
+        dpg.set_value("bulk_status", "Downloading...")
+
+        self.background.run_in_thread(
+            self.batch_downloader.run, sticker_ids, on_done=self._callback_bulk_download_finished
+        )
+
+    def _update_bulk_progress(self):
+        snapshot = self.batch_downloader.progress.snapshot()
+        dpg.configure_item(
+            "bulk_progress",
+            default_value=snapshot["fraction"],
+            overlay=f"{snapshot['done'] + snapshot['failed']}/{len(snapshot['packs'])} packs, "
+            f"{snapshot['downloaded'] // 1024}/{snapshot['total'] // 1024} KiB",
+        )
+
+    def _callback_bulk_download_finished(self, future):
+        self._bulk_downloading = False
+        self._update_bulk_progress()
+        try:
+            results = future.result()
+        except Exception as err:
+            print(f"Error downloading stickers: {err}")
+            dpg.set_value("bulk_status", f"Download failed: {err}")
+            return
+        failed = [result["sticker_id"] for result in results if not result["ok"]]
+        dpg.set_value(
+            "bulk_status",
+            f"Downloaded {len(results) - len(failed)}/{len(results)}"
+            + (f"\nFailed: {', '.join(failed)}" if failed else ""),
+        )
 
-        if dpg.does_item_exist("sticker_table"):
-            dpg.delete_item("sticker_table")
-
-        self._create_sticker_table()
-
-        with dpg.table_row(parent="sticker_table", tag="loading_sticker_indicator"):
-            dpg.add_loading_indicator(parent="loading_sticker_indicator")
-            dpg.add_loading_indicator(parent="loading_sticker_indicator")
-            dpg.add_loading_indicator(parent="loading_sticker_indicator")
-
-        task = self.loop.create_task(self._collect_stickers())
-        task.add_done_callback(self._callback_stickers_data_collected)
+    def _scroll_rows(self, rows):
+        scroll = dpg.get_y_scroll("sticker_scroll") + rows * self._row_height
+        dpg.set_y_scroll("sticker_scroll", max(0.0, scroll))
 
     def _previous_page_callback(self, sender, app_data, user_data):
-        pass
+        self._scroll_rows(-CATALOG.PAGE_SIZE)
 
     def _next_page_callback(self, sender, app_data, user_data):
-        pass
+        self._scroll_rows(CATALOG.PAGE_SIZE)
 
     def _quit_callback(self):
-        self.loop.stop()
         dpg.stop_dearpygui()
 
-    async def _run_dpg(self):
+    def _run_dpg(self):
+        # Only UI work happens here, render_dearpygui_frame paces the loop at the display rate
         while dpg.is_dearpygui_running():
+            self.background.drain()
+            self._update_visible_rows()
+            if self._bulk_downloading and time.monotonic() >= self._next_progress_update:
+                self._next_progress_update = time.monotonic() + PROGRESS_UPDATE_INTERVAL
+                self._update_bulk_progress()
             dpg.render_dearpygui_frame()
-            await asyncio.sleep(0.01)
 
     def run(self):
         dpg.set_primary_window("main_window", True)
         dpg.setup_dearpygui()
         dpg.show_viewport()
-        self.loop.run_until_complete(self._run_dpg())
+        self.background.start()
+        self.background.run_in_thread(CATALOG.count, on_done=self._callback_catalog_count)
+        self._run_dpg()
+        self.background.stop()
         dpg.destroy_context()
 
 
@@ -0,0 +1,341 @@
+import os
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+
+from metrics import METRICS
+
+STATES = ("queued", "running", "done", "failed")
+
+
+def worker_name():
+    """
+    Names the current process in the queue as `host:pid`. Threads of one process may append their own
+    `:suffix`; heartbeat() refreshes the jobs of all of them.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobQueue:
+    """
+    Durable SQLite queue of sticker IDs to download, shared by the threads and processes of bulk runs.
+
+    Every sticker ID is one job, so submitting an ID again only raises its priority (and re-queues it when
+    it had failed) instead of downloading it twice. A job goes queued -> running -> done, or back to queued
+    after an error until `max_attempts` is used up, then failed; its attempts and last error are kept.
+    Within a priority, jobs run in the order they were queued, so a retried job goes to the back.
+
+    claim() takes the next job in one write transaction (BEGIN IMMEDIATE), so several worker processes on
+    the same host can drain one queue without handing out a job twice. A running job holds a lease of
+    `lease` seconds that its worker keeps renewing through heartbeat() (see Heartbeat); recover() puts jobs
+    whose lease ran out back in the queue, which is how a killed or crashed run picks up where it stopped.
+    No process is probed or signalled, so this works the same on every platform.
+    """
+
+    def __init__(self, path: str = "jobs.db", *, max_attempts: int = 3, timeout: float = 30.0,
+                 lease: float = 60.0):
+        self.path = path
+        self.max_attempts = max(1, max_attempts)
+        self.timeout = timeout
+        self.lease = lease
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def _connect(self):
+        """
+        Opens the database on first use. Callers hold self._lock.
+        """
+        if self._connection is None:
+            # Autocommit mode, transactions are opened explicitly so claims can take the write lock up front
+            self._connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                                               check_same_thread=False)
+            self._connection.row_factory = sqlite3.Row
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    sticker_id TEXT PRIMARY KEY,
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    state TEXT NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    worker TEXT,
+                    heartbeat REAL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_next ON jobs (state, priority DESC, updated_at)"
+            )
+        return self._connection
+
+    def _write(self, statements):
+        """
+        Runs `statements(connection)` in one write transaction and returns what it returns.
+        """
+        with self._lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                result = statements(connection)
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+            return result
+
+    def submit(self, sticker_ids, *, priority: int = 0, retry_failed: bool = True, redo: bool = False):
+        """
+        Adds sticker IDs to the queue, skipping duplicates.
+
+        Args:
+            sticker_ids (list): Sticker IDs, already parsed.
+            priority (int): Higher runs first. A queued job submitted again keeps the higher of both.
+            retry_failed (bool): Put failed jobs back in the queue with a fresh attempt budget.
+            redo (bool): Also put jobs that are done back in the queue.
+
+        Returns:
+            int: Number of jobs that were added or put back in the queue.
+        """
+        requeue_states = ["failed"] * retry_failed + ["done"] * redo
+
+        def _submit(connection):
+            now = time.time()
+            added = 0
+            for sticker_id in dict.fromkeys(sticker_ids):
+                row = connection.execute("SELECT state FROM jobs WHERE sticker_id = ?", (sticker_id,)).fetchone()
+                if row is None:
+                    connection.execute(
+                        "INSERT INTO jobs (sticker_id, priority, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                        (sticker_id, priority, now, now),
+                    )
+                    added += 1
+                elif row["state"] in requeue_states:
+                    connection.execute(
+                        "UPDATE jobs SET state = 'queued', priority = ?, attempts = 0, worker = NULL, "
+                        "updated_at = ? WHERE sticker_id = ?",
+                        (priority, now, sticker_id),
+                    )
+                    added += 1
+                else:
+                    connection.execute(
+                        "UPDATE jobs SET priority = MAX(priority, ?) WHERE sticker_id = ?", (priority, sticker_id)
+                    )
+            return added
+
+        added = self._write(_submit)
+        METRICS.inc("jobs_submitted_total", added)
+        return added
+
+    def claim(self, worker: str = None):
+        """
+        Marks the next queued job as running for `worker` and counts the attempt.
+
+        Returns:
+            dict | None: The job, or None when nothing is queued.
+        """
+        worker = worker or worker_name()
+
+        def _claim(connection):
+            row = connection.execute(
+                "SELECT sticker_id FROM jobs WHERE state = 'queued' ORDER BY priority DESC, updated_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE jobs SET state = 'running', attempts = attempts + 1, worker = ?, heartbeat = ?, "
+                "updated_at = ? WHERE sticker_id = ?",
+                (worker, time.time(), time.time(), row["sticker_id"]),
+            )
+            return dict(connection.execute("SELECT * FROM jobs WHERE sticker_id = ?",
+                                           (row["sticker_id"],)).fetchone())
+
+        return self._write(_claim)
+
+    def complete(self, sticker_id: str):
+        self._write(lambda connection: connection.execute(
+            "UPDATE jobs SET state = 'done', last_error = NULL, worker = NULL, heartbeat = NULL, updated_at = ? WHERE sticker_id = ?",
+            (time.time(), sticker_id),
+        ))
+        METRICS.inc("jobs_finished_total", state="done")
+
+    def fail(self, sticker_id: str, error: str, *, retry: bool = True):
+        """
+        Records a failed attempt. The job goes back in the queue unless `retry` is False or it has used up
+        max_attempts.
+
+        Returns:
+            str: The job's new state, "queued" or "failed".
+        """
+        def _fail(connection):
+            row = connection.execute("SELECT attempts FROM jobs WHERE sticker_id = ?", (sticker_id,)).fetchone()
+            state = "queued" if retry and row is not None and row["attempts"] < self.max_attempts else "failed"
+            connection.execute(
+                "UPDATE jobs SET state = ?, last_error = ?, worker = NULL, heartbeat = NULL, updated_at = ? WHERE sticker_id = ?",
+                (state, error, time.time(), sticker_id),
+            )
+            return state
+
+        state = self._write(_fail)
+        METRICS.inc("jobs_finished_total", state="retry" if state == "queued" else "failed")
+        return state
+
+    def heartbeat(self, worker: str = None):
+        """
+        Renews the lease of every job running for `worker` or one of its `worker:suffix` threads.
+
+        Returns:
+            int: Number of jobs renewed.
+        """
+        worker = worker or worker_name()
+        return self._write(lambda connection: connection.execute(
+            "UPDATE jobs SET heartbeat = ? WHERE state = 'running' AND (worker = ? OR worker LIKE ? ESCAPE '\\')",
+            (time.time(), worker, worker.replace("%", r"\%").replace("_", r"\_") + ":%"),
+        ).rowcount)
+
+    def recover(self, *, all_workers: bool = False):
+        """
+        Puts jobs whose lease ran out, their worker having stopped renewing it, back in the queue. Their
+        attempt stays counted, so a pack that crashes the process every time ends up failed.
+
+        Args:
+            all_workers (bool): Requeue every running job, for when no other process uses the queue.
+
+        Returns:
+            int: Number of jobs put back.
+        """
+        def _recover(connection):
+            expired_before = float("inf") if all_workers else time.time() - self.lease
+            stale = connection.execute(
+                "SELECT sticker_id, attempts FROM jobs WHERE state = 'running' AND COALESCE(heartbeat, 0) < ?",
+                (expired_before,),
+            ).fetchall()
+            now = time.time()
+            for row in stale:
+                connection.execute(
+                    "UPDATE jobs SET state = ?, last_error = COALESCE(last_error, 'worker stopped'), worker = NULL, "
+                    "heartbeat = NULL, updated_at = ? WHERE sticker_id = ?",
+                    ("queued" if row["attempts"] < self.max_attempts else "failed", now, row["sticker_id"]),
+                )
+            return len(stale)
+
+        recovered = self._write(_recover)
+        if recovered:
+            METRICS.inc("jobs_recovered_total", recovered)
+        return recovered
+
+    def requeue(self, *, state: str = "failed"):
+        """
+        Puts every job in `state` back in the queue with a fresh attempt budget.
+
+        Returns:
+            int: Number of jobs put back.
+        """
+        return self._write(lambda connection: connection.execute(
+            "UPDATE jobs SET state = 'queued', attempts = 0, worker = NULL, updated_at = ? WHERE state = ?",
+            (time.time(), state),
+        ).rowcount)
+
+    def purge(self, *, state: str = "done"):
+        """
+        Deletes every job in `state`. Returns the number deleted.
+        """
+        return self._write(lambda connection: connection.execute(
+            "DELETE FROM jobs WHERE state = ?", (state,)
+        ).rowcount)
+
+    def counts(self):
+        """
+        Returns:
+            dict: Number of jobs in each state.
+        """
+        with self._lock:
+            rows = self._connect().execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        counts = dict.fromkeys(STATES, 0)
+        counts.update({row[0]: row[1] for row in rows})
+        return counts
+
+    def jobs(self, state: str = None):
+        """
+        Returns the jobs in `state` (or all of them) as dictionaries, in the order they would be claimed.
+        """
+        query = "SELECT * FROM jobs"
+        params = ()
+        if state:
+            query += " WHERE state = ?"
+            params = (state,)
+        with self._lock:
+            rows = self._connect().execute(query + " ORDER BY priority DESC, updated_at", params).fetchall()
+        return [dict(row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+class Heartbeat(threading.Thread):
+    """
+    Renews the leases of `worker`'s jobs every third of the queue's lease until stopped, and puts jobs of
+    stopped workers back in the queue on the way.
+
+        with Heartbeat(queue, worker_name()):
+            drain(queue)
+    """
+
+    def __init__(self, queue: JobQueue, worker: str = None):
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.worker = worker or worker_name()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.queue.lease / 3):
+            try:
+                self.queue.heartbeat(self.worker)
+                self.queue.recover()
+            except sqlite3.Error as err:
+                print(f"Job queue heartbeat failed: {err}")
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+        return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect and manage a batch download job queue.")
+    parser.add_argument("command", choices=["stats", "failed", "requeue", "purge"],
+                        help="stats: jobs per state, failed: list failed jobs with their last error, "
+                             "requeue: queue failed jobs again, purge: delete finished jobs")
+    parser.add_argument("-q", "--queue", default="jobs.db", help="Job queue database")
+    args = parser.parse_args(argv)
+
+    queue = JobQueue(args.queue)
+    if args.command == "failed":
+        for job in queue.jobs("failed"):
+            print(f"{job['sticker_id']}: {job['attempts']} attempts, {job['last_error']}")
+    elif args.command == "requeue":
+        print(f"Queued {queue.requeue(state='failed')} failed jobs again")
+    elif args.command == "purge":
+        print(f"Deleted {queue.purge(state='done')} finished jobs")
+    print(", ".join(f"{count} {state}" for state, count in queue.counts().items()))
+    queue.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import threading
+import contextlib
+
+NAMESPACE = "line_downloader"
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BYTES_BUCKETS = (1024, 16 * 1024, 128 * 1024, 1024 ** 2, 8 * 1024 ** 2, 64 * 1024 ** 2)
+THROUGHPUT_BUCKETS = (64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2)
+
+
+def buckets_for(name: str):
+    """
+    Picks histogram buckets from the unit suffix of a metric name.
+    """
+    if name.endswith("_bytes_per_second"):
+        return THROUGHPUT_BUCKETS
+    if name.endswith("_bytes"):
+        return BYTES_BUCKETS
+    return SECONDS_BUCKETS
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+
+    def cumulative(self):
+        """
+        Returns [(upper bound, observations <= bound)], ending with +Inf, as Prometheus expects.
+        """
+        running = 0
+        result = []
+        for bound, count in zip(self.buckets, self.counts):
+            running += count
+            result.append((bound, running))
+        result.append((float("inf"), self.count))
+        return result
+
+
+def _label_key(labels: dict):
+    return tuple(sorted((key, str(value)) for key, value in labels.items() if value is not None))
+
+
+def _format_labels(key: tuple, extra: tuple = ()):
+    pairs = key + extra
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Metrics:
+    """
+    Thread-safe registry of counters, gauges and histograms, keyed on name and labels.
+
+    Network timings are recorded by transport.MetricsTransport for every request of the shared clients;
+    cache, retry and disk metrics are recorded where those happen. snapshot() and to_prometheus() export
+    everything recorded so far.
+
+        METRICS.inc("cache_requests_total", cache="thumbnail", result="hit")
+        with METRICS.time("disk_write_seconds", op="extract"):
+            ...
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges[(name, _label_key(labels))] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets_for(name))
+            histogram.observe(value)
+
+    @contextlib.contextmanager
+    def time(self, name: str, **labels):
+        """
+        Observes the seconds spent in the with block into histogram `name`.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    def snapshot(self):
+        """
+        Returns every metric as plain data, for json.dump.
+
+        Returns:
+            dict: counters and gauges as lists of {name, labels, value}; histograms as lists of {name,
+            labels, count, sum, buckets}, where buckets maps each upper bound to its cumulative count.
+        """
+        with self._lock:
+            counters = [{"name": name, "labels": dict(key), "value": value}
+                        for (name, key), value in sorted(self._counters.items())]
+            gauges = [{"name": name, "labels": dict(key), "value": value}
+                      for (name, key), value in sorted(self._gauges.items())]
+            histograms = [{"name": name, "labels": dict(key), "count": histogram.count, "sum": histogram.sum,
+                           "buckets": {("+Inf" if bound == float("inf") else str(bound)): count
+                                       for bound, count in histogram.cumulative()}}
+                          for (name, key), histogram in sorted(self._histograms.items())]
+        return {"timestamp": time.time(), "counters": counters, "gauges": gauges, "histograms": histograms}
+
+    def to_prometheus(self):
+        """
+        Renders every metric in the Prometheus text exposition format, names prefixed with NAMESPACE.
+        """
+        lines = []
+        with self._lock:
+            for kind, metrics in (("counter", self._counters), ("gauge", self._gauges)):
+                seen = set()
+                for (name, key), value in sorted(metrics.items()):
+                    full_name = f"{NAMESPACE}_{name}"
+                    if name not in seen:
+                        seen.add(name)
+                        lines.append(f"# TYPE {full_name} {kind}")
+                    lines.append(f"{full_name}{_format_labels(key)} {value}")
+
+            seen = set()
+            for (name, key), histogram in sorted(self._histograms.items()):
+                full_name = f"{NAMESPACE}_{name}"
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f"# TYPE {full_name} histogram")
+                for bound, count in histogram.cumulative():
+                    le = "+Inf" if bound == float("inf") else repr(float(bound))
+                    lines.append(f"{full_name}_bucket{_format_labels(key, (('le', le),))} {count}")
+                lines.append(f"{full_name}_sum{_format_labels(key)} {histogram.sum}")
+                lines.append(f"{full_name}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def write_metrics(path: str, *, fmt: str = None, metrics: Metrics = None):
+    """
+    Writes a snapshot to `path` atomically, so a reader (e.g. node_exporter's textfile collector) never
+    sees a partial file.
+
+    Args:
+        fmt (str, optional): "prometheus" or "json". Defaults to Prometheus for .prom/.txt files, JSON otherwise.
+        metrics (Metrics, optional): Defaults to METRICS.
+    """
+    metrics = metrics or METRICS
+    fmt = fmt or ("prometheus" if path.endswith((".prom", ".txt")) else "json")
+    if fmt == "prometheus":
+        content = metrics.to_prometheus()
+    else:
+        content = json.dumps(metrics.snapshot(), indent=2)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+METRICS = Metrics()
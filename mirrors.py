@@ -0,0 +1,253 @@
+import time
+import threading
+from functools import partial
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import httpx
+
+from metrics import METRICS
+from ratelimit import parse_retry_after
+from retry import RETRY_POLICY, MIRROR_BREAKERS, CircuitOpenError, RetryPolicy, CircuitBreakers
+from transport import TRANSPORT_SETTINGS
+
+
+class MirrorStats:
+    """
+    Keeps a moving average of response latency and error rate per mirror host.
+
+    order() sorts mirrors by expected latency, with errors counting as a heavy latency penalty, so later
+    requests try the mirror that has been answering fastest first. Mirrors without samples keep their
+    position at the front so they get measured.
+    """
+
+    ERROR_PENALTY = 10.0
+
+    def __init__(self, alpha: float = 0.3):
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    @staticmethod
+    def host_of(url: str):
+        return urlparse(url).netloc
+
+    def record(self, url: str, *, latency: float = None, error: bool = False):
+        host = self.host_of(url)
+        with self._lock:
+            stats = self._hosts.setdefault(
+                host, {"latency": None, "error_rate": 0.0, "requests": 0, "errors": 0}
+            )
+            stats["requests"] += 1
+            stats["errors"] += int(error)
+            stats["error_rate"] += self.alpha * (float(error) - stats["error_rate"])
+            if latency is not None:
+                if stats["latency"] is None:
+                    stats["latency"] = latency
+                else:
+                    stats["latency"] += self.alpha * (latency - stats["latency"])
+
+    def score(self, url: str):
+        with self._lock:
+            stats = self._hosts.get(self.host_of(url))
+            if stats is None:
+                return 0.0
+            return (stats["latency"] or 0.0) + stats["error_rate"] * self.ERROR_PENALTY
+
+    def order(self, urls: list):
+        return sorted(urls, key=self.score)
+
+    def snapshot(self):
+        with self._lock:
+            return {host: dict(stats) for host, stats in self._hosts.items()}
+
+
+MIRROR_STATS = MirrorStats()
+
+_mirror_executor = None
+_mirror_executor_lock = threading.Lock()
+
+
+def _hedge_executor():
+    """
+    Returns the pool hedged requests race on, created on first use with TRANSPORT_SETTINGS["hedge_workers"]
+    threads.
+    """
+    global _mirror_executor
+    with _mirror_executor_lock:
+        if _mirror_executor is None:
+            _mirror_executor = ThreadPoolExecutor(max_workers=TRANSPORT_SETTINGS["hedge_workers"],
+                                                  thread_name_prefix="mirror")
+        return _mirror_executor
+
+
+def _discard(stats: MirrorStats, breakers: CircuitBreakers, url: str, started: float, future):
+    """
+    Done callback for a request that lost the race: record its latency and close the response.
+    """
+    if future.cancelled():
+        return
+    try:
+        response = future.result()
+    except Exception:
+        stats.record(url, error=True)
+        breakers.record(stats.host_of(url), False)
+        return
+    stats.record(url, latency=time.monotonic() - started)
+    breakers.record(stats.host_of(url), response.status_code < 500)
+    response.close()
+
+
+def open_first(send, urls: list, *, accept, hedge_after: float = None, stats: MirrorStats = MIRROR_STATS,
+               breakers: CircuitBreakers = MIRROR_BREAKERS):
+    """
+    Sends a request to the mirrors in `urls`, fastest known mirror first, and returns the first accepted response.
+
+    Mirrors whose circuit breaker is open are skipped; connection errors and 5xx answers count against a
+    mirror's breaker.
+
+    Without `hedge_after` the mirrors are tried one after another on the caller's thread. With it, the
+    requests run on a shared pool and the next mirror is raced against the pending ones every `hedge_after`
+    seconds without an answer; the first accepted response wins and the others are cancelled, or closed as
+    soon as they arrive.
+
+    Args:
+        send (callable): send(url) performs the request and returns an httpx.Response.
+        urls (list): The mirror base URLs.
+        accept (callable): accept(response) tells whether a response can be used.
+        hedge_after (float, optional): Latency threshold in seconds before racing the next mirror.
+
+    Returns:
+        tuple: (url, response) of the winner, or (None, None) if every mirror answered with an unusable response.
+
+    Raises:
+        CircuitOpenError: If the breaker of every mirror is open.
+        Exception: The last error raised by send() if no mirror answered at all.
+    """
+    queue = stats.order(list(urls))
+    if hedge_after is None:
+        return _open_in_turn(send, queue, accept=accept, stats=stats, breakers=breakers)
+    pending = {}
+    answered = False
+    last_error = None
+
+    def _launch(reason: str):
+        while queue:
+            url = queue.pop(0)
+            if not breakers.allow(stats.host_of(url)):
+                METRICS.inc("mirror_attempts_total", host=stats.host_of(url), reason="circuit_open")
+                continue
+            METRICS.inc("mirror_attempts_total", host=stats.host_of(url), reason=reason)
+            pending[_hedge_executor().submit(send, url)] = (url, time.monotonic())
+            return
+
+    if queue:
+        _launch("first")
+        if not pending:
+            raise CircuitOpenError(f"Circuit open for every mirror: {', '.join(stats.host_of(url) for url in urls)}")
+    while pending:
+        timeout = hedge_after if queue else None
+        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            _launch("hedge")
+            continue
+
+        for future in done:
+            url, started = pending.pop(future)
+            try:
+                response = future.result()
+            except Exception as err:
+                stats.record(url, error=True)
+                breakers.record(stats.host_of(url), False)
+                last_error = err
+                continue
+
+            answered = True
+            stats.record(url, latency=time.monotonic() - started)
+            breakers.record(stats.host_of(url), response.status_code < 500)
+            if accept(response):
+                for loser, (loser_url, loser_started) in pending.items():
+                    if not loser.cancel():
+                        loser.add_done_callback(partial(_discard, stats, breakers, loser_url, loser_started))
+                return url, response
+            response.close()
+
+        if queue and not pending:
+            _launch("fallback")
+
+    if not answered and last_error is not None:
+        raise last_error
+    return None, None
+
+
+def _open_in_turn(send, urls: list, *, accept, stats: MirrorStats, breakers: CircuitBreakers):
+    """
+    open_first() without hedging: each mirror in turn, sent from the calling thread.
+    """
+    answered = False
+    launched = 0
+    last_error = None
+    for url in urls:
+        host = stats.host_of(url)
+        if not breakers.allow(host):
+            METRICS.inc("mirror_attempts_total", host=host, reason="circuit_open")
+            continue
+        METRICS.inc("mirror_attempts_total", host=host, reason="fallback" if launched else "first")
+        launched += 1
+        started = time.monotonic()
+        try:
+            response = send(url)
+        except Exception as err:
+            stats.record(url, error=True)
+            breakers.record(host, False)
+            last_error = err
+            continue
+
+        answered = True
+        stats.record(url, latency=time.monotonic() - started)
+        breakers.record(host, response.status_code < 500)
+        if accept(response):
+            return url, response
+        response.close()
+
+    if urls and not launched:
+        raise CircuitOpenError(f"Circuit open for every mirror: {', '.join(stats.host_of(url) for url in urls)}")
+    if not answered and last_error is not None:
+        raise last_error
+    return None, None
+
+
+def open_first_with_retry(send, urls: list, *, accept, hedge_after: float = None, method: str = "GET",
+                          policy: RetryPolicy = RETRY_POLICY, operation: str = "request", log=None):
+    """
+    open_first() retried with backoff under `policy`: when no mirror answered and the error is retryable,
+    or when the mirrors only gave retryable answers (429, 5xx), waiting at least as long as their Retry-After.
+
+    Returns:
+        tuple: (url, response) as open_first, (None, None) once no retry is left or the answers were final (e.g. 404).
+    """
+    for attempt in range(policy.attempts):
+        retryable = []
+
+        def _accept(response: httpx.Response):
+            if accept(response):
+                return True
+            if policy.should_retry_status(response.status_code, method):
+                retryable.append(parse_retry_after(response.headers.get("Retry-After")) or 0.0)
+            return False
+
+        try:
+            url, response = open_first(send, urls, accept=_accept, hedge_after=hedge_after)
+        except httpx.HTTPError as err:
+            if attempt + 1 >= policy.attempts or not policy.should_retry_error(err, method):
+                raise
+            delay, reason = policy.backoff(attempt), repr(err)
+        else:
+            if response is not None or not retryable or attempt + 1 >= policy.attempts:
+                return url, response
+            delay, reason = policy.backoff(attempt, max(retryable)), "retryable status"
+        METRICS.inc("download_retries_total", operation=operation)
+        if log:
+            log.warning(f"Retrying {operation} in {delay:.1f}s ({attempt + 2}/{policy.attempts}): {reason}")
+        time.sleep(delay)
+    return None, None
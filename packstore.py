@@ -0,0 +1,416 @@
+import os
+import re
+import mmap
+import time
+import hashlib
+import sqlite3
+import zipfile
+import argparse
+import threading
+from pathlib import Path
+
+from config import Config
+from extract import _member_path, _zip_members, write_manifest
+from metrics import METRICS
+from progress import ProgressTracker
+from store import HASH_CHUNK_SIZE, store_for
+from verify import manifest_for
+
+PACK_STORE_DIR = ".packstore"
+INDEX_FILE = "index.db"
+SEGMENT_MAX_BYTES = 1024 * 1024 * 1024
+
+# A sticker file's name starts with its sticker ID: "123@2x.png", "animation@2x/123@2x.png", "sound/123.m4a"
+_STICKER_NAME = re.compile(r"^(\d+)(?=\D|$)")
+
+
+def member_key(name: str):
+    """
+    Splits a zip member name into (sticker ID, variant). The variant is the name with the sticker ID
+    replaced by "{id}", the same templates as the saved names of Config.TYPES_STICKER_FILE; members that
+    are not sticker files (tab icons, productInfo.meta) get an empty sticker ID and their name as variant.
+    """
+    directory, _, basename = name.replace("\\", "/").rpartition("/")
+    match = _STICKER_NAME.match(basename)
+    if not match:
+        return "", name
+    variant = "{id}" + basename[match.end():]
+    return match.group(1), f"{directory}/{variant}" if directory else variant
+
+
+def resolve_variant(variant: str):
+    """
+    Accepts a TYPES_STICKER_FILE key ("static", "animation", ...) or a variant template.
+    """
+    if variant in Config.TYPES_STICKER_FILE:
+        return Config.TYPES_STICKER_FILE[variant][1]
+    return variant
+
+
+class PackStore:
+    """
+    Packed alternative to extracting packs into folders: member bodies appended to a few large segment
+    files under `<output dir>/.packstore/`, and a SQLite index from (product ID, sticker ID, variant) to
+    segment, offset and length.
+
+    Segments are append-only. A zip is added in one write transaction of the index (BEGIN IMMEDIATE), which
+    also serializes the appends of several processes; every member is hashed before it is written, and a
+    body that is already stored (same SHA-256, e.g. the same PNG in the android and iphone pack) is indexed
+    again instead of appended. Bytes appended by a
+    process that died before committing are never indexed and only waste space.
+
+    Readers map each segment once with mmap, so reading a sticker is an index lookup and a slice of a
+    mapping, with no file opened per sticker.
+    """
+
+    def __init__(self, root: str, *, segment_max_bytes: int = SEGMENT_MAX_BYTES, timeout: float = 30.0):
+        self.root = root
+        self.segment_max_bytes = segment_max_bytes
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._connection = None
+        self._maps = {}
+
+    def _connect(self):
+        """
+        Opens the index on first use. Callers hold self._lock.
+        """
+        if self._connection is None:
+            os.makedirs(self.root, exist_ok=True)
+            self._connection = sqlite3.connect(os.path.join(self.root, INDEX_FILE), timeout=self.timeout,
+                                               isolation_level=None, check_same_thread=False)
+            self._connection.row_factory = sqlite3.Row
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS entries (
+                    pack TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    product_id TEXT NOT NULL,
+                    platform TEXT NOT NULL,
+                    sticker_id TEXT NOT NULL,
+                    variant TEXT NOT NULL,
+                    segment INTEGER NOT NULL,
+                    offset INTEGER NOT NULL,
+                    length INTEGER NOT NULL,
+                    crc INTEGER NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    added_at REAL NOT NULL,
+                    PRIMARY KEY (pack, name)
+                )
+                """
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS entries_key ON entries (product_id, sticker_id, variant)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS entries_body ON entries (sha256)")
+        return self._connection
+
+    def segment_path(self, segment: int):
+        return os.path.join(self.root, f"segment-{segment:05d}.bin")
+
+    def _last_segment(self):
+        segments = [int(name[8:13]) for name in os.listdir(self.root)
+                    if name.startswith("segment-") and name.endswith(".bin")]
+        return max(segments, default=0)
+
+    def is_packed(self, zip_path: str):
+        """
+        Tells whether every member of `zip_path`, with the same CRC and size, is already in the index.
+        """
+        try:
+            with zipfile.ZipFile(zip_path) as zip_ref:
+                members = _zip_members(zip_ref)
+        except (OSError, zipfile.BadZipFile):
+            return False
+        return self.members(Path(zip_path).stem) == members
+
+    def members(self, pack: str):
+        """
+        Returns the indexed members of the pack named `pack` (its zip stem) as {name: {"crc", "size"}}.
+        """
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT name, crc, length FROM entries WHERE pack = ?", (pack,)
+            ).fetchall()
+        return {row["name"]: {"crc": row["crc"], "size": row["length"]} for row in rows}
+
+    def add_zip(self, zip_path: str, *, pack_progress=None):
+        """
+        Appends the members of a pack zip to the segments and indexes them under the zip's stem,
+        `<product ID>_<platform>_<pack file>`, replacing an earlier version of the same pack.
+
+        Returns:
+            dict: members indexed, bytes appended and bytes saved by reusing bodies already stored.
+        """
+        pack = Path(zip_path).stem
+        product_id, platform = (pack.split("_", 2) + ["", ""])[:2]
+        result = {"members": 0, "appended_bytes": 0, "deduplicated_bytes": 0}
+        with self._lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._append_zip(connection, zip_path, pack, product_id, platform, result, pack_progress)
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+        METRICS.inc("disk_written_bytes_total", result["appended_bytes"], op="packstore")
+        METRICS.inc("blob_saved_bytes_total", result["deduplicated_bytes"])
+        return result
+
+    def _hash_member(self, zip_ref: zipfile.ZipFile, info: zipfile.ZipInfo):
+        digest = hashlib.sha256()
+        with zip_ref.open(info) as source:
+            for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _append_zip(self, connection, zip_path, pack, product_id, platform, result, pack_progress):
+        segment = self._last_segment()
+        target = None
+        rows = []
+        appended = {}
+        with zipfile.ZipFile(zip_path) as zip_ref, METRICS.time("disk_write_seconds", op="packstore"):
+            infos = [info for info in zip_ref.infolist() if not info.is_dir()]
+            if pack_progress:
+                pack_progress.begin(sum(info.file_size for info in infos))
+            try:
+                for info in infos:
+                    # Hash first and only write new bodies: a segment never shrinks, readers may have it mapped
+                    digest = self._hash_member(zip_ref, info)
+                    body = appended.get(digest) or connection.execute(
+                        "SELECT segment, offset FROM entries WHERE sha256 = ? LIMIT 1", (digest,)
+                    ).fetchone()
+                    if body is not None:
+                        result["deduplicated_bytes"] += info.file_size
+                    else:
+                        if target is None:
+                            target = open(self.segment_path(segment), "ab")
+                        offset = target.tell()
+                        if offset and offset + info.file_size > self.segment_max_bytes:
+                            target.close()
+                            segment += 1
+                            target = open(self.segment_path(segment), "ab")
+                            offset = 0
+                        with zip_ref.open(info) as source:
+                            for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b""):
+                                target.write(chunk)
+                        body = appended[digest] = (segment, offset)
+                        result["appended_bytes"] += info.file_size
+                    sticker_id, variant = member_key(info.filename)
+                    rows.append((pack, info.filename, product_id, platform, sticker_id, variant, body[0], body[1],
+                                 info.file_size, info.CRC, digest, time.time()))
+                    if pack_progress:
+                        pack_progress.advance(info.file_size)
+                if target is not None:
+                    target.flush()
+                    os.fsync(target.fileno())
+            finally:
+                if target is not None:
+                    target.close()
+        connection.execute("DELETE FROM entries WHERE pack = ?", (pack,))
+        connection.executemany("INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        result["members"] = len(rows)
+
+    def locate(self, product_id: str, sticker_id: str = "", variant: str = "static", *, platform: str = None):
+        """
+        Looks up one file, the most recently added if several packs of the product have it.
+
+        Args:
+            product_id (str): The product (pack) ID.
+            sticker_id (str): The sticker ID, empty for files of the pack itself such as "tab_on@2x.png".
+            variant (str): A TYPES_STICKER_FILE key, a variant template such as "sound/{id}.m4a", or the
+                member name of a non-sticker file.
+            platform (str, optional): Only look in packs of this platform.
+
+        Returns:
+            dict | None: The index entry, with the path of its segment, offset and length.
+        """
+        query = "SELECT * FROM entries WHERE product_id = ? AND sticker_id = ? AND variant = ?"
+        params = [str(product_id), str(sticker_id or ""), resolve_variant(variant)]
+        if platform:
+            query += " AND platform = ?"
+            params.append(platform)
+        with self._lock:
+            row = self._connect().execute(query + " ORDER BY added_at DESC LIMIT 1", params).fetchone()
+        if row is None:
+            return None
+        entry = dict(row)
+        entry["path"] = self.segment_path(entry["segment"])
+        return entry
+
+    def read_entry(self, entry: dict):
+        """
+        Returns the body of an index entry from the mapping of its segment, mapping the segment again once
+        it has grown past the end of the current mapping.
+        """
+        start, end = entry["offset"], entry["offset"] + entry["length"]
+        if start == end:
+            return b""
+        with self._lock:
+            mapping = self._maps.get(entry["segment"])
+            if mapping is None or len(mapping) < end:
+                if mapping is not None:
+                    mapping.close()
+                with open(self.segment_path(entry["segment"]), "rb") as f:
+                    mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps[entry["segment"]] = mapping
+            return mapping[start:end]
+
+    def read(self, product_id: str, sticker_id: str = "", variant: str = "static", *, platform: str = None):
+        """
+        Returns the body of one file as bytes, or None when it is not in the store. See locate().
+        """
+        entry = self.locate(product_id, sticker_id, variant, platform=platform)
+        return None if entry is None else self.read_entry(entry)
+
+    def packs(self):
+        with self._lock:
+            rows = self._connect().execute("SELECT DISTINCT pack FROM entries ORDER BY pack").fetchall()
+        return [row["pack"] for row in rows]
+
+    def export(self, folder: str, packs: list = None):
+        """
+        Writes packs back out as plain folders, `folder/<pack>/<member name>`, the same tree and manifest
+        extract_zip produces, through the blob store of `folder`.
+
+        Returns:
+            int: Number of files written.
+        """
+        store = store_for(folder)
+        written = 0
+        for pack in packs or self.packs():
+            extract_dir = os.path.join(folder, pack)
+            with self._lock:
+                rows = [dict(row) for row in self._connect().execute(
+                    "SELECT * FROM entries WHERE pack = ? ORDER BY rowid", (pack,))]
+            for entry in rows:
+                path = _member_path(extract_dir, entry["name"])
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path + ".part", "wb") as f:
+                    f.write(self.read_entry(entry))
+                store.adopt(path + ".part", path, entry["sha256"])
+                written += 1
+            write_manifest(extract_dir, f"{pack}.zip",
+                           {entry["name"]: {"crc": entry["crc"], "size": entry["length"]} for entry in rows})
+        return written
+
+    def usage(self):
+        """
+        Returns:
+            dict: packs, files and unique bodies indexed, and bytes of the segments on disk.
+        """
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT COUNT(DISTINCT pack), COUNT(*), COUNT(DISTINCT sha256), COALESCE(SUM(length), 0) "
+                "FROM entries"
+            ).fetchone()
+        segments = [name for name in os.listdir(self.root) if name.endswith(".bin")]
+        return {
+            "packs": row[0],
+            "files": row[1],
+            "bodies": row[2],
+            "file_bytes": row[3],
+            "segments": len(segments),
+            "segment_bytes": sum(os.path.getsize(os.path.join(self.root, name)) for name in segments),
+        }
+
+    def close(self):
+        with self._lock:
+            for mapping in self._maps.values():
+                mapping.close()
+            self._maps.clear()
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+_pack_stores = {}
+_pack_stores_lock = threading.Lock()
+
+
+def pack_store_for(output_dir: str = "output"):
+    """
+    Returns the PackStore of `output_dir`, kept inside it as PACK_STORE_DIR.
+    """
+    root = os.path.abspath(os.path.join(output_dir, PACK_STORE_DIR))
+    with _pack_stores_lock:
+        if root not in _pack_stores:
+            _pack_stores[root] = PackStore(root)
+        return _pack_stores[root]
+
+
+def pack_all(folder: str = "output", *, progress: ProgressTracker = None, on_result=None):
+    """
+    Adds every .zip in `folder` to its pack store instead of extracting it, skipping archives already in
+    the store and refusing ones that fail verification. Archives are added one at a time, appends to the
+    segments being serialized anyway.
+
+    Returns:
+        list: One dict per archive with zip, skipped, ok and error, as extract.extract_all.
+    """
+    pack_store = pack_store_for(folder)
+    results = []
+    for zip_path in sorted(str(path) for path in Path(folder).glob("*.zip")):
+        result = {"zip": zip_path, "skipped": False, "ok": True, "error": None}
+        pack_progress = progress.start(Path(zip_path).name) if progress else None
+        try:
+            if pack_store.is_packed(zip_path):
+                result["skipped"] = True
+            elif not manifest_for(folder).is_valid(zip_path):
+                result["ok"] = False
+                result["error"] = "Corrupt or incomplete zip, download it again"
+            else:
+                pack_store.add_zip(zip_path, pack_progress=pack_progress)
+        except (OSError, zipfile.BadZipFile, sqlite3.Error) as err:
+            result["ok"] = False
+            result["error"] = str(err)
+        if pack_progress:
+            pack_progress.finish(result["error"])
+        results.append(result)
+        if on_result:
+            on_result(result)
+    return results
+
+
+def _format_bytes(size: int):
+    return f"{size / 1024 / 1024:.1f} MiB"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Keep extracted packs in a few large files instead of folders.")
+    parser.add_argument("command", choices=["add", "export", "stats", "cat"],
+                        help="add: pack every zip of the output folder, export: write packs back out as "
+                             "folders, stats: show what the store holds, cat: write one file to stdout")
+    parser.add_argument("args", nargs="*",
+                        help="export: pack names (default all), cat: PRODUCT_ID [STICKER_ID [VARIANT]]")
+    parser.add_argument("-o", "--output", default="output", help="Output folder")
+    parser.add_argument("-p", "--platform", choices=list(Config.PLATFORM_LIST.keys()), help="With cat, the platform")
+    parser.add_argument("--to", help="With export, the folder to write to. Defaults to the output folder")
+    args = parser.parse_args(argv)
+
+    pack_store = pack_store_for(args.output)
+    if args.command == "add":
+        for result in pack_all(args.output):
+            status = "already packed" if result["skipped"] else "packed" if result["ok"] else result["error"]
+            print(f"{result['zip']}: {status}")
+    elif args.command == "export":
+        print(f"Wrote {pack_store.export(args.to or args.output, args.args or None)} files")
+    elif args.command == "cat":
+        if not args.args:
+            parser.error("cat needs a product ID")
+        body = pack_store.read(*args.args[:3], platform=args.platform)
+        if body is None:
+            parser.exit(1, "Not in the pack store\n")
+        os.write(1, body)
+        return 0
+    usage = pack_store.usage()
+    print(f"{usage['packs']} packs, {usage['files']} files ({usage['bodies']} unique), "
+          f"{_format_bytes(usage['file_bytes'])} in {usage['segments']} segments of "
+          f"{_format_bytes(usage['segment_bytes'])}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
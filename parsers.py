@@ -0,0 +1,166 @@
+import re
+from html.parser import HTMLParser
+from urllib.parse import urlparse, parse_qs
+
+from bs4 import BeautifulSoup
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+ITEM_CLASS = "mdCMN02Li"
+IMAGE_CLASS = "mdCMN05Img"
+TITLE_CLASS = "mdCMN05Ttl"
+
+
+def make_record(href: str, name: str, image_url: str):
+    """
+    Builds a product record from the raw values every backend extracts.
+    """
+    product_match = re.search(r"/product/(\d+)", href)
+    version = parse_qs(urlparse(image_url).query).get("v", ["0"])[0]
+    return {
+        "product_id": product_match.group(1) if product_match else None,
+        "name": name,
+        "link": f"https://store.line.me{href}",
+        "image_url": image_url,
+        "version": int(version) if version.isdigit() else 0,
+    }
+
+
+def parse_showcase_bs4(response: str):
+    """
+    Reference backend: builds the full BeautifulSoup tree and searches it.
+    """
+    records = []
+    soup = BeautifulSoup(response, "html.parser")
+    for sticker in soup.find_all("li", class_=ITEM_CLASS):
+        name = sticker.find("p", class_=TITLE_CLASS).text.strip()
+        href = sticker.find("a")["href"]
+        image_url = sticker.find("div", class_=IMAGE_CLASS).find("img")["src"]
+        records.append(make_record(href, name, image_url))
+    return records
+
+
+class _ShowcaseExtractor(HTMLParser):
+    """
+    Single pass over the tag stream that only keeps state for the fields of the current item, without
+    building a tree.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.records = []
+        self._item = None
+
+    @staticmethod
+    def _has_class(attrs, name):
+        for key, value in attrs:
+            if key == "class" and value and name in value.split():
+                return True
+        return False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "li":
+            if self._item is None:
+                if self._has_class(attrs, ITEM_CLASS):
+                    self._item = {"href": None, "image_url": None, "name": [], "li_depth": 1,
+                                  "image_depth": 0, "title_depth": 0, "title_done": False}
+            else:
+                self._item["li_depth"] += 1
+            return
+        item = self._item
+        if item is None:
+            return
+
+        if tag == "a" and item["href"] is None:
+            item["href"] = dict(attrs).get("href")
+        elif tag == "div":
+            if item["image_depth"]:
+                item["image_depth"] += 1
+            elif item["image_url"] is None and self._has_class(attrs, IMAGE_CLASS):
+                item["image_depth"] = 1
+        elif tag == "img" and item["image_depth"] and item["image_url"] is None:
+            item["image_url"] = dict(attrs).get("src")
+        elif tag == "p":
+            if item["title_depth"]:
+                item["title_depth"] += 1
+            elif not item["title_done"] and self._has_class(attrs, TITLE_CLASS):
+                item["title_depth"] = 1
+
+    def handle_endtag(self, tag):
+        item = self._item
+        if item is None:
+            return
+        if tag == "li":
+            item["li_depth"] -= 1
+            if item["li_depth"] == 0:
+                self._flush()
+        elif tag == "div" and item["image_depth"]:
+            item["image_depth"] -= 1
+        elif tag == "p" and item["title_depth"]:
+            item["title_depth"] -= 1
+            if item["title_depth"] == 0:
+                item["title_done"] = True
+
+    def handle_data(self, data):
+        if self._item is not None and self._item["title_depth"]:
+            self._item["name"].append(data)
+
+    def _flush(self):
+        item, self._item = self._item, None
+        self.records.append(make_record(item["href"], "".join(item["name"]).strip(), item["image_url"]))
+
+    def close(self):
+        super().close()
+        if self._item is not None:
+            self._flush()
+
+
+def parse_showcase_stream(response: str):
+    """
+    Streaming backend on the standard library HTMLParser, no tree is built.
+    """
+    extractor = _ShowcaseExtractor()
+    extractor.feed(response)
+    extractor.close()
+    return extractor.records
+
+
+def _class_xpath(tag: str, name: str):
+    return f"{tag}[contains(concat(' ', normalize-space(@class), ' '), ' {name} ')]"
+
+
+def parse_showcase_lxml(response: str):
+    """
+    C-backed backend using lxml, available when lxml is installed.
+    """
+    records = []
+    document = lxml.html.fromstring(response)
+    for sticker in document.xpath(f"//{_class_xpath('li', ITEM_CLASS)}"):
+        name = "".join(sticker.xpath(f".//{_class_xpath('p', TITLE_CLASS)}")[0].itertext()).strip()
+        href = sticker.xpath(".//a")[0].get("href")
+        image_url = sticker.xpath(f".//{_class_xpath('div', IMAGE_CLASS)}")[0].xpath(".//img")[0].get("src")
+        records.append(make_record(href, name, image_url))
+    return records
+
+
+PARSERS = {
+    "bs4": parse_showcase_bs4,
+    "stream": parse_showcase_stream,
+}
+if lxml is not None:
+    PARSERS["lxml"] = parse_showcase_lxml
+
+DEFAULT_PARSER = "lxml" if "lxml" in PARSERS else "stream"
+
+
+def get_parser(name: str = None):
+    """
+    Returns the showcase parser called `name`, or the fastest available one.
+    """
+    name = name or DEFAULT_PARSER
+    if name not in PARSERS:
+        raise ValueError(f"Unknown or unavailable parser {name!r}, choose from: {', '.join(PARSERS)}")
+    return PARSERS[name]
@@ -0,0 +1,135 @@
+import time
+import threading
+
+
+class PackProgress:
+    """
+    Byte counters of a single pack download.
+
+    Several workers may write to it at once (the single sticker files of one pack are fetched in
+    parallel), so updates take a lock, and as_dict() takes it too so a sample is never half written.
+    """
+
+    __slots__ = ("sticker_id", "state", "downloaded", "total", "started_at", "finished_at", "error", "_lock")
+
+    def __init__(self, sticker_id: str):
+        self._lock = threading.Lock()
+        self.sticker_id = sticker_id
+        self.state = "queued"
+        self.downloaded = 0
+        self.total = 0
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+
+    def begin(self, total: int, downloaded: int = 0):
+        with self._lock:
+            self.state = "downloading"
+            self.total = total or 0
+            self.downloaded = downloaded
+            if self.started_at is None:
+                self.started_at = time.monotonic()
+
+    def grow(self, size: int):
+        """
+        Adds `size` bytes to the total, for packs whose size is only known file by file.
+        """
+        with self._lock:
+            self.total += size
+
+    def advance(self, size: int):
+        with self._lock:
+            self.downloaded += size
+
+    def finish(self, error: str = None):
+        with self._lock:
+            self.state = "failed" if error else "done"
+            self.error = error
+            self.finished_at = time.monotonic()
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "sticker_id": self.sticker_id,
+                "state": self.state,
+                "downloaded": self.downloaded,
+                "total": self.total,
+                "fraction": self.downloaded / self.total if self.total else 0.0,
+                "error": self.error,
+            }
+
+
+class ProgressTracker:
+    """
+    Registry of PackProgress counters shared by every worker of a download run.
+
+    Consumers (GUI, CLI, logs) call snapshot() at whatever rate suits them to get per-pack and aggregate
+    progress; the download loop itself never calls into them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._packs = {}
+        self._started_at = time.monotonic()
+
+    def reset(self):
+        with self._lock:
+            self._packs = {}
+            self._started_at = time.monotonic()
+
+    def start(self, sticker_id: str):
+        pack = PackProgress(sticker_id)
+        pack.state = "metadata"
+        with self._lock:
+            self._packs[sticker_id] = pack
+        return pack
+
+    def snapshot(self):
+        with self._lock:
+            packs = [pack.as_dict() for pack in self._packs.values()]
+            elapsed = time.monotonic() - self._started_at
+        downloaded = sum(pack["downloaded"] for pack in packs)
+        total = sum(pack["total"] for pack in packs)
+        return {
+            "packs": packs,
+            "downloaded": downloaded,
+            "total": total,
+            "fraction": downloaded / total if total else 0.0,
+            "bytes_per_second": downloaded / elapsed if elapsed > 0 else 0.0,
+            "active": sum(pack["state"] in ("metadata", "downloading") for pack in packs),
+            "done": sum(pack["state"] == "done" for pack in packs),
+            "failed": sum(pack["state"] == "failed" for pack in packs),
+        }
+
+
+class ProgressSampler(threading.Thread):
+    """
+    Calls `callback(tracker.snapshot())` every `interval` seconds until stopped, and once more on stop.
+
+        with ProgressSampler(tracker, 0.1, update_progress_bar):
+            run_downloads()
+    """
+
+    def __init__(self, tracker: ProgressTracker, interval: float, callback):
+        super().__init__(daemon=True)
+        self.tracker = tracker
+        self.interval = interval
+        self.callback = callback
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.callback(self.tracker.snapshot())
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        self.callback(self.tracker.snapshot())
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+        return False
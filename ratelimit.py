@@ -0,0 +1,125 @@
+import math
+import time
+from email.utils import parsedate_to_datetime
+
+# Longest Retry-After honoured, so a bogus header can't stall a run for hours
+MAX_RETRY_AFTER = 300.0
+
+
+def parse_retry_after(value: str, now: float = None):
+    """
+    Parses a Retry-After header, either delay seconds or an HTTP date.
+
+    Returns:
+        float | None: Seconds to wait, between 0 and MAX_RETRY_AFTER, or None without a usable header.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return min(float(value), MAX_RETRY_AFTER)
+    try:
+        retry_at = parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+    return min(max(0.0, retry_at - (now or time.time())), MAX_RETRY_AFTER)
+
+
+def is_throttled(status: int):
+    """
+    Tells whether a response asks the client to slow down: 429 Too Many Requests or any 5xx.
+    """
+    return status == 429 or 500 <= status < 600
+
+
+class AdaptiveLimit:
+    """
+    Request budget of one host: a token bucket capping the request rate, and a concurrency limit, both
+    adjusted by additive-increase/multiplicative-decrease (AIMD).
+
+    Every successful response raises the concurrency limit by 1/limit (about one slot per round of
+    requests) and the rate by `rate_increase` requests per second. A throttled response (429, 5xx or a
+    timeout) halves both and, with a Retry-After header, blocks the host until then. Only requests sent
+    after the last decrease can trigger another one, so a burst of failures of requests already in flight
+    counts as a single congestion signal. Limits so settle just below what the host sustains.
+
+    Not thread-safe: the transports guard it with their own lock or run it on a single event loop.
+    """
+
+    def __init__(self, *, concurrency: float, max_concurrency: int, rate: float, max_rate: float = None,
+                 rate_increase: float = 1.0, min_rate: float = 0.5, decrease_factor: float = 0.5):
+        self.max_concurrency = max_concurrency
+        self.concurrency = min(float(concurrency), max_concurrency)
+        self.rate = rate
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.rate_increase = rate_increase
+        self.decrease_factor = decrease_factor
+        self.tokens = 1.0
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.throttled = 0
+        self._epoch = 0
+        self._refilled_at = time.monotonic()
+
+    def _refill(self, now: float):
+        burst = max(1.0, self.concurrency)
+        self.tokens = min(burst, self.tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def try_acquire(self, now: float = None):
+        """
+        Takes a concurrency slot and a token if both are available.
+
+        Returns:
+            tuple: (epoch, None) on success, to pass back to feedback(); otherwise (None, seconds to wait
+            before trying again), None meaning until a slot is released.
+        """
+        now = now or time.monotonic()
+        if now < self.blocked_until:
+            return None, self.blocked_until - now
+        if self.in_flight >= math.floor(self.concurrency):
+            return None, None
+        self._refill(now)
+        if self.tokens < 1.0:
+            return None, (1.0 - self.tokens) / self.rate
+        self.tokens -= 1.0
+        self.in_flight += 1
+        return self._epoch, None
+
+    def release(self):
+        self.in_flight -= 1
+
+    def feedback(self, epoch: int, *, throttled: bool, retry_after: float = None, now: float = None):
+        """
+        Adjusts the limits with the outcome of a request sent in `epoch`.
+        """
+        now = now or time.monotonic()
+        if retry_after:
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+        if not throttled:
+            # Only grow a limit that is actually in use, an idle host would otherwise drift to the maximum
+            if self.in_flight + 1 >= math.floor(self.concurrency):
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1.0 / self.concurrency)
+            self.rate += self.rate_increase
+            if self.max_rate:
+                self.rate = min(self.rate, self.max_rate)
+            return
+        self.throttled += 1
+        if epoch != self._epoch:
+            return
+        self._epoch += 1
+        self.concurrency = max(1.0, self.concurrency * self.decrease_factor)
+        self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+        self._refill(now)
+        self.tokens = min(self.tokens, 1.0)
+
+    def snapshot(self, now: float = None):
+        now = now or time.monotonic()
+        return {
+            "concurrency": math.floor(self.concurrency),
+            "in_flight": self.in_flight,
+            "rate": round(self.rate, 2),
+            "blocked_for": round(max(0.0, self.blocked_until - now), 2),
+            "throttled": self.throttled,
+        }
@@ -0,0 +1,177 @@
+import time
+import random
+import asyncio
+import threading
+import httpx
+
+from metrics import METRICS
+from ratelimit import parse_retry_after
+
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE", "TRACE"})
+# 429 and 503 mean the server turned the request down before acting on it, so any method may be resent
+REFUSED_STATUSES = frozenset({429, 503})
+RETRY_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+
+class CircuitOpenError(httpx.TransportError):
+    """
+    Raised instead of sending a request when every mirror it could go to has an open circuit breaker.
+    """
+
+
+class RetryPolicy:
+    """
+    When and how long to wait before resending a failed request.
+
+    Delays grow exponentially from `base_delay` up to `max_delay`, with full jitter so workers that failed
+    together don't come back together; a Retry-After header is a lower bound. Only failures that can't
+    have changed anything on the server are retried for non-idempotent methods: connection errors before
+    the request went out, and 429/503 answers.
+    """
+
+    def __init__(self, attempts: int = 4, *, base_delay: float = 0.5, max_delay: float = 30.0,
+                 multiplier: float = 2.0):
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+
+    def backoff(self, attempt: int, retry_after: float = None):
+        """
+        Returns the seconds to wait after failed attempt number `attempt` (0-based).
+        """
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * self.multiplier ** attempt))
+        return max(delay, retry_after or 0.0)
+
+    def should_retry_status(self, status: int, method: str = "GET"):
+        if status in REFUSED_STATUSES:
+            return True
+        return status in RETRY_STATUSES and method.upper() in IDEMPOTENT_METHODS
+
+    def should_retry_error(self, err: Exception, method: str = "GET"):
+        if isinstance(err, CircuitOpenError):
+            return False
+        if isinstance(err, httpx.HTTPStatusError):
+            return self.should_retry_status(err.response.status_code, method)
+        if isinstance(err, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+            return True
+        return isinstance(err, httpx.TransportError) and method.upper() in IDEMPOTENT_METHODS
+
+    def _delay_after(self, err: Exception, attempt: int):
+        retry_after = None
+        if isinstance(err, httpx.HTTPStatusError):
+            retry_after = parse_retry_after(err.response.headers.get("Retry-After"))
+        return self.backoff(attempt, retry_after)
+
+    def _should_retry(self, err: Exception, attempt: int, method: str, operation: str, log, retry_on):
+        if attempt + 1 >= self.attempts or not self.should_retry_error(err, method):
+            return None
+        if retry_on and not isinstance(err, retry_on):
+            return None
+        delay = self._delay_after(err, attempt)
+        METRICS.inc("download_retries_total", operation=operation)
+        if log:
+            log.warning(f"Retrying {operation} in {delay:.1f}s ({attempt + 2}/{self.attempts}): {err!r}")
+        return delay
+
+    def call(self, function, *, method: str = "GET", operation: str = "request", log=None, retry_on=None):
+        """
+        Calls `function()` until it returns, retrying the httpx errors this policy allows, or only those of
+        them that are instances of `retry_on` (an exception type or tuple) when given.
+
+        Raises:
+            Exception: The error of the last attempt.
+        """
+        for attempt in range(self.attempts):
+            try:
+                return function()
+            except httpx.HTTPError as err:
+                delay = self._should_retry(err, attempt, method, operation, log, retry_on)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+
+    async def acall(self, function, *, method: str = "GET", operation: str = "request", log=None,
+                    retry_on=None):
+        """
+        asyncio counterpart of call(), `function()` returning an awaitable.
+        """
+        for attempt in range(self.attempts):
+            try:
+                return await function()
+            except httpx.HTTPError as err:
+                delay = self._should_retry(err, attempt, method, operation, log, retry_on)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+
+
+class CircuitBreakers:
+    """
+    One circuit breaker per host.
+
+    After `failure_threshold` failures in a row (connection errors and 5xx answers) a host's breaker opens
+    and allow() turns it down without a request, so every worker skips a dead mirror at once instead of
+    each waiting for its own timeout. After `reset_after` seconds one trial request is let through
+    (half-open); its success closes the breaker, its failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_after: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    def _transition(self, host: str, breaker: dict, state: str):
+        breaker["state"] = state
+        METRICS.inc("circuit_breaker_transitions_total", host=host, state=state)
+        METRICS.set("circuit_breaker_open", int(state == "open"), host=host)
+
+    def allow(self, host: str):
+        """
+        Tells whether a request may go to `host` now. In the half-open state this claims the single trial.
+        """
+        with self._lock:
+            breaker = self._hosts.get(host)
+            if breaker is None or breaker["state"] == "closed":
+                return True
+            now = time.monotonic()
+            # A trial whose outcome never came back (e.g. a cancelled hedge) is given up after reset_after
+            if now - breaker["changed_at"] < self.reset_after:
+                return False
+            if breaker["state"] == "open":
+                self._transition(host, breaker, "half_open")
+            breaker["changed_at"] = now
+            return True
+
+    def record(self, host: str, ok: bool):
+        with self._lock:
+            breaker = self._hosts.setdefault(host, {"state": "closed", "failures": 0, "changed_at": 0.0})
+            if ok:
+                breaker["failures"] = 0
+                if breaker["state"] != "closed":
+                    self._transition(host, breaker, "closed")
+                return
+            breaker["failures"] += 1
+            if breaker["state"] == "half_open" or (
+                    breaker["state"] == "closed" and breaker["failures"] >= self.failure_threshold):
+                self._transition(host, breaker, "open")
+                breaker["changed_at"] = time.monotonic()
+
+    def state(self, host: str):
+        with self._lock:
+            breaker = self._hosts.get(host)
+            return breaker["state"] if breaker else "closed"
+
+    def snapshot(self):
+        with self._lock:
+            return {host: {"state": breaker["state"], "failures": breaker["failures"]}
+                    for host, breaker in self._hosts.items()}
+
+    def reset(self):
+        with self._lock:
+            self._hosts.clear()
+
+
+RETRY_POLICY = RetryPolicy()
+MIRROR_BREAKERS = CircuitBreakers()
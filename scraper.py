@@ -1,13 +1,23 @@
 import os
-import shutil
-import aiohttp
+import time
+import hashlib
+import tempfile
+import contextlib
+import httpx
 import asyncio
 import aiofiles
 import random
-import string
 
-from urllib.parse import urlparse
-from bs4 import BeautifulSoup
+from functools import partial
+from cache import ThumbnailCache, PageCache, THUMBNAIL_CACHE, PAGE_CACHE
+from catalog import Catalog, CATALOG
+from metrics import METRICS
+from parsers import get_parser
+from retry import RETRY_POLICY
+from transport import get_async_client, aclose_async_client
+from utils import logger
+
+logger = logger('Scraper', to_file=False)
 
 # Constants
 FAKE_USER_AGENTS = [
@@ -25,150 +35,393 @@ FAKE_USER_AGENTS = [
 
 FAKE_HEADERS = {
     "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/png,image/svg+xml,*/*;q=0.8",
-    "Accept-Encoding": "gzip, deflate, br, zstd",
     "Accept-Language": "en-US,en;q=0.5",
-    "Connection": "keep-alive",
     "DNT": "1",
     "Host": "store.line.me",
     "Referer": "https://store.line.me/stickershop/",
 }
 
+# Largest showcase page accepted by fetch(), and the piece size images are streamed to disk in
+PAGE_MAX_BYTES = 8 * 1024 * 1024
+IMAGE_CHUNK_SIZE = 64 * 1024
+
 
-async def fetch(url: str, *, session: aiohttp.ClientSession = None, **kwargs):
+async def fetch(url: str, *, client: httpx.AsyncClient = None, max_bytes: int = PAGE_MAX_BYTES, **kwargs):
     """
-    Asynchronously fetches content from a URL using a provided aiohttp session.
+    Asynchronously fetches content from a URL using the shared pooled client, retried under RETRY_POLICY.
+
+    The body is streamed and given up once it passes `max_bytes`, so a runaway response can't take the
+    memory of the process; pages are parsed whole, so the text of one page is still held.
 
     Args:
       url (str): The URL to fetch.
-      session (aiohttp.ClientSession, optional): The aiohttp session to use. Defaults to None.
+      client (httpx.AsyncClient, optional): The client to use. Defaults to transport.get_async_client().
+      max_bytes (int, optional): Largest body accepted. Defaults to PAGE_MAX_BYTES.
+
+    Raises:
+        httpx.HTTPStatusError: If the response status is not 2xx.
+        ValueError: If the body is larger than `max_bytes`.
     """
 
-    async with session or aiohttp.ClientSession() as session:
-        async with session.get(url, **kwargs) as response:
+    client = client or get_async_client()
+
+    async def _get():
+        async with client.stream("GET", url, **kwargs) as response:
             response.raise_for_status()
-            return await response.text()
+            body = bytearray()
+            async for chunk in response.aiter_bytes():
+                body += chunk
+                if len(body) > max_bytes:
+                    raise ValueError(f"{url} is larger than {max_bytes} bytes")
+            return body.decode(response.encoding or "utf-8", errors="replace")
+
+    return await RETRY_POLICY.acall(_get, operation="page")
 
 
 async def download_image(
-    url: str, filename: str, *, session: aiohttp.ClientSession = None, **kwargs
-) -> bytes:
+    url: str, filename: str, *,
+    client: httpx.AsyncClient = None,
+    expected_size: int = None,
+    expected_sha256: str = None,
+    chunk_size: int = IMAGE_CHUNK_SIZE,
+    **kwargs
+) -> dict:
     """
-    Asynchronously downloads an image from a URL using a provided aiohttp session.
+    Asynchronously downloads an image from a URL using the shared pooled client, retried under RETRY_POLICY.
+
+    The body is streamed in `chunk_size` pieces to a temporary file next to `filename`, hashed and counted
+    on the way, and renamed over `filename` only once it is complete and checked, so memory stays at one
+    chunk per download and `filename` is never seen half written.
 
     Args:
         url (str): The URL of the image to download.
         filename (str): The filename of the downloaded image.
-        session (aiohttp.ClientSession, optional): The aiohttp session to use. Defaults to None.
-        **kwargs: Additional keyword arguments to pass to the session.get() method.
+        client (httpx.AsyncClient, optional): The client to use. Defaults to transport.get_async_client().
+        expected_size (int, optional): Size the body must have, on top of the Content-Length check.
+        expected_sha256 (str, optional): SHA-256 hex digest the body must have.
+        chunk_size (int, optional): Bytes read and written at a time. Defaults to IMAGE_CHUNK_SIZE.
+        **kwargs: Additional keyword arguments to pass to the client.stream() method.
 
     Returns:
-        bytes: The downloaded image in bytes.
+        dict: path, size (bytes), sha256 and content_type of the downloaded image.
 
     Raises:
-        aiohttp.ClientResponseError: If the response status is not 200.
+        httpx.HTTPStatusError: If the response status is not 2xx.
+        httpx.RemoteProtocolError: If the body is shorter than announced or fails the size or hash check.
     """
 
     # Create the directory if it doesn't exist
-    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    directory = os.path.dirname(filename)
+    os.makedirs(directory, exist_ok=True)
+
+    client = client or get_async_client()
+
+    async def _get():
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(filename) + ".", suffix=".part")
+        os.close(fd)
+        try:
+            async with client.stream("GET", url, **kwargs) as response:
+                response.raise_for_status()
+                digest = hashlib.sha256()
+                size = 0
+                started = time.perf_counter()
+                async with aiofiles.open(tmp_path, "wb") as f:
+                    async for chunk in response.aiter_bytes(chunk_size):
+                        digest.update(chunk)
+                        size += len(chunk)
+                        await f.write(chunk)
+                METRICS.observe("disk_write_seconds", time.perf_counter() - started, op="image")
+                # Content-Length counts the bytes on the wire, before any content decoding
+                announced = int(response.headers.get("Content-Length", 0)) or None
+                if announced is not None and response.num_bytes_downloaded != announced:
+                    raise httpx.RemoteProtocolError(
+                        f"Incomplete download of {url}: {response.num_bytes_downloaded}/{announced} bytes")
+                if expected_size is not None and size != expected_size:
+                    raise httpx.RemoteProtocolError(f"{url} has {size} bytes, expected {expected_size}")
+                if expected_sha256 and digest.hexdigest() != expected_sha256.lower():
+                    raise httpx.RemoteProtocolError(f"{url} does not match its SHA-256 {expected_sha256}")
+                content_type = response.headers.get("Content-Type")
+            os.replace(tmp_path, filename)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+            raise
+        METRICS.inc("disk_written_bytes_total", size, op="image")
+        return {"path": filename, "size": size, "sha256": digest.hexdigest(), "content_type": content_type}
+
+    return await RETRY_POLICY.acall(_get, operation="image")
+
+
+async def download_many_images(
+    jobs: list, *, client: httpx.AsyncClient = None, limit: int = 8, **kwargs
+) -> list:
+    """
+    Concurrently downloads many images over one pooled client.
 
-    async with session or aiohttp.ClientSession() as session:
-        async with session.get(url, **kwargs) as response:
-            response.raise_for_status()
-            content = await response.read()
-            async with aiofiles.open(filename, "wb") as f:
-                await f.write(content)
-            return content
+    Args:
+        jobs (list): (url, filename) pairs to download.
+        client (httpx.AsyncClient, optional): The client to use. Defaults to transport.get_async_client().
+        limit (int, optional): Maximum number of downloads in flight. Defaults to 8.
+        **kwargs: Additional keyword arguments to pass to the client.get() method.
+
+    Returns:
+        list: For each job, in the same order, the download_image() metadata dict or the exception that job
+            raised.
+    """
+    client = client or get_async_client()
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def _bounded(url, filename):
+        async with semaphore:
+            return await download_image(url, filename, client=client, **kwargs)
+
+    return await asyncio.gather(
+        *(_bounded(url, filename) for url, filename in jobs), return_exceptions=True
+    )
+
+
+def showcase_url(page: int):
+    return f"https://store.line.me/stickershop/showcase/top/en?page={str(page)}"
+
+
+# Background refreshes of stale pages, by (id of the page cache, page number), so each page of a cache is
+# refreshed at most once at a time
+_page_refreshes = {}
+
+
+def _refresh_pending(key: tuple):
+    """
+    Tells whether a refresh under `key` is still running on the current loop. Refreshes that finished, or
+    that belong to another or a closed loop and so may never finish, are dropped.
+    """
+    task = _page_refreshes.get(key)
+    if task is None:
+        return False
+    if task.done() or task.get_loop() is not asyncio.get_running_loop():
+        _page_refreshes.pop(key, None)
+        return False
+    return True
+
+
+async def _refresh_showcase_page(page: int, *, client: httpx.AsyncClient, headers: dict, page_cache: PageCache):
+    response = await fetch(showcase_url(page), client=client, headers=headers)
+    started = time.perf_counter()
+    await asyncio.to_thread(page_cache.put, page, response)
+    METRICS.observe("disk_write_seconds", time.perf_counter() - started, op="page")
+    return response
+
+
+def _on_page_refreshed(key: tuple, task: asyncio.Task):
+    if _page_refreshes.get(key) is task:
+        del _page_refreshes[key]
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Error refreshing showcase page {key[1]}: {task.exception()}")
+
+
+async def fetch_showcase_page(
+    page: int = 1, *,
+    client: httpx.AsyncClient = None,
+    headers: dict = None,
+    page_cache: PageCache = None,
+    always_fetch_new: bool = False,
+):
+    """
+    Returns the HTML of a showcase page through the per-page cache.
+
+    A fresh cached page is returned as is. A stale one is returned immediately while a background task
+    refetches it for the next call. A missing page, or any page with `always_fetch_new`, is fetched and
+    cached before returning.
+    """
+    page_cache = page_cache or PAGE_CACHE
+    client = client or get_async_client()
+
+    if not always_fetch_new:
+        response, fresh = await asyncio.to_thread(page_cache.get, page)
+        METRICS.inc("cache_requests_total", cache="page",
+                    result="miss" if response is None else "hit" if fresh else "stale")
+        if response is not None:
+            key = (id(page_cache), page)
+            if not fresh and not _refresh_pending(key):
+                task = asyncio.create_task(
+                    _refresh_showcase_page(page, client=client, headers=headers, page_cache=page_cache)
+                )
+                _page_refreshes[key] = task
+                task.add_done_callback(partial(_on_page_refreshed, key))
+            return response
+
+    return await _refresh_showcase_page(page, client=client, headers=headers, page_cache=page_cache)
+
+
+def parse_showcase_page(response: str, parser: str = None):
+    """
+    Parses a showcase page into product records.
+
+    Args:
+        parser (str, optional): Backend from parsers.PARSERS ("lxml", "stream" or "bs4"). Defaults to the
+            fastest one available.
+
+    Returns:
+        list: Dictionaries with the product_id, name, link, image_url and version of each sticker, in page order.
+    """
+    return get_parser(parser)(response)
+
+
+async def cache_thumbnails(
+    stickers: list, *,
+    client: httpx.AsyncClient = None,
+    thumbnail_cache: ThumbnailCache = None,
+    download_images: bool = True,
+    max_concurrent_downloads: int = 8,
+    user_agent: str = None,
+):
+    """
+    Fills in "cached_image" of each sticker from the thumbnail cache, downloading the missing ones.
+
+    A sticker whose image failed to download has its exception under "error".
+    """
+    thumbnail_cache = thumbnail_cache or THUMBNAIL_CACHE
+    user_agent = user_agent or random.choice(FAKE_USER_AGENTS)
+
+    # One trip off the event loop for all the lookups, each of which stats a file
+    cached_images = await asyncio.to_thread(
+        lambda: [thumbnail_cache.get(sticker["image_url"]) for sticker in stickers]
+    )
+    for sticker, cached_image in zip(stickers, cached_images):
+        sticker["cached_image"] = cached_image or "not downloaded"
+
+    missing = [sticker for sticker in stickers if sticker["cached_image"] == "not downloaded"]
+    METRICS.inc("cache_requests_total", len(stickers) - len(missing), cache="thumbnail", result="hit")
+    METRICS.inc("cache_requests_total", len(missing), cache="thumbnail", result="miss")
+    if download_images and missing:
+        for sticker in missing:
+            sticker["cached_image"] = thumbnail_cache.path_for(sticker["image_url"])
+
+        results = await download_many_images(
+            [(sticker["image_url"], sticker["cached_image"]) for sticker in missing],
+            client=client,
+            limit=max_concurrent_downloads,
+            headers={
+                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/png,image/svg+xml,*/*;q=0.8",
+                "Host": "stickershop.line-scdn.net",
+                "User-Agent": user_agent,
+                "Referer": "https://store.line.me/stickershop/",
+            },
+        )
+        for sticker, result in zip(missing, results):
+            if not isinstance(result, Exception):
+                thumbnail_cache.commit(sticker["image_url"])
+            elif isinstance(result, httpx.HTTPStatusError):
+                logger.error(f"Error downloading image: {result}, {sticker['name']} - {sticker['image_url']} - {sticker['cached_image']} - {user_agent}")
+                sticker["error"] = result
+            elif isinstance(result, Exception):
+                logger.error(f"Error downloading image {sticker['image_url']}: {result!r}")
+                sticker["error"] = result
+
+    await asyncio.to_thread(thumbnail_cache.flush)
+    return stickers
 
 
 async def scrape_line_store_stickers(
     page: int = 1 ,*, 
     always_fetch_new: bool = False, 
     download_images: bool = True, 
-    remove_cache_before_download: bool = False
+    remove_cache_before_download: bool = False,
+    max_concurrent_downloads: int = 8,
+    thumbnail_cache: ThumbnailCache = None,
+    page_cache: PageCache = None,
 ):
     """
     Scrapes Line Store stickers by fetching the showcase top page in English.
 
     This function will:
-        - Check if a "cache" folder already exists and remove it if it does.
-        - Attempt to create a "cache" folder to store downloaded images.
-        - Download all sticker images to the "cache" folder.
-        - Store the fetched HTML content as "store.html".
+        - Clear the thumbnail cache first if asked to.
+        - Download sticker images missing from the thumbnail cache, concurrently over the shared client.
+        - Serve the page HTML from the per-page cache, see fetch_showcase_page.
 
     Args:
         page (int, optional): The page number to fetch. Defaults to 1.
         always_fetch_new (bool, optional): Whether to always fetch new content. Defaults to False.
         download_images (bool, optional): Whether to download images. Defaults to False.
-        remove_cache_before_download (bool, optional): Whether to remove the "cache" folder before downloading. Defaults to False.
+        remove_cache_before_download (bool, optional): Whether to clear the thumbnail cache before downloading. Defaults to False.
+        max_concurrent_downloads (int, optional): Maximum number of images downloaded at once. Defaults to 8.
+        thumbnail_cache (ThumbnailCache, optional): The cache images are served from and stored in. Defaults to THUMBNAIL_CACHE.
+        page_cache (PageCache, optional): The cache showcase HTML is served from and stored in. Defaults to PAGE_CACHE.
 
     Returns:
         list: A collection of dictionaries, each containing the name, link, and image URL of a sticker.
+        A sticker whose image failed to download has its exception under "error".
     """
     user_agent = random.choice(FAKE_USER_AGENTS)
     headers = FAKE_HEADERS.copy()
     headers["User-Agent"] = user_agent
 
-    if os.path.exists("cache") and remove_cache_before_download:
-        await asyncio.to_thread(shutil.rmtree, "cache")
-
-    async with aiohttp.ClientSession() as session:
-        if not os.path.exists("store.html") or always_fetch_new:
-            response = await fetch(
-                f"https://store.line.me/stickershop/showcase/top/en?page={str(page)}",
-                session=session,
-                headers=headers,
-            )
-            async with aiofiles.open("store.html", "w", encoding="utf-8") as f:
-                await f.write(response)
-        else:
-            with open("store.html", "r", encoding="utf-8") as f:
-                response = f.read()
-
-        # Build Stickers Collection
-        stickers_collection = []
-
-        # Scrape the store page
-        soup = BeautifulSoup(response, "html.parser")
-        stickers = soup.find_all("li", class_="mdCMN02Li")
-        for sticker in stickers:
-            name = sticker.find("p", class_="mdCMN05Ttl").text.strip()
-            link = f"https://store.line.me{sticker.find("a")["href"]}"
-            #image_url = sticker.find("img")["src"]
-            image_url = sticker.find("div", class_="mdCMN05Img").find("img")["src"]
-            file_ext = urlparse(image_url).path.split(".")[-1]
-
-            # generate unique filename
-            filename = f"{''.join(random.choice(string.ascii_lowercase + string.digits) for _ in range(10))}"
-
-            # cache image via download
-            tmp_img_path = f"cache/{filename}.{file_ext}"
-            if download_images:
-                try:
-                    await download_image(f"{image_url}", tmp_img_path, headers={
-                        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/png,image/svg+xml,*/*;q=0.8",
-                        "Accept-Encoding": "gzip, deflate, br, zstd",
-                        "Host": "stickershop.line-scdn.net",
-                        "User-Agent": user_agent,
-                        "Referer": "https://store.line.me/stickershop/",
-                    })
-                except aiohttp.ClientResponseError as e:
-                    print(f"Error downloading image: {e}, {name} - {image_url} - {tmp_img_path} - {user_agent} - {headers}")
-                except Exception as e:
-                    print(f"Exception: {e}")
-            else:
-                tmp_img_path = "not downloaded"
-
-            # Add the sticker to the collection
-            stickers_collection.append(
-                {
-                    "name": name,
-                    "link": link,
-                    "image_url": image_url,
-                    "cached_image": tmp_img_path,
-                }
-            )
-
-        return stickers_collection
+    thumbnail_cache = thumbnail_cache or THUMBNAIL_CACHE
+
+    if remove_cache_before_download:
+        # Only the thumbnails: the HTTP and page caches under "cache" keep their revalidation data
+        await asyncio.to_thread(thumbnail_cache.clear)
+
+    client = get_async_client()
+    response = await fetch_showcase_page(
+        page, client=client, headers=headers, page_cache=page_cache, always_fetch_new=always_fetch_new
+    )
+
+    # Scrape the store page, served from the thumbnail cache on a hit
+    stickers_collection = parse_showcase_page(response)
+    return await cache_thumbnails(
+        stickers_collection,
+        client=client,
+        thumbnail_cache=thumbnail_cache,
+        download_images=download_images,
+        max_concurrent_downloads=max_concurrent_downloads,
+        user_agent=user_agent,
+    )
+
+
+async def crawl_showcase(
+    start_page: int = 1, end_page: int = 10, *,
+    catalog: Catalog = None,
+    concurrency: int = 4,
+    stop_when_unchanged: bool = True,
+):
+    """
+    Crawls showcase pages start_page..end_page into the product catalog.
+
+    Pages are fetched `concurrency` at a time and upserted in page order. With `stop_when_unchanged`, the
+    crawl stops after the first page that brings no new or changed product, since later pages of a
+    re-crawl are then already known.
+
+    Returns:
+        dict: pages (number of pages stored), new and changed product counts, and stopped_at (the
+        unchanged page the crawl stopped on, or None).
+    """
+    catalog = catalog or CATALOG
+    client = get_async_client()
+    headers = FAKE_HEADERS.copy()
+    headers["User-Agent"] = random.choice(FAKE_USER_AGENTS)
+
+    summary = {"pages": 0, "new": 0, "changed": 0, "stopped_at": None}
+    for window_start in range(start_page, end_page + 1, max(1, concurrency)):
+        pages = list(range(window_start, min(window_start + max(1, concurrency), end_page + 1)))
+        responses = await asyncio.gather(
+            *(fetch_showcase_page(page, client=client, headers=headers, always_fetch_new=True) for page in pages),
+            return_exceptions=True,
+        )
+        for page, response in zip(pages, responses):
+            if isinstance(response, Exception):
+                print(f"Error fetching showcase page {page}: {response}")
+                continue
+            records = await asyncio.to_thread(parse_showcase_page, response)
+            if not records:
+                return summary
+            new, changed = await asyncio.to_thread(catalog.upsert, records, page)
+            summary["pages"] += 1
+            summary["new"] += new
+            summary["changed"] += changed
+            if stop_when_unchanged and not new and not changed:
+                summary["stopped_at"] = page
+                return summary
+    return summary
 
 
 async def scrape_line_store_stickers_test():
@@ -181,6 +434,7 @@ async def scrape_line_store_stickers_test():
 
 async def main():
     sticker_collection = await scrape_line_store_stickers()
+    await aclose_async_client()
 
     print("[", end="")
     for sticker in sticker_collection:
@@ -0,0 +1,223 @@
+import os
+import hashlib
+import argparse
+import threading
+
+from metrics import METRICS
+
+BLOB_DIR = ".blobs"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path: str):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BlobStore:
+    """
+    Content-addressed store of file bodies under `<output dir>/.blobs/<sha256[:2]>/<sha256>`.
+
+    Every file put into the output tree through adopt() is kept once per unique body. The paths the app
+    and the user see (pack folders, platform folders, per-sticker folders) are hardlinks to the blob,
+    so the same PNG downloaded for android, iphone and pc, or extracted twice, takes the space of one.
+
+    A blob's link count tells how many views still use it, so no separate reference list is kept: gc()
+    removes blobs whose only remaining link is the store's own. Views are always replaced with a new link
+    and never written through, so rewriting one path can't change the others.
+
+    Where the filesystem has no hardlinks, adopt() falls back to a plain rename and nothing is deduplicated.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def blob_path(self, digest: str):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def _link_into_place(self, blob: str, path: str):
+        """
+        Points `path` at `blob` through a temporary link and a rename, replacing whatever was there.
+        """
+        tmp_path = f"{path}.{threading.get_ident()}.link"
+        os.link(blob, tmp_path)
+        os.replace(tmp_path, path)
+
+    def adopt(self, source: str, path: str, digest: str = None):
+        """
+        Moves the finished file `source` to `path`, stored once per body.
+
+        Args:
+            source (str): A complete temporary file, e.g. a downloaded `.part`. It is gone afterwards.
+            path (str): The file's place in the output tree.
+            digest (str, optional): SHA-256 hex digest of `source` when the caller hashed it while writing.
+
+        Returns:
+            str: The digest of the body.
+        """
+        digest = digest or hash_file(source)
+        blob = self.blob_path(digest)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        try:
+            # Link instead of rename so a concurrent adopt of the same body can't replace the blob under us
+            os.link(source, blob)
+            METRICS.inc("blob_store_total", result="new")
+        except FileExistsError:
+            try:
+                self._link_into_place(blob, path)
+            except OSError:
+                os.replace(source, path)
+                return digest
+            os.remove(source)
+            METRICS.inc("blob_store_total", result="deduplicated")
+            METRICS.inc("blob_saved_bytes_total", os.path.getsize(blob))
+            return digest
+        except OSError:
+            # No hardlinks on this filesystem, keep the file as it is
+            os.replace(source, path)
+            return digest
+        os.replace(source, path)
+        return digest
+
+    def intern(self, path: str):
+        """
+        Replaces an existing output file with a link to its blob, for trees written before the store existed.
+
+        Returns:
+            bool: True if the file was already in the store or got linked, False if it could not be.
+        """
+        digest = hash_file(path)
+        blob = self.blob_path(digest)
+        try:
+            if os.path.exists(blob) and os.path.samefile(blob, path):
+                return True
+        except OSError:
+            pass
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        try:
+            os.link(path, blob)
+            return True
+        except FileExistsError:
+            pass
+        except OSError:
+            return False
+        try:
+            size = os.path.getsize(path)
+            self._link_into_place(blob, path)
+        except OSError:
+            return False
+        METRICS.inc("blob_store_total", result="deduplicated")
+        METRICS.inc("blob_saved_bytes_total", size)
+        return True
+
+    def _blobs(self):
+        for prefix in sorted(os.listdir(self.root)) if os.path.isdir(self.root) else []:
+            directory = os.path.join(self.root, prefix)
+            if not os.path.isdir(directory):
+                continue
+            for name in sorted(os.listdir(directory)):
+                yield os.path.join(directory, name)
+
+    def usage(self):
+        """
+        Returns:
+            dict: blobs and bytes held by the store, links pointing at them, and bytes saved by the sharing.
+        """
+        usage = {"blobs": 0, "bytes": 0, "links": 0, "saved_bytes": 0}
+        for blob in self._blobs():
+            stat = os.stat(blob)
+            links = stat.st_nlink - 1
+            usage["blobs"] += 1
+            usage["bytes"] += stat.st_size
+            usage["links"] += links
+            usage["saved_bytes"] += max(0, links - 1) * stat.st_size
+        return usage
+
+    def gc(self, *, dry_run: bool = False):
+        """
+        Deletes blobs no output file links to any more.
+
+        Returns:
+            dict: removed blob count and reclaimed bytes.
+        """
+        result = {"removed": 0, "reclaimed_bytes": 0}
+        for blob in self._blobs():
+            stat = os.stat(blob)
+            if stat.st_nlink > 1:
+                continue
+            result["removed"] += 1
+            result["reclaimed_bytes"] += stat.st_size
+            if not dry_run:
+                os.remove(blob)
+        return result
+
+
+def iter_output_files(folder: str):
+    """
+    Yields every regular file under `folder` that belongs in the store: not the store itself, not zips or
+    manifests, not unfinished downloads.
+    """
+    for directory, subdirectories, files in os.walk(folder):
+        # Hidden folders are the store itself and other packed formats (.packstore)
+        subdirectories[:] = [name for name in subdirectories if not name.startswith(".")]
+        if directory == folder:
+            continue
+        for name in files:
+            if name.startswith(".") or name.endswith((".part", ".link", ".tmp")):
+                continue
+            yield os.path.join(directory, name)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def store_for(output_dir: str = "output"):
+    """
+    Returns the BlobStore of `output_dir`. It lives inside the output folder so views and blobs share a
+    filesystem and can be hardlinked.
+    """
+    root = os.path.abspath(os.path.join(output_dir, BLOB_DIR))
+    with _stores_lock:
+        if root not in _stores:
+            _stores[root] = BlobStore(root)
+        return _stores[root]
+
+
+def _format_bytes(size: int):
+    return f"{size / 1024 / 1024:.1f} MiB"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the deduplicated blob store of an output folder.")
+    parser.add_argument("command", choices=["gc", "dedupe", "stats"],
+                        help="gc: delete unreferenced blobs, dedupe: move existing files into the store, "
+                             "stats: show disk usage")
+    parser.add_argument("-o", "--output", default="output", help="Output folder")
+    parser.add_argument("--dry-run", action="store_true", help="With gc, only report what would be deleted")
+    args = parser.parse_args(argv)
+
+    store = store_for(args.output)
+    if args.command == "dedupe":
+        linked = failed = 0
+        for path in iter_output_files(args.output):
+            if store.intern(path):
+                linked += 1
+            else:
+                failed += 1
+        print(f"Linked {linked} files into the store" + (f", {failed} could not be linked" if failed else ""))
+    elif args.command == "gc":
+        result = store.gc(dry_run=args.dry_run)
+        print(f"{'Would remove' if args.dry_run else 'Removed'} {result['removed']} blobs, "
+              f"{_format_bytes(result['reclaimed_bytes'])}")
+    usage = store.usage()
+    print(f"{usage['blobs']} blobs, {_format_bytes(usage['bytes'])} on disk, {usage['links']} files, "
+          f"{_format_bytes(usage['saved_bytes'])} saved")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
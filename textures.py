@@ -0,0 +1,95 @@
+import os
+from array import array
+from collections import OrderedDict
+from dearpygui import dearpygui as dpg
+
+THUMBNAIL_SIZE = 96
+
+
+def load_thumbnail(path: str, size: int = THUMBNAIL_SIZE):
+    """
+    Decodes an image and scales it to fit a `size` x `size` RGBA texture, centered on a transparent
+    background. Pure CPU work, meant to run off the render thread.
+
+    Returns:
+        array.array: size * size * 4 floats for dpg.set_value on a dynamic texture, or None when the file
+        is missing or can't be decoded.
+    """
+    if not path or not os.path.exists(path):
+        return None
+    image = dpg.load_image(path)
+    if image is None:
+        return None
+    width, height, channels, data = image
+    pixels = memoryview(data).cast("B").cast("f")
+
+    scale = min(size / width, size / height, 1.0)
+    out_width, out_height = max(1, int(width * scale)), max(1, int(height * scale))
+    left, top = (size - out_width) // 2, (size - out_height) // 2
+
+    # Nearest-neighbour sampling, a thumbnail is downscaled once per decode so quality is not worth the cost
+    columns = [(x * width // out_width) * channels for x in range(out_width)]
+    output = array("f", bytes(size * size * 4 * 4))
+    for y in range(out_height):
+        row_start = (y * height // out_height) * width * channels
+        row = pixels[row_start:row_start + width * channels]
+        if channels == 4:
+            values = [row[column + c] for column in columns for c in range(4)]
+        else:
+            values = [value for column in columns for value in (row[column], row[column + 1], row[column + 2], 1.0)]
+        start = ((top + y) * size + left) * 4
+        output[start:start + out_width * 4] = array("f", values)
+    return output
+
+
+class TexturePool:
+    """
+    A fixed set of `size` x `size` dynamic textures reused for thumbnails, keyed on image URL.
+
+    Textures are created once; put() uploads into a free one or recycles the least recently used, so GPU
+    memory stays at `capacity` textures however many rows are scrolled through. Keep `capacity` above the
+    number of images on screen, and get() every visible key on each refresh so they stay most recent.
+
+    Only use it from the render thread.
+    """
+
+    def __init__(self, capacity: int, size: int = THUMBNAIL_SIZE):
+        self.capacity = capacity
+        self.size = size
+        self._textures = OrderedDict()
+        self.evictions = 0
+        blank = [0.0] * (size * size * 4)
+        with dpg.texture_registry():
+            self.placeholder = dpg.add_static_texture(size, size, blank)
+            self._free = [dpg.add_dynamic_texture(size, size, blank) for _ in range(capacity)]
+
+    def get(self, key: str):
+        """
+        Returns the texture holding `key` and marks it as recently used, or None.
+        """
+        texture = self._textures.get(key)
+        if texture is not None:
+            self._textures.move_to_end(key)
+        return texture
+
+    def put(self, key: str, data):
+        """
+        Uploads `data` (from load_thumbnail) for `key` and returns its texture.
+        """
+        texture = self._textures.get(key)
+        if texture is None:
+            if self._free:
+                texture = self._free.pop()
+            else:
+                _, texture = self._textures.popitem(last=False)
+                self.evictions += 1
+        self._textures[key] = texture
+        self._textures.move_to_end(key)
+        dpg.set_value(texture, data)
+        return texture
+
+    def __contains__(self, key: str):
+        return key in self._textures
+
+    def __len__(self):
+        return len(self._textures)
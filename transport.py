@@ -0,0 +1,460 @@
+import time
+import asyncio
+import threading
+import weakref
+import importlib.util
+from functools import partial
+import httpx
+
+from metrics import METRICS
+from ratelimit import AdaptiveLimit, is_throttled, parse_retry_after
+
+# HTTP/2 needs the optional h2 package (pip install httpx[http2]), fall back to HTTP/1.1 without it
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+TRANSPORT_SETTINGS = {
+    "http2": True,
+    "max_connections": 64,
+    "max_keepalive_connections": 32,
+    "keepalive_expiry": 30.0,
+    # Per-host limits adapt between these bounds, see ratelimit.AdaptiveLimit
+    "initial_connections_per_host": 4,
+    "max_connections_per_host": 8,
+    "requests_per_second_per_host": 20.0,
+    "max_requests_per_second_per_host": 200.0,
+    "timeout": 30.0,
+    # Threads hedged mirror requests race on (mirrors.open_first), at least one per request in flight
+    "hedge_workers": 32,
+}
+
+
+class _ReleasingStream(httpx.SyncByteStream):
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            release, self._release = self._release, None
+            if release:
+                release()
+
+
+class _AsyncReleasingStream(httpx.AsyncByteStream):
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            release, self._release = self._release, None
+            if release:
+                await release()
+
+
+# Every host-limited transport, for host_limits()
+_LIMITED_TRANSPORTS = weakref.WeakSet()
+
+
+def _new_host_limit():
+    settings = TRANSPORT_SETTINGS
+    return AdaptiveLimit(concurrency=settings["initial_connections_per_host"],
+                         max_concurrency=settings["max_connections_per_host"],
+                         rate=settings["requests_per_second_per_host"],
+                         max_rate=settings["max_requests_per_second_per_host"])
+
+
+def _feedback(limit: AdaptiveLimit, epoch: int, host: str, *, response: httpx.Response = None,
+              error: Exception = None):
+    """
+    Reports the outcome of a request to its host's limit and publishes the new limits. Callers hold the lock.
+    """
+    throttled = isinstance(error, httpx.TimeoutException) or (response is not None and is_throttled(response.status_code))
+    retry_after = parse_retry_after(response.headers.get("Retry-After")) if throttled and response is not None else None
+    limit.feedback(epoch, throttled=throttled, retry_after=retry_after)
+    if throttled:
+        METRICS.inc("http_throttled_total", host=host,
+                    status=response.status_code if response is not None else type(error).__name__)
+    METRICS.set("host_concurrency_limit", limit.snapshot()["concurrency"], host=host)
+    METRICS.set("host_rate_limit", limit.rate, host=host)
+
+
+class HostLimitedTransport(httpx.BaseTransport):
+    """
+    Wraps a transport with an adaptive per-host budget (ratelimit.AdaptiveLimit): a token bucket for the
+    request rate and an AIMD concurrency limit, both backing off on 429, 5xx and timeouts and waiting
+    out Retry-After. A concurrency slot is held until the response body is closed; with HTTP/1.1 this is
+    the number of connections per host, with HTTP/2 the number of concurrent streams on the shared
+    connection.
+    """
+
+    def __init__(self, transport: httpx.BaseTransport):
+        self._transport = transport
+        self._limits = {}
+        self._condition = threading.Condition()
+        _LIMITED_TRANSPORTS.add(self)
+
+    def _acquire(self, host: str):
+        with self._condition:
+            limit = self._limits.get(host)
+            if limit is None:
+                limit = self._limits[host] = _new_host_limit()
+            while True:
+                epoch, wait = limit.try_acquire()
+                if epoch is not None:
+                    return limit, epoch
+                self._condition.wait(wait)
+
+    def _release(self, limit: AdaptiveLimit):
+        with self._condition:
+            limit.release()
+            self._condition.notify_all()
+
+    def handle_request(self, request: httpx.Request):
+        host = request.url.host
+        limit, epoch = self._acquire(host)
+        try:
+            response = self._transport.handle_request(request)
+        except Exception as err:
+            with self._condition:
+                _feedback(limit, epoch, host, error=err)
+            self._release(limit)
+            raise
+        except BaseException:
+            # Interrupted, not answered: this says nothing about the host, only free the slot
+            self._release(limit)
+            raise
+        with self._condition:
+            _feedback(limit, epoch, host, response=response)
+        response.stream = _ReleasingStream(response.stream, partial(self._release, limit))
+        return response
+
+    def limits(self):
+        with self._condition:
+            return {host: limit.snapshot() for host, limit in self._limits.items()}
+
+    def close(self):
+        self._transport.close()
+
+
+class AsyncHostLimitedTransport(httpx.AsyncBaseTransport):
+    """
+    asyncio counterpart of HostLimitedTransport.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+        self._limits = {}
+        self._condition = None
+        _LIMITED_TRANSPORTS.add(self)
+
+    async def _acquire(self, host: str):
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            limit = self._limits.get(host)
+            if limit is None:
+                limit = self._limits[host] = _new_host_limit()
+            while True:
+                epoch, wait = limit.try_acquire()
+                if epoch is not None:
+                    return limit, epoch
+                try:
+                    await asyncio.wait_for(self._condition.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _release(self, limit: AdaptiveLimit):
+        async with self._condition:
+            limit.release()
+            self._condition.notify_all()
+
+    async def handle_async_request(self, request: httpx.Request):
+        host = request.url.host
+        limit, epoch = await self._acquire(host)
+        try:
+            response = await self._transport.handle_async_request(request)
+        except Exception as err:
+            _feedback(limit, epoch, host, error=err)
+            await self._release(limit)
+            raise
+        except BaseException:
+            # Cancelled (e.g. the losing request of a mirror race) or interrupted: only free the slot
+            await self._release(limit)
+            raise
+        _feedback(limit, epoch, host, response=response)
+        response.stream = _AsyncReleasingStream(response.stream, partial(self._release, limit))
+        return response
+
+    def limits(self):
+        return {host: limit.snapshot() for host, limit in self._limits.items()}
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+class _RequestTimer:
+    """
+    Times one request from the httpcore trace events and records it into METRICS once its body is closed.
+
+    Connect time is only known for requests that opened a new connection; TTFB runs from the moment the
+    request reached the transport to the end of the response headers.
+    """
+
+    def __init__(self, request: httpx.Request):
+        self.host = request.url.host
+        self.method = request.method
+        self.status = None
+        self.started = time.perf_counter()
+        self.connect_started = None
+        self.connect_seconds = None
+        self.ttfb = None
+        self.received = 0
+        self._trace = request.extensions.get("trace")
+        self._finished = False
+
+    def _event(self, name: str):
+        now = time.perf_counter()
+        if name == "connection.connect_tcp.started":
+            self.connect_started = now
+        elif name in ("connection.connect_tcp.complete", "connection.start_tls.complete") and self.connect_started:
+            self.connect_seconds = now - self.connect_started
+        elif name.endswith(".receive_response_headers.complete"):
+            self.ttfb = now - self.started
+
+    def trace(self, name: str, info: dict):
+        self._event(name)
+        if self._trace:
+            self._trace(name, info)
+
+    async def atrace(self, name: str, info: dict):
+        self._event(name)
+        if self._trace:
+            await self._trace(name, info)
+
+    def headers_received(self, response: httpx.Response):
+        if self.ttfb is None:
+            self.ttfb = time.perf_counter() - self.started
+        self.status = response.status_code
+
+    def failed(self, err: Exception):
+        METRICS.inc("http_errors_total", host=self.host, error=type(err).__name__)
+
+    def finished(self):
+        if self._finished:
+            return
+        self._finished = True
+        total = time.perf_counter() - self.started
+        METRICS.inc("http_requests_total", host=self.host, method=self.method, status=self.status)
+        METRICS.observe("http_request_seconds", total, host=self.host)
+        METRICS.observe("http_ttfb_seconds", self.ttfb, host=self.host)
+        if self.connect_seconds is not None:
+            METRICS.inc("http_connections_opened_total", host=self.host)
+            METRICS.observe("http_connect_seconds", self.connect_seconds, host=self.host)
+        METRICS.inc("http_received_bytes_total", self.received, host=self.host)
+        METRICS.observe("http_response_bytes", self.received, host=self.host)
+        if self.received and total > self.ttfb:
+            METRICS.observe("http_throughput_bytes_per_second", self.received / (total - self.ttfb), host=self.host)
+
+
+class _MeteredStream(httpx.SyncByteStream):
+    def __init__(self, stream, timer: _RequestTimer):
+        self._stream = stream
+        self._timer = timer
+
+    def __iter__(self):
+        try:
+            for chunk in self._stream:
+                self._timer.received += len(chunk)
+                yield chunk
+        except Exception as err:
+            self._timer.failed(err)
+            raise
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._timer.finished()
+
+
+class _AsyncMeteredStream(httpx.AsyncByteStream):
+    def __init__(self, stream, timer: _RequestTimer):
+        self._stream = stream
+        self._timer = timer
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._stream:
+                self._timer.received += len(chunk)
+                yield chunk
+        except Exception as err:
+            self._timer.failed(err)
+            raise
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            self._timer.finished()
+
+
+class MetricsTransport(httpx.BaseTransport):
+    """
+    Wraps a transport to record connect time, TTFB, total time, bytes and throughput of every request,
+    per host, into METRICS.
+    """
+
+    def __init__(self, transport: httpx.BaseTransport):
+        self._transport = transport
+
+    def handle_request(self, request: httpx.Request):
+        timer = _RequestTimer(request)
+        request.extensions["trace"] = timer.trace
+        try:
+            response = self._transport.handle_request(request)
+        except Exception as err:
+            timer.failed(err)
+            raise
+        timer.headers_received(response)
+        response.stream = _MeteredStream(response.stream, timer)
+        return response
+
+    def close(self):
+        self._transport.close()
+
+
+class AsyncMetricsTransport(httpx.AsyncBaseTransport):
+    """
+    asyncio counterpart of MetricsTransport.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+
+    async def handle_async_request(self, request: httpx.Request):
+        timer = _RequestTimer(request)
+        request.extensions["trace"] = timer.atrace
+        try:
+            response = await self._transport.handle_async_request(request)
+        except Exception as err:
+            timer.failed(err)
+            raise
+        timer.headers_received(response)
+        response.stream = _AsyncMeteredStream(response.stream, timer)
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+def configure(**settings):
+    """
+    Updates TRANSPORT_SETTINGS. Only clients created afterwards pick up the new values, so call this
+    before the first request.
+    """
+    unknown = set(settings) - set(TRANSPORT_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown transport settings: {', '.join(sorted(unknown))}")
+    TRANSPORT_SETTINGS.update(settings)
+
+
+def client_options():
+    """
+    Keyword arguments for httpx.HTTPTransport / httpx.AsyncHTTPTransport from TRANSPORT_SETTINGS.
+    """
+    settings = TRANSPORT_SETTINGS
+    return {
+        "http2": settings["http2"] and HTTP2_AVAILABLE,
+        "limits": httpx.Limits(
+            max_connections=settings["max_connections"],
+            max_keepalive_connections=settings["max_keepalive_connections"],
+            keepalive_expiry=settings["keepalive_expiry"],
+        ),
+    }
+
+
+def create_transport(transport: httpx.BaseTransport = None):
+    """
+    Builds the transport of the shared client: `transport`, by default a pooled httpx.HTTPTransport set up
+    from TRANSPORT_SETTINGS, with request metrics and behind the per-host limit.
+    """
+    transport = MetricsTransport(transport or httpx.HTTPTransport(**client_options()))
+    return HostLimitedTransport(transport)
+
+
+def create_async_transport(transport: httpx.AsyncBaseTransport = None):
+    """
+    asyncio counterpart of create_transport.
+    """
+    transport = AsyncMetricsTransport(transport or httpx.AsyncHTTPTransport(**client_options()))
+    return AsyncHostLimitedTransport(transport)
+
+
+_client = None
+_client_lock = threading.Lock()
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_client():
+    """
+    Returns the app-wide httpx.Client, creating it on first use. Safe to share between threads.
+    """
+    global _client
+    with _client_lock:
+        if _client is None or _client.is_closed:
+            _client = httpx.Client(transport=create_transport(), timeout=TRANSPORT_SETTINGS["timeout"])
+        return _client
+
+
+def host_limits():
+    """
+    Returns the current adaptive limits of every host, merged over the live host-limited transports.
+
+    Returns:
+        dict: {host: {concurrency, in_flight, rate, blocked_for, throttled}}, hosts of asyncio clients
+        listed as "<host> (async)".
+    """
+    limits = {}
+    for transport in list(_LIMITED_TRANSPORTS):
+        suffix = " (async)" if isinstance(transport, AsyncHostLimitedTransport) else ""
+        for host, snapshot in transport.limits().items():
+            limits[host + suffix] = snapshot
+    return limits
+
+
+def get_async_client():
+    """
+    Returns the httpx.AsyncClient of the running event loop, creating it on first use.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(transport=create_async_transport(), timeout=TRANSPORT_SETTINGS["timeout"])
+        _async_clients[loop] = client
+    return client
+
+
+def close_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+async def aclose_async_client():
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
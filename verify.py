@@ -0,0 +1,237 @@
+import os
+import time
+import sqlite3
+import zipfile
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from config import Config
+from jobs import JobQueue
+from metrics import METRICS
+from store import hash_file
+
+MANIFEST_FILE = ".verify.db"
+
+
+def check_zip(path: str):
+    """
+    Reads a pack zip in full: its SHA-256, and the CRC of every member through zipfile.testzip.
+
+    Returns:
+        dict: path, ok, size, sha256 and error (None, or why the zip is unusable).
+    """
+    result = {"path": path, "ok": False, "size": None, "sha256": None, "error": None}
+    try:
+        result["size"] = os.path.getsize(path)
+        result["sha256"] = hash_file(path)
+        with zipfile.ZipFile(path) as zip_ref:
+            bad_member = zip_ref.testzip()
+    except (zipfile.BadZipFile, OSError, EOFError) as err:
+        result["error"] = str(err) or type(err).__name__
+        return result
+    if bad_member is not None:
+        result["error"] = f"CRC mismatch in {bad_member}"
+        return result
+    result["ok"] = True
+    return result
+
+
+class PackManifest:
+    """
+    SQLite record of the pack zips of an output folder that passed check_zip, with their size, mtime and
+    SHA-256 at that time.
+
+    A pack whose size and mtime still match its record is taken as valid without being read, which makes
+    the check before every download nearly free; anything else is read and checked again. scan() reads
+    every pack regardless and also compares the hash, to catch files that changed in place.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def _connect(self):
+        """
+        Opens the database on first use. Callers hold self._lock.
+        """
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=30.0, check_same_thread=False)
+            self._connection.row_factory = sqlite3.Row
+            with self._connection:
+                self._connection.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS packs (
+                        name TEXT PRIMARY KEY,
+                        size INTEGER NOT NULL,
+                        mtime_ns INTEGER NOT NULL,
+                        sha256 TEXT NOT NULL,
+                        verified_at REAL NOT NULL
+                    )
+                    """
+                )
+        return self._connection
+
+    def lookup(self, filename: str):
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT * FROM packs WHERE name = ?", (os.path.basename(filename),)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def record(self, filename: str, sha256: str = None):
+        """
+        Records `filename` as a valid pack as it is on disk now, hashing it unless `sha256` is given.
+        """
+        stat = os.stat(filename)
+        sha256 = sha256 or hash_file(filename)
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO packs VALUES (?, ?, ?, ?, ?)",
+                    (os.path.basename(filename), stat.st_size, stat.st_mtime_ns, sha256, time.time()),
+                )
+
+    def forget(self, filename: str):
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute("DELETE FROM packs WHERE name = ?", (os.path.basename(filename),))
+
+    def is_valid(self, filename: str):
+        """
+        Tells whether `filename` is a complete pack zip, reading it only when it changed since it was last
+        recorded as valid. A pack that passes the full check is recorded, one that fails is forgotten.
+        """
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return False
+        record = self.lookup(filename)
+        if record and (record["size"], record["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns):
+            METRICS.inc("pack_verifications_total", result="unchanged")
+            return True
+        result = check_zip(filename)
+        METRICS.inc("pack_verifications_total", result="valid" if result["ok"] else "corrupt")
+        if result["ok"]:
+            self.record(filename, result["sha256"])
+        elif record:
+            self.forget(filename)
+        return result["ok"]
+
+    def scan(self, paths, *, workers: int = 4, on_result=None):
+        """
+        Checks every pack in `paths` in full on a pool of `workers` threads (hashing and CRC checks release
+        the GIL), comparing each hash with the recorded one.
+
+        Args:
+            paths (list): Pack zip paths.
+            on_result (callable, optional): Called with each result dict as soon as its pack is checked.
+
+        Returns:
+            list: One check_zip() result dict per path, in input order, with "changed" set when a pack that
+            was recorded as valid no longer has its recorded hash.
+        """
+        def _check(path):
+            record = self.lookup(path)
+            result = check_zip(path)
+            result["changed"] = bool(record and result["sha256"] and result["sha256"] != record["sha256"])
+            if result["ok"]:
+                self.record(path, result["sha256"])
+            elif record:
+                self.forget(path)
+            METRICS.inc("pack_verifications_total", result="valid" if result["ok"] else "corrupt")
+            if on_result:
+                on_result(result)
+            return result
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            return list(executor.map(_check, paths))
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+def iter_pack_files(folder: str):
+    """
+    Yields the downloaded pack zips of an output folder, `<sticker id>_<platform>_<pack file>.zip`. Other
+    zips are not the downloader's and are left alone.
+    """
+    if not os.path.isdir(folder):
+        return
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        if name.endswith(".zip") and sticker_id_of(name) and os.path.isfile(path):
+            yield path
+
+
+def sticker_id_of(path: str):
+    """
+    Returns the sticker ID a pack zip was saved under, or None for files not named by the downloader.
+    """
+    sticker_id, _, rest = os.path.basename(path).partition("_")
+    platform, _, pack_file = rest.partition("_")
+    if sticker_id.isdigit() and platform in Config.PLATFORM_LIST and pack_file in Config.TYPES_STICKER.values():
+        return sticker_id
+    return None
+
+
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+
+def manifest_for(output_dir: str = "output"):
+    """
+    Returns the PackManifest of `output_dir`, kept inside it as MANIFEST_FILE.
+    """
+    path = os.path.abspath(os.path.join(output_dir, MANIFEST_FILE))
+    with _manifests_lock:
+        if path not in _manifests:
+            _manifests[path] = PackManifest(path)
+        return _manifests[path]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check every downloaded pack zip of an output folder.")
+    parser.add_argument("-o", "--output", default="output", help="Output folder")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 4, help="Packs checked at a time")
+    parser.add_argument("-q", "--queue", metavar="DB",
+                        help="Put the sticker IDs of corrupt packs back in this job queue (see batch.py --queue)")
+    parser.add_argument("--delete", action="store_true",
+                        help="Delete corrupt packs. Without it the scan only reports; the downloader replaces "
+                             "corrupt packs by itself either way")
+    args = parser.parse_args(argv)
+
+    manifest = manifest_for(args.output)
+
+    def _on_result(result):
+        if not result["ok"]:
+            print(f"Corrupt: {result['path']}: {result['error']}")
+        elif result["changed"]:
+            print(f"Changed since last check, still valid: {result['path']}")
+
+    results = manifest.scan(list(iter_pack_files(args.output)), workers=args.workers, on_result=_on_result)
+    corrupt = [result["path"] for result in results if not result["ok"]]
+    if args.delete:
+        for path in corrupt:
+            os.remove(path)
+    print(f"Checked {len(results)} packs, {len(results) - len(corrupt)} valid, {len(corrupt)} corrupt"
+          + (", deleted" if args.delete and corrupt else ""))
+
+    if args.queue and corrupt:
+        queue = JobQueue(args.queue)
+        sticker_ids = [sticker_id for sticker_id in map(sticker_id_of, corrupt) if sticker_id]
+        print(f"Queued {queue.submit(sticker_ids, redo=True)} sticker IDs again in {args.queue}")
+        queue.close()
+    manifest.close()
+    return 1 if corrupt else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())